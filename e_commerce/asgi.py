@@ -3,6 +3,9 @@ ASGI config for e_commerce project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it (e.g. ``uvicorn e_commerce.asgi:application``) for the server-sent events of
+``/websec/products/stock-stream/``; the WSGI app answers that endpoint with 501.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
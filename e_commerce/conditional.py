@@ -0,0 +1,49 @@
+"""
+Conditional GET for DRF handlers.
+
+``@conditional(validators)`` calls ``validators(view, request, *args, **kwargs)`` before
+the handler. It returns ``(etag, last_modified)`` from cheap columns/counters, or ``None``
+to skip the check. A matching ``If-None-Match`` / ``If-Modified-Since`` gets a 304
+without running the handler's queries and serializers.
+"""
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+def version_tag(*parts):
+    """Weak ETag from ints/datetimes/strings, e.g. ``version_tag("cart", 7, cart.updated_at)``."""
+    return 'W/"%s"' % "-".join(
+        str(int(p.timestamp() * 1_000_000)) if hasattr(p, "timestamp") else str(p) for p in parts
+    )
+
+
+def conditional(validators, private=False):
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return handler(self, request, *args, **kwargs)
+            values = validators(self, request, *args, **kwargs)
+            if values is None:
+                return handler(self, request, *args, **kwargs)
+
+            etag, last_modified = values
+            etag = quote_etag(etag) if etag else None
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = handler(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            if etag:
+                response.headers["ETag"] = etag
+            if timestamp is not None:
+                response.headers["Last-Modified"] = http_date(timestamp)
+            if private:
+                # Ответ зависит от пользователя: общие кэши/CDN хранить не должны
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
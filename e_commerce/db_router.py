@@ -0,0 +1,88 @@
+"""
+Primary/replica routing for catalog reads.
+
+``ReplicaRoutingMiddleware`` marks GET/HEAD/OPTIONS requests as replica-eligible;
+``PrimaryReplicaRouter`` then sends reads of the catalog models to one of
+``DATABASE_REPLICAS``. Everything else goes to ``default`` (the primary):
+writes, ``select_for_update`` (Django routes it through ``db_for_write``),
+management commands and any request that has already written something.
+After a write the client also gets a short-lived cookie so that its next
+requests read its own writes from the primary despite replication lag.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+PRIMARY = "default"
+PIN_COOKIE = "db_primary"
+DEFAULT_REPLICA_MODELS = (
+    "shop.brand", "shop.category", "shop.product", "shop.productimage", "shop.productrecommendation",
+)
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class RoutingState:
+    __slots__ = ("use_replica", "pinned")
+
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.pinned = False
+
+
+_state = ContextVar("db_routing_state", default=None)
+
+
+def replicas():
+    return [alias for alias in getattr(settings, "DATABASE_REPLICAS", ()) if alias in settings.DATABASES]
+
+
+def pin_to_primary():
+    """Sends the rest of the current request to the primary."""
+    state = _state.get()
+    if state is not None:
+        state.pinned = True
+
+
+class PrimaryReplicaRouter:
+    def _replica_models(self):
+        return getattr(settings, "DATABASE_REPLICA_MODELS", DEFAULT_REPLICA_MODELS)
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.pinned:
+            return PRIMARY
+        if model._meta.label_lower not in self._replica_models():
+            return PRIMARY
+        aliases = replicas()
+        return random.choice(aliases) if aliases else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии primary, объекты из них можно связывать между собой
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, "DATABASE_REPLICA_PIN_SECONDS", 5)
+
+    def __call__(self, request):
+        state = RoutingState(
+            use_replica=request.method in SAFE_METHODS and PIN_COOKIE not in request.COOKIES,
+        )
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if state.pinned and self.pin_seconds and replicas():
+            response.set_cookie(PIN_COOKIE, "1", max_age=self.pin_seconds, httponly=True, samesite="Lax")
+        return response
@@ -0,0 +1,197 @@
+"""
+Sparse fieldsets for DRF serializers: ``?fields=`` and ``?expand=``.
+
+``?fields=id,name,brand.name`` keeps only the listed fields; dotted names select
+fields of nested serializers. ``?expand=brand,items.product`` lists the nested
+serializers rendered as objects; once ``expand`` is given, every other nested
+relation is rendered as its primary key (a list of keys for ``many=True``).
+Without the parameters the payload is unchanged.
+
+Serializers opt in with ``SparseFieldsetMixin``; the parsed ``Fieldset`` is passed
+as ``context["fieldset"]``. ``shape_queryset()`` derives ``only()``,
+``select_related()`` and ``prefetch_related()`` from the pruned serializer, so
+unrequested columns and relations are not loaded at all.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = "fields"
+EXPAND_PARAM = "expand"
+
+
+class Fieldset:
+    def __init__(self, path="", expand_given=False):
+        self.path = path
+        self.only = None  # None — все поля
+        self.expand = set() if expand_given else None  # None — все вложенные развёрнуты
+        self.children = {}
+        self._expand_given = expand_given
+
+    def child(self, name):
+        if name not in self.children:
+            self.children[name] = Fieldset(f"{self.path}{name}.", self._expand_given)
+        return self.children[name]
+
+    def is_expanded(self, name):
+        if self.expand is None or name in self.expand:
+            return True
+        # brand.name в fields подразумевает развёрнутый brand
+        child = self.children.get(name)
+        return child is not None and child.only is not None
+
+    @classmethod
+    def parse(cls, fields=None, expand=None):
+        root = cls(expand_given=expand is not None)
+        for path in _split(fields):
+            *parents, name = path.split(".")
+            node = root
+            for part in parents:
+                node.only = (node.only or set()) | {part}
+                node = node.child(part)
+            node.only = (node.only or set()) | {name}
+        for path in _split(expand):
+            node = root
+            for part in path.split("."):
+                node.expand.add(part)
+                node = node.child(part)
+        return root
+
+    @classmethod
+    def from_request(cls, request):
+        """``None`` when the request asks for the full payload."""
+        params = request.query_params
+        if FIELDS_PARAM not in params and EXPAND_PARAM not in params:
+            return None
+        return cls.parse(params.get(FIELDS_PARAM), params.get(EXPAND_PARAM))
+
+
+def _split(value):
+    return [part.strip() for part in (value or "").split(",") if part.strip()]
+
+
+def fieldset_key(request):
+    """Normalized (fields, expand) — a hashable cache key for the requested shape."""
+    params = request.query_params
+    if FIELDS_PARAM not in params and EXPAND_PARAM not in params:
+        return None
+    expand = params.get(EXPAND_PARAM)
+    return (
+        ",".join(sorted(set(_split(params.get(FIELDS_PARAM))))) or None,
+        ",".join(sorted(set(_split(expand)))) if expand is not None else None,
+    )
+
+
+class SparseFieldsetMixin:
+    """Prunes ``get_fields()`` to ``context["fieldset"]``; write-only fields are kept for input."""
+
+    def _get_fieldset(self):
+        if hasattr(self, "_fieldset"):
+            return self._fieldset
+        parent = self.parent
+        if parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None):
+            return self.context.get("fieldset")
+        return None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self._get_fieldset()
+        if fieldset is None:
+            return fields
+
+        readable = {name for name, field in fields.items() if not field.write_only}
+        unknown = (fieldset.only or set()) - readable
+        if unknown:
+            raise ValidationError({FIELDS_PARAM: [f"Неизвестное поле: {fieldset.path}{n}" for n in sorted(unknown)]})
+        nested = {name for name in readable if isinstance(fields[name], serializers.BaseSerializer)}
+        unknown = (fieldset.expand or set()) - nested
+        if unknown:
+            raise ValidationError({EXPAND_PARAM: [f"Нельзя развернуть: {fieldset.path}{n}" for n in sorted(unknown)]})
+
+        for name in readable:
+            if fieldset.only is not None and name not in fieldset.only:
+                del fields[name]
+            elif name in nested:
+                fields[name] = _expanded(fields[name], name, fieldset)
+        return fields
+
+
+def _expanded(field, name, fieldset):
+    many = isinstance(field, serializers.ListSerializer)
+    if fieldset.is_expanded(name):
+        (field.child if many else field)._fieldset = fieldset.child(name)
+        return field
+    source = field.source or name
+    kwargs = {"source": source} if source != name else {}
+    return serializers.PrimaryKeyRelatedField(read_only=True, many=many, **kwargs)
+
+
+def _relations(model):
+    # Обратные связи ищем по имени аксессора (productimage_set), get_field его не знает
+    return {rel.get_accessor_name(): rel for rel in model._meta.related_objects}
+
+
+def _walk(serializer, model, prefix, columns, select, prefetch):
+    relations = _relations(model)
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        source = field.source.split(".")[0]
+        many = isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField))
+        if source in relations and many:
+            rel = relations[source]
+            queryset = rel.related_model._default_manager.order_by("pk")
+            if isinstance(field, serializers.ListSerializer):
+                queryset = shape_queryset(queryset, field.child, extra=_parent_fk(rel))
+            else:
+                queryset = queryset.only("pk", *_parent_fk(rel))
+            prefetch.append(Prefetch(f"{prefix}{source}", queryset=queryset))
+            continue
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            model_field = None
+        if field.source == "*" or model_field is None or not model_field.concrete or "." in field.source:
+            # Свойство/метод модели: неизвестно, какие колонки нужны — грузим модель целиком
+            columns.extend(f"{prefix}{f.name}" for f in model._meta.concrete_fields)
+            continue
+        columns.append(f"{prefix}{source}")
+        if model_field.is_relation and isinstance(field, serializers.BaseSerializer):
+            select.append(f"{prefix}{source}")
+            _walk(field, model_field.related_model, f"{prefix}{source}__", columns, select, prefetch)
+
+
+def _parent_fk(rel):
+    return (rel.field.name,) if rel.one_to_many else ()
+
+
+def shape_queryset(queryset, serializer, extra=()):
+    """``queryset`` restricted to what ``serializer`` (already pruned) renders; ``extra`` columns are always loaded."""
+    columns, select, prefetch = [], [], []
+    _walk(serializer, queryset.model, "", columns, select, prefetch)
+    queryset = queryset.only("pk", *dict.fromkeys([*columns, *extra]))
+    if select:
+        queryset = queryset.select_related(*select)
+    return queryset.prefetch_related(*prefetch)
+
+
+def prefetch_lookups(serializer):
+    """``prefetch_related_objects()`` lookups for instances of ``serializer``'s model that are already loaded."""
+    columns, select, prefetch = [], [], []
+    _walk(serializer, serializer.Meta.model, "", columns, select, prefetch)
+    return [*select, *prefetch]
+
+
+class SparseFieldsetViewMixin:
+    """Hands ``?fields=``/``?expand=`` of GET requests to the serializers as ``context["fieldset"]``."""
+
+    def get_fieldset(self):
+        if self.request is None or self.request.method not in ("GET", "HEAD"):
+            return None
+        if not hasattr(self, "_fieldset"):
+            self._fieldset = Fieldset.from_request(self.request)
+        return self._fieldset
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), "fieldset": self.get_fieldset()}
@@ -0,0 +1,287 @@
+"""
+Per-request instrumentation: SQL count/time, serializer and render time.
+
+Timings are sent back in a ``Server-Timing`` header and aggregated into
+in-process histograms, exported in Prometheus text format by ``metrics_view``.
+Views may declare a query budget (``max_queries``) that is checked here too.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.renderers import JSONRenderer
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_current = ContextVar("request_metrics", default=None)
+logger = logging.getLogger("e_commerce.query_budget")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestMetrics:
+    __slots__ = (
+        "queries", "sql_time", "serialize_time", "render_time", "serializer_depth",
+        "budget", "captured",
+    )
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+        self.serializer_depth = 0
+        self.budget = None
+        # (call site, sql) — собираем только когда у вьюхи есть бюджет и проверка включена
+        self.captured = None
+
+
+def current_metrics():
+    return _current.get()
+
+
+def _query_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_time += time.perf_counter() - start
+        metrics.queries += 1
+        if metrics.captured is not None:
+            metrics.captured.append((_call_site(), sql))
+
+
+_SKIP_DIRS = ("site-packages", "dist-packages", os.path.dirname(os.__file__))
+
+
+def _call_site():
+    base_dir = str(settings.BASE_DIR)
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base_dir) and filename != __file__ and not any(d in filename for d in _SKIP_DIRS):
+            return f"{os.path.relpath(filename, base_dir)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "<framework>"
+
+
+def query_budget(max_queries):
+    """Decorator for a view function, APIView handler or viewset action."""
+    def decorator(func):
+        func.max_queries = max_queries
+        return func
+    return decorator
+
+
+def resolve_query_budget(view_func, method):
+    """
+    Budget for a resolved view: ``@query_budget`` on the handler/action first,
+    then ``max_queries`` on the class (an int, or a dict keyed by action/handler name).
+    """
+    cls = getattr(view_func, "cls", None) or getattr(view_func, "view_class", None)
+    if cls is None:
+        return getattr(view_func, "max_queries", None)
+    actions = getattr(view_func, "actions", None)
+    name = actions.get(method.lower()) if actions else method.lower()
+    if name is None:
+        return None
+    budget = getattr(getattr(cls, name, None), "max_queries", None)
+    if budget is None:
+        budget = getattr(cls, "max_queries", None)
+        if isinstance(budget, dict):
+            budget = budget.get(name)
+    return budget
+
+
+def format_budget_report(request, metrics):
+    grouped = Counter(metrics.captured or ())
+    lines = [f"{request.method} {request.path}: {metrics.queries} queries, budget {metrics.budget}"]
+    for (site, sql), count in grouped.most_common():
+        prefix = f"{count}x" if count > 1 else "  "
+        lines.append(f"  {prefix} {site}: {sql[:300]}")
+    return "\n".join(lines)
+
+
+@contextmanager
+def timed(section):
+    """Adds the wall time of the block, minus SQL executed inside it, to ``<section>_time``."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start, sql_start = time.perf_counter(), metrics.sql_time
+    try:
+        yield
+    finally:
+        spent = time.perf_counter() - start - (metrics.sql_time - sql_start)
+        setattr(metrics, f"{section}_time", getattr(metrics, f"{section}_time") + spent)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+
+
+class MetricsRegistry:
+    METRICS = {
+        "request_duration_seconds": ("Total request time", DURATION_BUCKETS),
+        "db_duration_seconds": ("Time spent in SQL", DURATION_BUCKETS),
+        "serialize_duration_seconds": ("Time spent in DRF serializers, SQL excluded", DURATION_BUCKETS),
+        "render_duration_seconds": ("Time spent rendering the response body", DURATION_BUCKETS),
+        "db_queries": ("SQL queries per request", QUERY_BUCKETS),
+    }
+
+    def __init__(self, prefix="shop_http"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def observe(self, labels, values):
+        with self._lock:
+            series = self._data.get(labels)
+            if series is None:
+                series = self._data[labels] = {
+                    name: Histogram(buckets) for name, (_, buckets) in self.METRICS.items()
+                }
+            for name, value in values.items():
+                series[name].observe(value)
+
+    def render(self):
+        with self._lock:
+            snapshot = {
+                labels: {name: (list(h.counts), h.total) for name, h in series.items()}
+                for labels, series in self._data.items()
+            }
+
+        lines = []
+        for name, (help_text, buckets) in self.METRICS.items():
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for (view, method), series in sorted(snapshot.items()):
+                counts, total = series[name]
+                label = f'view="{_escape(view)}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{metric}_bucket{{{label},le="{le}"}} {cumulative}')
+                lines.append(f"{metric}_sum{{{label}}} {total}")
+                lines.append(f"{metric}_count{{{label}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is None or not getattr(settings, "QUERY_BUDGET_ENABLED", False):
+            return None
+        metrics.budget = resolve_query_budget(view_func, request.method)
+        if metrics.budget is not None:
+            metrics.captured = []
+        return None
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_query_wrapper))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        view = match.route if match is not None else "unresolved"
+        registry.observe(
+            (view, request.method),
+            {
+                "request_duration_seconds": total,
+                "db_duration_seconds": metrics.sql_time,
+                "serialize_duration_seconds": metrics.serialize_time,
+                "render_duration_seconds": metrics.render_time,
+                "db_queries": metrics.queries,
+            },
+        )
+
+        if metrics.budget is not None and metrics.queries > metrics.budget:
+            report = format_budget_report(request, metrics)
+            if getattr(settings, "QUERY_BUDGET_MODE", "log") == "raise":
+                raise QueryBudgetExceeded(report)
+            logger.warning(report)
+
+        if getattr(settings, "INSTRUMENTATION_SERVER_TIMING", True):
+            response["Server-Timing"] = ", ".join([
+                f'db;dur={metrics.sql_time * 1000:.2f};desc="{metrics.queries} queries"',
+                f"serialize;dur={metrics.serialize_time * 1000:.2f}",
+                f"render;dur={metrics.render_time * 1000:.2f}",
+                f"total;dur={total * 1000:.2f}",
+            ])
+        return response
+
+
+class InstrumentedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed("render"):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class InstrumentedSerializerMixin:
+    """Times the outermost ``to_representation`` call; nested serializers are counted in the parent."""
+
+    def to_representation(self, instance):
+        metrics = _current.get()
+        if metrics is None or metrics.serializer_depth:
+            return super().to_representation(instance)
+        metrics.serializer_depth += 1
+        try:
+            with timed("serialize"):
+                return super().to_representation(instance)
+        finally:
+            metrics.serializer_depth -= 1
+
+
+def metrics_view(request):
+    allowed = getattr(settings, "METRICS_ALLOWED_IPS", ["127.0.0.1", "::1"])
+    # Только REMOTE_ADDR: X-Forwarded-For подделывается клиентом
+    if request.META.get("REMOTE_ADDR") not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
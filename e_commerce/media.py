@@ -0,0 +1,82 @@
+"""
+``MEDIA_URL`` serving.
+
+Content-addressed names (``<dir>/<2 hex>/<sha256>.<ext>``, see ``shop.storage``)
+never change their bytes, so they are sent with a one-year ``immutable``
+``Cache-Control``. ``MEDIA_SERVE_MODE`` picks who sends the bytes:
+
+- ``"django"`` — this process (``FileResponse``); the route exists only with ``DEBUG``;
+- ``"x-accel"`` — nginx: an empty response with ``X-Accel-Redirect`` to
+  ``MEDIA_ACCEL_PREFIX`` + path, an ``internal`` location aliased to ``MEDIA_ROOT``;
+- ``"x-sendfile"`` — Apache ``mod_xsendfile`` / lighttpd: ``X-Sendfile`` with the absolute path.
+
+Partial uploads under ``INCOMING_DIR`` are never served.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.urls import re_path
+from django.utils._os import safe_join
+
+SERVE_MODES = ("django", "x-accel", "x-sendfile")
+DEFAULT_ACCEL_PREFIX = "/protected-media/"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Временные файлы загрузок (shop.storage) до переименования в хеш
+INCOMING_DIR = ".incoming"
+
+CONTENT_ADDRESSED_NAME = re.compile(r"(?:^|/)([0-9a-f]{2})/(\1[0-9a-f]{62})(\.[0-9a-z]+)?$")
+
+
+def content_addressed_name(directory, digest, ext=""):
+    return posixpath.join(directory, digest[:2], f"{digest}{ext}")
+
+
+def is_content_addressed(name):
+    return bool(name) and CONTENT_ADDRESSED_NAME.search(name) is not None
+
+
+def serve_mode():
+    mode = getattr(settings, "MEDIA_SERVE_MODE", "django")
+    if mode not in SERVE_MODES:
+        raise ValueError(f"MEDIA_SERVE_MODE must be one of {', '.join(SERVE_MODES)}")
+    return mode
+
+
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    # Первый компонент уже нормализованного пути: product_images/../.incoming/x тоже сюда
+    relative = os.path.relpath(full_path, os.path.abspath(settings.MEDIA_ROOT))
+    if relative.split(os.sep, 1)[0] == INCOMING_DIR or not os.path.isfile(full_path):
+        raise Http404
+
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    mode = serve_mode()
+    if mode == "x-accel":
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, "MEDIA_ACCEL_PREFIX", DEFAULT_ACCEL_PREFIX)
+        response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(path)
+    elif mode == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = full_path
+    else:
+        response = FileResponse(open(full_path, "rb"), content_type=content_type)
+    if is_content_addressed(path):
+        response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def media_urlpatterns():
+    """The ``MEDIA_URL`` route: always behind X-Accel/X-Sendfile, only with ``DEBUG`` in ``"django"`` mode."""
+    if serve_mode() == "django" and not settings.DEBUG:
+        return []
+    prefix = re.escape(settings.MEDIA_URL.lstrip("/"))
+    return [re_path(rf"^{prefix}(?P<path>.+)$", serve_media, name="media")]
@@ -0,0 +1,72 @@
+"""
+Fast JSON rendering for responses that are already plain data.
+
+``FastJSONRenderer`` encodes with the function named by ``FAST_JSON_ENCODER``:
+``"auto"`` (orjson when installed, otherwise the stdlib), ``"orjson"``, ``"json"``
+or a dotted path to ``dumps(data) -> bytes``. Output is byte-identical to DRF's
+``JSONRenderer`` for dicts/lists of str/int/bool/None — views that pass anything
+else (Decimal, datetime, floats) should keep the default renderer.
+"""
+import json
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+from .instrumentation import InstrumentedJSONRenderer, timed
+
+_SEPARATORS = (",", ":") if api_settings.COMPACT_JSON else (", ", ": ")
+
+
+def _escape_separators(data):
+    # Как в JSONRenderer: U+2028/U+2029 валидны в JSON, но ломают JavaScript
+    return data.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+def stdlib_dumps(data):
+    text = json.dumps(
+        data, cls=encoders.JSONEncoder, ensure_ascii=not api_settings.UNICODE_JSON,
+        allow_nan=not api_settings.STRICT_JSON, separators=_SEPARATORS,
+    )
+    return text.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029").encode()
+
+
+def orjson_dumps(data):
+    import orjson  # опционально
+    return _escape_separators(orjson.dumps(data))
+
+
+@lru_cache(maxsize=None)
+def _resolve(name):
+    if name == "json":
+        return stdlib_dumps
+    if name == "orjson":
+        import orjson  # noqa: F401 — падаем сразу, если пакета нет
+        return orjson_dumps
+    if name == "auto":
+        try:
+            return _resolve("orjson")
+        except ImportError:
+            return stdlib_dumps
+    return import_string(name)
+
+
+def get_dumps():
+    name = getattr(settings, "FAST_JSON_ENCODER", "auto")
+    # orjson всегда компактный и не экранирует не-ASCII: иначе выходил бы другой байтовый поток
+    if name in ("auto", "orjson") and (not api_settings.COMPACT_JSON or not api_settings.UNICODE_JSON):
+        name = "json"
+    return _resolve(name)
+
+
+class FastJSONRenderer(InstrumentedJSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        with timed("render"):
+            return get_dumps()(data)
+
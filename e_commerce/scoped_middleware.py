@@ -0,0 +1,58 @@
+"""
+Route-aware middleware: the browser stack runs only where it is used.
+
+The ``Scoped*`` subclasses of Django's session, CSRF, authentication and messages
+middleware keep their place in ``MIDDLEWARE`` (so ordering against Common/Cors/axes
+and the admin system checks stay as with the stock classes), but do nothing for
+requests outside ``FULL_STACK_PATHS`` (admin, the CSRF cookie and login endpoints):
+no ``process_request`` / ``process_response`` / ``process_view``, so the JWT API gets
+no session lookup, no ``Vary: Cookie`` and no CSRF check. ``LEAN_API_MIDDLEWARE = False``
+runs them for every request, as before. Both settings are read per request.
+"""
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+
+DEFAULT_FULL_STACK_PATHS = ("/websec/admin/", "/websec/auth/csrf/", "/websec/auth/login/")
+
+
+def uses_full_stack(request):
+    scoped = getattr(request, "_full_stack", None)
+    if scoped is None:
+        # Считается один раз на запрос: все Scoped*-middleware решают одинаково
+        prefixes = tuple(getattr(settings, "FULL_STACK_PATHS", DEFAULT_FULL_STACK_PATHS))
+        scoped = not getattr(settings, "LEAN_API_MIDDLEWARE", True) or request.path_info.startswith(prefixes)
+        request._full_stack = scoped
+    return scoped
+
+
+class RouteScopedMixin:
+    """For ``MiddlewareMixin`` subclasses: outside ``FULL_STACK_PATHS`` the request goes straight on."""
+
+    def __call__(self, request):
+        if uses_full_stack(request):
+            return super().__call__(request)
+        # В async-режиме get_response — корутина, её и возвращаем
+        return self.get_response(request)
+
+
+class ScopedSessionMiddleware(RouteScopedMixin, SessionMiddleware):
+    pass
+
+
+class ScopedCsrfViewMiddleware(RouteScopedMixin, CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        # process_view BaseHandler вызывает сам, мимо __call__
+        if not uses_full_stack(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class ScopedAuthenticationMiddleware(RouteScopedMixin, AuthenticationMiddleware):
+    pass
+
+
+class ScopedMessageMiddleware(RouteScopedMixin, MessageMiddleware):
+    pass
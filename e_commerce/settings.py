@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from datetime import timedelta
 
@@ -50,18 +51,25 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    
+    'e_commerce.instrumentation.InstrumentationMiddleware',
+    'e_commerce.db_router.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # Scoped* — стандартные middleware, которые работают только для FULL_STACK_PATHS
+    'e_commerce.scoped_middleware.ScopedSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'e_commerce.scoped_middleware.ScopedCsrfViewMiddleware',
+    'e_commerce.scoped_middleware.ScopedAuthenticationMiddleware',
+    'e_commerce.scoped_middleware.ScopedMessageMiddleware',
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     "axes.middleware.AxesMiddleware"
 ]
 
+# API аутентифицируется JWT; сессии нужны админке, CSRF-cookie и логину (axes)
+FULL_STACK_PATHS = ["/websec/admin/", "/websec/auth/csrf/", "/websec/auth/login/"]
+# False — полный стек для всех запросов (как раньше)
+LEAN_API_MIDDLEWARE = True
+
 ROOT_URLCONF = 'e_commerce.urls'
 
 TEMPLATES = [
@@ -93,9 +101,39 @@ DATABASES = {
         'PASSWORD': '00000000',
         'HOST': 'localhost',
         'PORT': '5432',
-    }
+    },
+    # Реплика только для чтения (streaming replication), например:
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.postgresql_psycopg2',
+    #     'NAME': 'web_sec_project',
+    #     'USER': 'karim',
+    #     'PASSWORD': '00000000',
+    #     'HOST': 'replica.local',
+    #     'PORT': '5432',
+    # },
 }
 
+# Чтения каталога (Brand/Category/Product/ProductImage) в GET-запросах идут на реплики,
+# всё остальное и запросы после записи — на 'default'
+DATABASE_ROUTERS = ['e_commerce.db_router.PrimaryReplicaRouter']
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+# Сколько секунд после записи клиент читает с primary (запас на лаг репликации)
+DATABASE_REPLICA_PIN_SECONDS = 5
+
+# Кэш общий для всех воркеров: версия каталога, single-flight-блокировки и
+# stale-while-revalidate (shop.cache) работают только так. Нужен пакет redis;
+# для Memcached — 'django.core.cache.backends.memcached.PyMemcacheCache'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+        'KEY_PREFIX': 'e_commerce',
+    },
+}
+# Тесты и DEBUG — кэш в памяти процесса
+if DEBUG or sys.argv[1:2] == ['test']:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -143,6 +181,14 @@ LOCALE_PATHS = [
 
 MEDIA_URL = '/websec/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Загрузки хранятся один раз под хешем содержимого (shop.storage), URL не меняются
+STORAGES = {
+    "default": {"BACKEND": "shop.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+# "django" (только DEBUG), "x-accel" (nginx) или "x-sendfile" (Apache/lighttpd) — e_commerce.media
+MEDIA_SERVE_MODE = "django"
+MEDIA_ACCEL_PREFIX = "/protected-media/"
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -165,7 +211,7 @@ REST_FRAMEWORK = {
         "rest_framework.filters.OrderingFilter",
     ],
     "DEFAULT_RENDERER_CLASSES": [
-        "rest_framework.renderers.JSONRenderer",
+        "e_commerce.instrumentation.InstrumentedJSONRenderer",
     ],
 }
 
@@ -213,6 +259,14 @@ AXES_META_PRECEDENCE_ORDER = [
     "REMOTE_ADDR",
 ]
 
+# Instrumentation: Server-Timing headers + /websec/metrics/ (Prometheus text format)
+INSTRUMENTATION_SERVER_TIMING = True
+METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+
+# Query budgets (max_queries on views): "log" on staging, "raise" in tests
+QUERY_BUDGET_ENABLED = DEBUG
+QUERY_BUDGET_MODE = "log"
+
 RECAPTCHA_SECRET_KEY = "6LdrV0YsAAAAANDVcDt3ggVnIIQclyHsZJucjMuP"
 # if v3:
 RECAPTCHA_MIN_SCORE = 0.5
\ No newline at end of file
@@ -0,0 +1,65 @@
+# e_commerce/testing.py
+from django.test import override_settings
+from django.urls import reverse, resolve, NoReverseMatch
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .instrumentation import QueryBudgetExceeded, resolve_query_budget
+
+
+class QueryBudgetTestMixin:
+    """
+    Mixin for ``TestCase``: ``assertRouterQueryBudgets(router)`` issues a GET to every
+    list/detail route and every GET extra action of the router's viewsets that declares
+    ``max_queries`` and fails when a request issues more queries than that.
+
+    ``budget_user`` (if set) authenticates with a JWT, so the auth lookup counts too.
+    """
+
+    budget_user = None
+
+    def _budget_object_pk(self, viewset):
+        view = viewset()
+        view.action = "retrieve"
+        view.format_kwarg = None
+        view.kwargs = {}
+        request = Request(APIRequestFactory().get("/"))
+        request.user = self.budget_user
+        view.request = request
+        obj = view.get_queryset().first()
+        return obj.pk if obj is not None else None
+
+    def _budget_urls(self, router):
+        for prefix, viewset, basename in router.registry:
+            if hasattr(viewset, "list"):
+                yield reverse(f"{basename}-list")
+            if hasattr(viewset, "retrieve") and hasattr(viewset, "get_queryset"):
+                pk = self._budget_object_pk(viewset)
+                if pk is not None:
+                    yield reverse(f"{basename}-detail", args=[pk])
+            for extra in viewset.get_extra_actions():
+                if extra.detail or "get" not in extra.mapping:
+                    continue
+                try:
+                    yield reverse(f"{basename}-{extra.url_name}")
+                except NoReverseMatch:
+                    continue
+
+    def assertQueryBudget(self, url):
+        headers = {}
+        if self.budget_user is not None:
+            headers["HTTP_AUTHORIZATION"] = f"Bearer {RefreshToken.for_user(self.budget_user).access_token}"
+        with override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_MODE="raise"):
+            try:
+                response = self.client.get(url, **headers)
+            except QueryBudgetExceeded as exc:
+                self.fail(str(exc))
+        self.assertLess(response.status_code, 400, f"GET {url}: {response.status_code}")
+
+    def assertRouterQueryBudgets(self, router):
+        for url in self._budget_urls(router):
+            if resolve_query_budget(resolve(url).func, "GET") is None:
+                continue
+            with self.subTest(url=url):
+                self.assertQueryBudget(url)
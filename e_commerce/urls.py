@@ -19,12 +19,18 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .instrumentation import metrics_view
+from .media import media_urlpatterns
+
 
 urlpatterns = [
     path('websec/admin/', admin.site.urls),
+    path('websec/metrics/', metrics_view, name='metrics'),
     path('websec/auth/', include('user.urls')),
     path('websec/', include('shop.urls')),
 ]
 
+urlpatterns += media_urlpatterns()
+
 if settings.DEBUG:
-    urlpatterns += static( settings.MEDIA_URL, document_root = settings.MEDIA_ROOT) + static( settings.STATIC_URL, document_root = settings.STATIC_ROOT)
\ No newline at end of file
+    urlpatterns += static( settings.STATIC_URL, document_root = settings.STATIC_ROOT)
\ No newline at end of file
@@ -1,5 +1,15 @@
-from django.contrib import admin
+from decimal import Decimal, ROUND_HALF_UP
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.db.models import Max
+from django.template.response import TemplateResponse
 from .models import *
+from .exports import export_orders, export_products
+from .changes import activate_products, deactivate_products
+from .bulk_update import MAX_QUANTITY, apply_updates, parse_updates
+from .paginators import EstimatedCountPaginator
 # Register your models here.
 
 admin.site.register(Category)
@@ -8,15 +18,24 @@ admin.site.register(Brand)
 # admin.site.register(ProductImage)
 # admin.site.register(Cart)
 # admin.site.register(CartItem)
-admin.site.register(Order)
+# admin.site.register(Order)
 # admin.site.register(OrderItem)
 
+
+class PerformantAdminMixin:
+    # Для больших таблиц: без второго COUNT(*) на каждой странице и с оценкой числа строк
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+
 @admin.register(Cart)
-class CustomCartAdmin(admin.ModelAdmin):
+class CustomCartAdmin(PerformantAdminMixin, admin.ModelAdmin):
     fieldsets = (
         (None, {'fields': ('user',)}),
     )
     list_display = ('user_full_name', 'user__email')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
 
     def user_full_name(self, obj):
         if obj.user:
@@ -25,7 +44,7 @@ class CustomCartAdmin(admin.ModelAdmin):
     search_fields = ('user__first_name', 'user__last_name', 'user__email')
 
 @admin.register(ProductImage)
-class CuscomProductImagesAdmin(admin.ModelAdmin):
+class CuscomProductImagesAdmin(PerformantAdminMixin, admin.ModelAdmin):
     fieldsets = (
         ('Main info', {'fields': ('image', 'name', 'product')}),
     )
@@ -33,7 +52,9 @@ class CuscomProductImagesAdmin(admin.ModelAdmin):
         ('Main info', {'fields': ('image', 'product')}),
     )
     list_display = ('product__name', 'name',)
-    search_fields = ('Product__name',)
+    list_select_related = ('product',)
+    autocomplete_fields = ('product',)
+    search_fields = ('product__name',)
     ordering = ('product__name',)
     list_per_page = 20
     save_on_top = True
@@ -49,8 +70,36 @@ class ProductImageInline(admin.TabularInline):
     extra = 1
     fields = ("image",)
 
+def _scaled_price(price, percent):
+    return (price * (100 + percent) / 100).quantize(Decimal(1), ROUND_HALF_UP)
+
+
+class BulkPriceStockForm(forms.Form):
+    price_percent = forms.DecimalField(
+        required=False, max_digits=6, decimal_places=2, min_value=-100, label='Change price by, %',
+    )
+    quantity = forms.IntegerField(required=False, min_value=0, max_value=MAX_QUANTITY, label='Set stock to')
+
+    def __init__(self, *args, queryset=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queryset = queryset
+
+    def clean(self):
+        data = super().clean()
+        percent = data.get('price_percent')
+        if percent is None and data.get('quantity') is None:
+            raise forms.ValidationError('Fill in the price change and/or the stock.')
+        if percent is not None and self.queryset is not None:
+            # Самая дорогая из выбранных должна остаться в пределах колонки price
+            highest = self.queryset.aggregate(highest=Max('price'))['highest']
+            max_digits = Product._meta.get_field('price').max_digits
+            if highest is not None and _scaled_price(highest, percent) >= 10 ** max_digits:
+                self.add_error('price_percent', f'The new price of {highest} would exceed {max_digits} digits.')
+        return data
+
+
 @admin.register(Product)
-class CustomProductAdmin(admin.ModelAdmin):
+class CustomProductAdmin(PerformantAdminMixin, admin.ModelAdmin):
     fieldsets = (
         ('Main info', {'fields': ('sku', 'name', 'description', 'price', 'is_active')}),
         ('Additional information', {'fields': ('quantity', 'category', 'brand')}),
@@ -60,20 +109,63 @@ class CustomProductAdmin(admin.ModelAdmin):
         ('Additional information', {'fields': ('quantity', 'category', 'brand')}),
     )
     list_display = ('sku', 'name', 'quantity', 'price', 'is_active')
-    search_fields = ('sku', 'name', 'price', 'brand__name', 'category__name')
+    # sku ищем точным совпадением; бренд и категория выбираются через list_filter
+    search_fields = ('=sku', 'name')
     ordering = ('sku',)
     list_filter = ('is_active', 'brand', 'category')
     list_per_page = 20
     save_on_top = True
     inlines = [ProductImageInline]
 
-    actions = ['make_active', 'make_unactive']
+    actions = ['make_active', 'make_unactive', 'bulk_update_price_stock', 'export_csv', 'export_ndjson']
 
     def make_active(self, request, queryset):
-        queryset.update(is_active=True)
+        activate_products(queryset)
 
     def make_unactive(self, request, queryset):
-        queryset.update(is_active=False)
+        # Не queryset.update(): нужны updated_at и tombstone для ленты изменений
+        deactivate_products(queryset)
+
+    @admin.action(description='Update price/stock of selected products')
+    def bulk_update_price_stock(self, request, queryset):
+        # Один set-based UPDATE на пачку (shop.bulk_update), а не save() каждого товара
+        form = BulkPriceStockForm(request.POST if 'apply' in request.POST else None, queryset=queryset)
+        if form.is_valid():
+            percent, quantity = form.cleaned_data['price_percent'], form.cleaned_data['quantity']
+            rows = []
+            for sku, price in queryset.values_list('sku', 'price').iterator():
+                row = {'sku': sku, 'quantity': quantity}
+                if percent is not None:
+                    row['price'] = _scaled_price(price, percent)
+                rows.append(row)
+            try:
+                updates = parse_updates(rows)
+            except ValueError as exc:
+                # Цены могли измениться после проверки формы
+                self.message_user(request, str(exc), messages.ERROR)
+                return None
+            result = apply_updates(updates)
+            self.message_user(
+                request, f"Updated {result['updated']} products, {result['price_changes']} price changes.",
+                messages.SUCCESS,
+            )
+            return None
+        return TemplateResponse(request, 'admin/shop/product/bulk_update.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Update price/stock',
+            'opts': self.model._meta,
+            'form': form,
+            'selected': queryset.values_list('pk', flat=True),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+
+    @admin.action(description='Export selected products (CSV)')
+    def export_csv(self, request, queryset):
+        return export_products(queryset, 'csv')
+
+    @admin.action(description='Export selected products (NDJSON)')
+    def export_ndjson(self, request, queryset):
+        return export_products(queryset, 'ndjson')
 
     def get_fieldsets(self, request, obj=None):
         if obj:
@@ -81,7 +173,7 @@ class CustomProductAdmin(admin.ModelAdmin):
         return self.add_fieldsets
     
 @admin.register(CartItem)
-class CustomCartItemsAdmin(admin.ModelAdmin):
+class CustomCartItemsAdmin(PerformantAdminMixin, admin.ModelAdmin):
     fieldsets = (
         ('Cart info', {'fields': ('cart', 'total_item_price',)}),
         ('Selected product', {'fields': ('product', 'quantity', 'unit_price',)}),
@@ -91,7 +183,9 @@ class CustomCartItemsAdmin(admin.ModelAdmin):
         ('Selected product', {'fields': ('product', 'quantity')}),
     )
     list_display = ('cart__user__username', 'product__name', 'quantity', 'total_item_price')
-    search_fields = ('cart__user__username', 'product__sku', 'product__name',)
+    list_select_related = ('cart__user', 'product')
+    autocomplete_fields = ('cart', 'product')
+    search_fields = ('cart__user__username', '=product__sku', 'product__name',)
     readonly_fields = ('total_item_price', 'unit_price')
     list_per_page = 20
     save_on_top = True
@@ -101,8 +195,58 @@ class CustomCartItemsAdmin(admin.ModelAdmin):
             return self.fieldsets
         return self.add_fieldsets
     
+# Заказы и архив выгружаются одинаково (shop.exports.order_documents)
+@admin.action(description='Export selected orders with items (CSV)')
+def export_orders_csv(modeladmin, request, queryset):
+    return export_orders(queryset, 'csv')
+
+
+@admin.action(description='Export selected orders with items (NDJSON)')
+def export_orders_ndjson(modeladmin, request, queryset):
+    return export_orders(queryset, 'ndjson')
+
+
+@admin.register(Order)
+class CustomOrderAdmin(PerformantAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'user__email', 'status', 'total_amount', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('status', 'delivery_method')
+    autocomplete_fields = ('user',)
+    search_fields = ('=id', 'user__email')
+    ordering = ('-id',)
+    list_per_page = 20
+    actions = [export_orders_csv, export_orders_ndjson]
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    fields = ('product', 'quantity', 'unit_price', 'subtotal')
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(PerformantAdminMixin, admin.ModelAdmin):
+    # Архив только для чтения: заказы туда переносит команда archive_orders
+    list_display = ('id', 'user__email', 'status', 'total_amount', 'created_at', 'archived_at')
+    list_select_related = ('user',)
+    list_filter = ('status', 'delivery_method')
+    search_fields = ('=id', 'user__email')
+    ordering = ('-id',)
+    list_per_page = 20
+    inlines = (ArchivedOrderItemInline,)
+    actions = [export_orders_csv, export_orders_ndjson]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(OrderItem)
-class CustomOrderItemsAdmin(admin.ModelAdmin):
+class CustomOrderItemsAdmin(PerformantAdminMixin, admin.ModelAdmin):
     fieldsets = (
         ('Cart info', {'fields': ('order', 'subtotal',)}),
         ('Selected product', {'fields': ('product', 'quantity', 'unit_price',)}),
@@ -112,7 +256,10 @@ class CustomOrderItemsAdmin(admin.ModelAdmin):
         ('Selected product', {'fields': ('product', 'quantity')}),
     )
     list_display = ('order__user__username', 'product__name', 'quantity', 'subtotal')
-    search_fields = ('order__user__username', 'product__sku', 'product__name',)
+    list_select_related = ('order__user', 'product')
+    raw_id_fields = ('order',)
+    autocomplete_fields = ('product',)
+    search_fields = ('order__user__username', '=product__sku', 'product__name',)
     readonly_fields = ('subtotal', 'unit_price')
     list_per_page = 20
     save_on_top = True
@@ -0,0 +1,48 @@
+# shop/analytics.py
+"""Dashboard queries. Read only the daily rollups from shop.rollups, never Order/OrderItem."""
+from django.db.models import Sum
+
+from .models import ProductDailySales, CategoryDailySales, BrandDailySales
+
+DEFAULT_PERIOD_DAYS = 30
+MAX_PERIOD_DAYS = 366
+DEFAULT_TOP_LIMIT = 10
+MAX_TOP_LIMIT = 100
+
+# Измерение -> (модель, ключ, поля для подписи)
+DIMENSIONS = {
+    "products": (ProductDailySales, "product_id", ("product__name", "product__sku")),
+    "categories": (CategoryDailySales, "category_id", ("category__name",)),
+    "brands": (BrandDailySales, "brand_id", ("brand__name",)),
+}
+
+
+def daily_totals(first_day, last_day):
+    # Сумма по категориям = сумма по всем товарам: у каждого товара ровно одна категория
+    rows = (
+        CategoryDailySales.objects.filter(day__gte=first_day, day__lte=last_day)
+        .values("day")
+        .annotate(total_units=Sum("units"), total_revenue=Sum("revenue"))
+        .order_by("day")
+    )
+    return [{"day": r["day"], "units": r["total_units"], "revenue": r["total_revenue"]} for r in rows]
+
+
+def top(dimension, first_day, last_day, order_by="units", limit=DEFAULT_TOP_LIMIT):
+    model, key, labels = DIMENSIONS[dimension]
+    rows = (
+        model.objects.filter(day__gte=first_day, day__lte=last_day)
+        .values(key, *labels)
+        .annotate(total_units=Sum("units"), total_revenue=Sum("revenue"), total_orders=Sum("orders"))
+        .order_by(f"-total_{order_by}", key)[:limit]
+    )
+    return [
+        {
+            "id": r[key],
+            **{label.split("__", 1)[1]: r[label] for label in labels},
+            "units": r["total_units"],
+            "revenue": r["total_revenue"],
+            "orders": r["total_orders"],
+        }
+        for r in rows
+    ]
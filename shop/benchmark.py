@@ -0,0 +1,359 @@
+# shop/benchmark.py
+import json
+import random
+import statistics
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Callable, Optional
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .categories import fill_root_paths
+from .models import Brand, Category, Product, ProductImage, Cart, CartItem, Order, OrderItem
+
+BENCH_PASSWORD = "bench-password"
+
+
+@dataclass
+class Dataset:
+    brands: int = 20
+    categories: int = 30
+    products: int = 2000
+    images_per_product: int = 2
+    users: int = 200
+    cart_items: int = 3
+    orders: int = 500
+    seed: int = 42
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: str
+    auth: bool = False
+    data: Optional[dict] = None
+    # Вызывается перед каждой итерацией и в замер не входит (например, наполнить корзину)
+    setup: Optional[Callable[[], None]] = None
+
+
+def seed_dataset(dataset):
+    rng = random.Random(dataset.seed)
+    User = get_user_model()
+
+    brands = Brand.objects.bulk_create(Brand(name=f"Brand {i}") for i in range(dataset.brands))
+    categories = Category.objects.bulk_create(
+        Category(name=f"Category {i}", slug=f"category-{i}") for i in range(dataset.categories)
+    )
+    fill_root_paths()
+    products = Product.objects.bulk_create(
+        Product(
+            name=f"{rng.choice(['Phone', 'Laptop', 'Tablet', 'Watch', 'Camera'])} {i}",
+            sku=f"BENCH-{i:07d}",
+            description="Benchmark product " * 5,
+            price=Decimal(rng.randint(10, 5000)),
+            quantity=1_000_000,
+            brand=rng.choice(brands),
+            category=rng.choice(categories),
+        )
+        for i in range(dataset.products)
+    )
+    ProductImage.objects.bulk_create(
+        ProductImage(image=f"product_images/bench_{p.pk}_{j}.jpg", name=f"Bench_{p.pk}_{j}", product=p)
+        for p in products
+        for j in range(dataset.images_per_product)
+    )
+
+    password = make_password(BENCH_PASSWORD)
+    users = User.objects.bulk_create(
+        User(
+            email=f"bench{i}@example.com",
+            username=f"bench_{i}",
+            first_name="Bench",
+            last_name=str(i),
+            password=password,
+            is_active=True,
+        )
+        for i in range(dataset.users)
+    )
+    carts = Cart.objects.bulk_create(Cart(user=u) for u in users)
+    CartItem.objects.bulk_create(
+        CartItem(cart=cart, product=p, quantity=1, unit_price=p.price, total_item_price=p.price)
+        for cart in carts
+        for p in rng.sample(products, dataset.cart_items)
+    )
+
+    orders = Order.objects.bulk_create(
+        Order(
+            user=rng.choice(users),
+            status=Order.Status.DELIVERED,
+            total_amount=0,
+            shipping_address="Benchmark street 1",
+            delivery_method=Order.DeliveryMethod.COURIER,
+        )
+        for _ in range(dataset.orders)
+    )
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product=p, quantity=1, unit_price=p.price, subtotal=p.price)
+        for order in orders
+        for p in rng.sample(products, rng.randint(1, 4))
+    )
+    return {"brands": brands, "categories": categories, "products": products, "users": users}
+
+
+def build_scenarios(seeded):
+    user = seeded["users"][0]
+    product = seeded["products"][0]
+    brand = seeded["brands"][0]
+
+    def fill_cart():
+        cart = Cart.objects.get(user=user)
+        if not cart.cartitem_set.exists():
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+
+    return [
+        Scenario("product_list", "get", "/websec/products/"),
+        Scenario("product_search", "get", "/websec/products/?search=Phone"),
+        Scenario("product_filter", "get", f"/websec/products/?brand={brand.pk}&price_min=100&ordering=price"),
+        Scenario("product_popular", "get", "/websec/products/?ordering=-units_sold_30d"),
+        Scenario("product_detail", "get", f"/websec/products/{product.pk}/"),
+        Scenario("cart_read", "get", "/websec/cart/", auth=True),
+        Scenario("cart_add", "post", "/websec/cart-items/", auth=True, data={"product_id": product.pk, "quantity": 1}),
+        Scenario("login", "post", "/websec/auth/login/",
+                 data={"email": user.email, "password": BENCH_PASSWORD}),
+        Scenario("me", "get", "/websec/auth/me/", auth=True),
+        # Последним: оформление заказа очищает корзину, от которой зависят cart_read и me
+        Scenario("checkout", "post", "/websec/orders/from_cart/", auth=True,
+                 data={"shipping_address": "Benchmark street 1"}, setup=fill_cart),
+    ]
+
+
+def _summarize(timings, queries):
+    timings = sorted(timings)
+    total = sum(timings)
+    cuts = statistics.quantiles(timings, n=100, method="inclusive") if len(timings) > 1 else timings * 99
+    return {
+        "iterations": len(timings),
+        "mean_ms": round(total / len(timings) * 1000, 3),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "throughput_rps": round(len(timings) / total, 1) if total else None,
+        "queries": queries,
+    }
+
+
+def run_client(scenarios, user, iterations, warmup):
+    """``queries`` is counted on a cold request (cache cleared), ``warm_queries`` on the first timed one."""
+    client = Client()
+    token = str(RefreshToken.for_user(user).access_token)
+    results = {}
+    for scenario in scenarios:
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if scenario.auth else {}
+        call = getattr(client, scenario.method)
+        kwargs = {"content_type": "application/json"} if scenario.data is not None else {}
+
+        def request(count_queries=False):
+            if scenario.setup:
+                scenario.setup()
+            # setup() тоже ходит в БД — считаем только запросы самого вызова
+            with CaptureQueriesContext(connection) if count_queries else nullcontext() as captured:
+                start = time.perf_counter()
+                response = call(scenario.path, scenario.data, **kwargs, **headers)
+                elapsed = time.perf_counter() - start
+            if response.status_code >= 400:
+                raise RuntimeError(f"{scenario.name}: HTTP {response.status_code} {response.content[:200]!r}")
+            return elapsed, len(captured) if count_queries else None
+
+        # Холодный запрос вне замера: на кэшируемых путях только промах показывает N+1
+        cache.clear()
+        _, cold_queries = request(count_queries=True)
+        for _ in range(warmup):
+            request()
+        first, warm_queries = request(count_queries=True)
+        timings = [first] + [request()[0] for _ in range(iterations - 1)]
+        results[f"client:{scenario.name}"] = {**_summarize(timings, cold_queries), "warm_queries": warm_queries}
+    return results
+
+
+def _start_wsgi():
+    from wsgiref.simple_server import make_server, WSGIRequestHandler
+    from django.core.wsgi import get_wsgi_application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = make_server("127.0.0.1", 0, get_wsgi_application(), handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+    return server.server_port, stop
+
+
+def _start_asgi():
+    import socket
+    import uvicorn  # опционально, только для --server asgi
+    from django.core.asgi import get_asgi_application
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        get_asgi_application(), host="127.0.0.1", port=port, log_level="warning", lifespan="off",
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return port, stop
+
+
+def run_server(kind, scenarios, user, iterations, warmup):
+    import requests
+
+    port, stop = _start_asgi() if kind == "asgi" else _start_wsgi()
+    base = f"http://127.0.0.1:{port}"
+    token = str(RefreshToken.for_user(user).access_token)
+    session = requests.Session()
+    results = {}
+    try:
+        for scenario in scenarios:
+            headers = {"Authorization": f"Bearer {token}"} if scenario.auth else {}
+
+            def request():
+                if scenario.setup:
+                    scenario.setup()
+                start = time.perf_counter()
+                response = session.request(scenario.method, base + scenario.path, json=scenario.data, headers=headers)
+                elapsed = time.perf_counter() - start
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{scenario.name}: HTTP {response.status_code} {response.text[:200]!r}")
+                return elapsed
+
+            for _ in range(warmup):
+                request()
+            timings = [request() for _ in range(iterations)]
+            results[f"{kind}:{scenario.name}"] = _summarize(timings, None)
+    finally:
+        session.close()
+        stop()
+    return results
+
+
+def serializer_microbench(queryset, repeat=5):
+    """
+    Rows/sec for queryset -> JSON bytes: DRF ProductSerializer + JSONRenderer vs the
+    compiled path with each available encoder. Checks that all outputs are identical.
+    """
+    from django.test import RequestFactory
+    from rest_framework.renderers import JSONRenderer
+    from e_commerce.renderers import orjson_dumps, stdlib_dumps
+    from .compiled import CompiledSerializer
+    from .queries import with_product_relations
+    from .serializers import ProductSerializer
+
+    request = RequestFactory().get("/websec/products/")
+    queryset = with_product_relations(queryset)
+    compiled = CompiledSerializer(ProductSerializer)
+
+    variants = {
+        "drf": lambda: JSONRenderer().render(
+            ProductSerializer(queryset.all(), many=True, context={"request": request}).data
+        ),
+        "compiled+json": lambda: stdlib_dumps(compiled.serialize(queryset.all(), request)),
+    }
+    try:
+        import orjson  # noqa: F401
+        variants["compiled+orjson"] = lambda: orjson_dumps(compiled.serialize(queryset.all(), request))
+    except ImportError:
+        pass
+
+    results, reference = {}, None
+    for name, run in variants.items():
+        output = run()  # прогрев
+        if reference is None:
+            reference = output
+        elif output != reference:
+            raise RuntimeError(f"{name}: output differs from ProductSerializer")
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        rows = queryset.count()
+        results[name] = {"rows": rows, "best_ms": round(best * 1000, 2), "rows_per_sec": round(rows / best)}
+    return results
+
+
+def middleware_overhead(paths, iterations=500, warmup=20):
+    """
+    Per-request latency of ``paths`` with the full middleware stack vs ``LEAN_API_MIDDLEWARE``.
+    The client carries session and CSRF cookies like a browser that has visited the admin;
+    modes alternate on every iteration so drift affects both equally.
+    """
+    from django.conf import settings
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.test.utils import override_settings
+
+    session = SessionStore()
+    session["bench"] = True
+    session.create()
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+    client.cookies[settings.CSRF_COOKIE_NAME] = "x" * 32
+
+    modes = {"full": override_settings(LEAN_API_MIDDLEWARE=False), "lean": override_settings(LEAN_API_MIDDLEWARE=True)}
+    results = {}
+    for path in paths:
+        timings = {mode: [] for mode in modes}
+        queries = {}
+        for i in range(warmup + iterations):
+            for mode, overrides in modes.items():
+                with overrides, CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = client.get(path)
+                    elapsed = time.perf_counter() - start
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{path}: HTTP {response.status_code}")
+                if i >= warmup:
+                    timings[mode].append(elapsed)
+                queries[mode] = len(captured)
+        results[path] = {mode: _summarize(timings[mode], queries[mode]) for mode in modes}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Returns human-readable regressions: p95 slower by more than ``threshold`` or more cold/warm queries."""
+    regressions = []
+    for name, base in baseline.get("results", {}).items():
+        current = results.get(name)
+        if current is None:
+            continue
+        if base["p95_ms"] and current["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {current['p95_ms']}ms")
+        for key in ("queries", "warm_queries"):
+            if base.get(key) is not None and current.get(key) is not None and current[key] > base[key]:
+                regressions.append(f"{name}: {key.replace('_', ' ')} {base[key]} -> {current[key]}")
+    return regressions
+
+
+def load_report(path):
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
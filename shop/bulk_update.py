@@ -0,0 +1,134 @@
+# shop/bulk_update.py
+"""
+Set-based price and stock updates by SKU (staff API and admin action).
+
+Each batch of ``batch_size`` changes runs in one transaction:
+
+1. ``SELECT ... FOR UPDATE`` of the affected products (ids, current price/stock);
+2. one ``UPDATE ... FROM (VALUES ...)`` for the whole batch (``WITH v AS (VALUES ...)``,
+   so SQLite runs the same statement), ``updated_at`` included for the change feed;
+3. one ``bulk_create`` of ``PriceHistory`` rows for the prices that actually changed;
+4. one ``notify_stock`` for the new quantities and, on commit, one catalog version
+   bump for the batch instead of a cache invalidation per product.
+
+Like ``shop.rollups``, the SQL targets PostgreSQL and SQLite (3.33+).
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import PriceHistory, Product
+from .stock_stream import notify_stock
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MAX_ROWS = 10000
+# Верхняя граница PositiveIntegerField (integer в PostgreSQL)
+MAX_QUANTITY = 2 ** 31 - 1
+
+
+def max_rows():
+    return getattr(settings, "SHOP_BULK_UPDATE_MAX_ROWS", DEFAULT_MAX_ROWS)
+
+
+def parse_updates(rows):
+    """``[{sku, price?, quantity?}]`` -> ``{sku: (price | None, quantity | None)}``; the last row per SKU wins.
+
+    Raises ``ValueError`` naming the first invalid row.
+    """
+    # decimal_places=0: цена — целое число меньше 10**max_digits
+    max_price = Decimal(10) ** Product._meta.get_field("price").max_digits
+    updates = {}
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            raise ValueError(f"{index}: ожидается объект")
+        sku = str(row.get("sku") or "").strip()
+        if not sku:
+            raise ValueError(f"{index}: нужен sku")
+        price = quantity = None
+        try:
+            if row.get("price") is not None:
+                price = Decimal(str(row["price"]))
+                if not price.is_finite() or not 0 <= price < max_price or price != price.to_integral_value():
+                    raise ValueError
+                price = price.quantize(Decimal(1))
+            if row.get("quantity") is not None:
+                value = row["quantity"]
+                if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+                    raise ValueError
+                quantity = int(value)
+                if not 0 <= quantity <= MAX_QUANTITY:
+                    raise ValueError
+        except (InvalidOperation, TypeError, ValueError):
+            raise ValueError(f"{index} ({sku}): цена — целое число от 0 до {max_price - 1}, количество — от 0 до {MAX_QUANTITY}")
+        if price is None and quantity is None:
+            raise ValueError(f"{index} ({sku}): нужны price и/или quantity")
+        updates[sku] = (price, quantity)
+    return updates
+
+
+def _update_from_values(connection, values, now):
+    """values: [(id, price | None, quantity | None)]; NULL keeps the current value."""
+    qn = connection.ops.quote_name
+    table = qn(Product._meta.db_table)
+    # Типы задаёт CAST: иначе VALUES из одних NULL в колонке PostgreSQL считает text
+    row = "(CAST(%s AS bigint), CAST(%s AS numeric), CAST(%s AS integer))"
+    params = [value for item in values for value in item] + [now]
+    sql = (
+        f"WITH v (id, price, quantity) AS (VALUES {', '.join([row] * len(values))}) "
+        f"UPDATE {table} SET {qn('price')} = COALESCE(v.price, {table}.{qn('price')}), "
+        f"{qn('quantity')} = COALESCE(v.quantity, {table}.{qn('quantity')}), {qn('updated_at')} = %s "
+        f"FROM v WHERE {table}.{qn('id')} = v.id"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def _apply_batch(batch, using):
+    now = timezone.now()
+    current = {
+        sku: (pk, price, quantity)
+        for pk, sku, price, quantity in Product.objects.using(using).select_for_update()
+        .filter(sku__in=list(batch)).order_by("pk").values_list("pk", "sku", "price", "quantity")
+    }
+    values, history, stock = [], [], {}
+    for sku, (price, quantity) in batch.items():
+        if sku not in current:
+            continue
+        pk, old_price, old_quantity = current[sku]
+        # Неизменившиеся значения не пишем: ни истории, ни уведомлений
+        price = None if price == old_price else price
+        quantity = None if quantity == old_quantity else quantity
+        if price is None and quantity is None:
+            continue
+        values.append((pk, price, quantity))
+        if price is not None:
+            history.append(PriceHistory(product_id=pk, previous_price=old_price, price=price, changed_at=now))
+        if quantity is not None:
+            stock[pk] = quantity
+
+    if values:
+        connection = connections[using]
+        _update_from_values(connection, values, connection.ops.adapt_datetimefield_value(now))
+        PriceHistory.objects.using(using).bulk_create(history)
+        notify_stock(stock, using)
+        transaction.on_commit(bump_catalog_version, using=using)
+    return len(values), len(history), [sku for sku in batch if sku not in current]
+
+
+def apply_updates(updates, batch_size=DEFAULT_BATCH_SIZE):
+    """Applies ``parse_updates()`` output; returns {"updated", "price_changes", "missing"}."""
+    using = router.db_for_write(Product)
+    items = list(updates.items())
+    updated = price_changes = 0
+    missing = []
+    for start in range(0, len(items), batch_size):
+        with transaction.atomic(using=using):
+            batch_updated, batch_prices, batch_missing = _apply_batch(dict(items[start:start + batch_size]), using)
+        updated += batch_updated
+        price_changes += batch_prices
+        missing += batch_missing
+    return {"updated": updated, "price_changes": price_changes, "missing": missing}
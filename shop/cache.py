@@ -0,0 +1,133 @@
+# shop/cache.py
+import hashlib
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+CATALOG_VERSION_KEY = "shop:catalog:version"
+CATALOG_CHANGED_AT_KEY = "shop:catalog:changed_at"
+
+# Сколько после истечения отдаём устаревшее значение, пока один воркер пересчитывает
+DEFAULT_STALE_SECONDS = 600
+DEFAULT_LOCK_SECONDS = 30
+# Холодный ключ: ждём результат воркера с блокировкой, потом считаем сами
+DEFAULT_WAIT_SECONDS = 5
+
+_force_refresh = ContextVar("catalog_force_refresh", default=False)
+
+
+def cache_is_shared():
+    """False for per-process backends: the version, locks and warmed entries would stay in one process."""
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+def _initial_version():
+    # Время в мкс: бампов меньше миллиона в секунду, так что после вытеснения или сброса
+    # ключа в общем кэше версия не повторит уже выданную
+    return time.time_ns() // 1000
+
+
+def get_catalog_version():
+    """Catalog version shared by all workers through ``CACHES`` (see ``cache_is_shared``)."""
+    return cache.get_or_set(CATALOG_VERSION_KEY, _initial_version, None)
+
+
+def get_catalog_changed_at():
+    """Time of the last bump, for ``Last-Modified``; if the key is gone, from now on."""
+    return datetime.fromtimestamp(cache.get_or_set(CATALOG_CHANGED_AT_KEY, time.time, None), timezone.utc)
+
+
+def bump_catalog_version():
+    # Время — до версии: читатель между ними получит новое время со старой версией, а не наоборот
+    cache.set(CATALOG_CHANGED_AT_KEY, time.time(), None)
+    # Старые ключи не удаляем — они просто перестают читаться и истекают по TTL
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, _initial_version(), None)
+
+
+def normalize_params(params, allowed=None):
+    """Sorted (key, value) pairs without empty values, so ?a=1&b=2 and ?b=2&a=1 share a key."""
+    normalized = []
+    for key in sorted(params.keys()):
+        if allowed is not None and key not in allowed:
+            continue
+        values = sorted(v.strip() for v in params.getlist(key) if v.strip())
+        if values:
+            normalized.append((key, ",".join(values)))
+    return normalized
+
+
+def catalog_cache_key(prefix, params=()):
+    raw = "&".join(f"{k}={v}" for k, v in params)
+    digest = hashlib.md5(raw.encode("utf-8")).hexdigest()
+    return f"shop:{prefix}:v{get_catalog_version()}:{digest}"
+
+
+def catalog_cache_timeout(name, default):
+    return getattr(settings, "SHOP_CACHE_TIMEOUTS", {}).get(name, default)
+
+
+@contextmanager
+def force_refresh():
+    """Inside the block ``get_or_compute`` recomputes even fresh entries (cache warm-up)."""
+    token = _force_refresh.set(True)
+    try:
+        yield
+    finally:
+        _force_refresh.reset(token)
+
+
+def _wait_for(key, version):
+    deadline = time.monotonic() + getattr(settings, "SHOP_CACHE_WAIT_SECONDS", DEFAULT_WAIT_SECONDS)
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry
+    return None
+
+
+def get_or_compute(prefix, params, compute, default_timeout=300):
+    """
+    Cached ``compute()`` with single-flight locking and stale-while-revalidate.
+
+    Entries are stored as (catalog version, fresh until, data) under a key without the
+    version, so after a version bump or expiry the old data is still there: one worker
+    takes ``<key>:lock`` (``cache.add``) and recomputes, the others return the stale
+    data. On a cold key the others wait up to ``SHOP_CACHE_WAIT_SECONDS`` for it.
+    """
+    raw = "&".join(f"{k}={v}" for k, v in params)
+    key = f"shop:{prefix}:swr:{hashlib.md5(raw.encode('utf-8')).hexdigest()}"
+    lock = f"{key}:lock"
+    version = get_catalog_version()
+    lock_seconds = getattr(settings, "SHOP_CACHE_LOCK_SECONDS", DEFAULT_LOCK_SECONDS)
+
+    locked = False
+    if not _force_refresh.get():
+        entry = cache.get(key)
+        if entry is not None and entry[0] == version and time.time() < entry[1]:
+            return entry[2]
+        locked = cache.add(lock, 1, lock_seconds)
+        if not locked:
+            if entry is None:
+                entry = _wait_for(key, version)
+            if entry is not None:
+                return entry[2]
+
+    try:
+        data = compute()
+        timeout = catalog_cache_timeout(prefix, default_timeout)
+        stale = getattr(settings, "SHOP_CACHE_STALE_SECONDS", DEFAULT_STALE_SECONDS)
+        cache.set(key, (version, time.time() + timeout, data), timeout + stale)
+    finally:
+        if locked:
+            cache.delete(lock)
+    return data
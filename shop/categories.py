@@ -0,0 +1,72 @@
+# shop/categories.py
+"""
+Category tree: materialized paths and denormalized subtree product counts.
+
+``Category.path`` is ``"<root id>/.../<own id>/"``; a subtree is one indexed
+``path LIKE '<path>%'`` (on PostgreSQL the ``_like`` index Django adds for
+``db_index`` char fields). ``Category.save()`` rewrites descendant paths with one
+``UPDATE`` when a category moves.
+
+``Category.product_count`` is the number of active products in the subtree.
+Single saves and deletes adjust it through ``shop.signals``, bulk paths
+(``activate_products``/``deactivate_products``) through ``adjust_category_counts``;
+imports and ``refresh_category_counts`` recompute it from scratch. ``bulk_create()``
+skips ``save()``: call ``fill_root_paths()`` after creating root categories in bulk.
+"""
+from collections import defaultdict
+
+from django.db.models import CharField, Count, F, Value
+from django.db.models.functions import Cast, Concat, Greatest
+
+from .models import Category, Product
+
+
+def fill_root_paths():
+    """Paths of root categories created by ``bulk_create()`` (which skips ``Category.save()``)."""
+    return Category.objects.filter(path="", parent=None).update(
+        path=Concat(Cast("id", CharField()), Value("/")), depth=0,
+    )
+
+
+def subtree_path(category_id):
+    """Path prefix of the category's subtree, ``None`` for an unknown id."""
+    return Category.objects.filter(pk=category_id).values_list("path", flat=True).first()
+
+
+def adjust_category_counts(deltas):
+    """deltas: {category_id: change in active products}, applied to each category and its ancestors."""
+    deltas = {pk: delta for pk, delta in deltas.items() if pk is not None and delta}
+    if not deltas:
+        return
+    totals = defaultdict(int)
+    for pk, path in Category.objects.filter(pk__in=deltas).values_list("pk", "path"):
+        for ancestor in Category.path_ids(path):
+            totals[ancestor] += deltas[pk]
+    # Один UPDATE на каждое значение изменения, а не на категорию
+    by_delta = defaultdict(list)
+    for pk, delta in totals.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, ids in by_delta.items():
+        Category.objects.filter(pk__in=ids).update(product_count=Greatest(F("product_count") + delta, 0))
+
+
+def refresh_category_counts(batch_size=1000):
+    """Recomputes ``product_count`` of every category; returns how many rows changed."""
+    direct = (
+        Product.objects.filter(is_active=True).values("category_id").annotate(n=Count("id"))
+        .values_list("category_id", "n").order_by()
+    )
+    categories = list(Category.objects.only("id", "path", "product_count"))
+    paths = {category.pk: category.path for category in categories}
+    totals = defaultdict(int)
+    for category_id, n in direct:
+        for ancestor in Category.path_ids(paths.get(category_id, "")):
+            totals[ancestor] += n
+    changed = []
+    for category in categories:
+        if category.product_count != totals[category.pk]:
+            category.product_count = totals[category.pk]
+            changed.append(category)
+    Category.objects.bulk_update(changed, ["product_count"], batch_size=batch_size)
+    return len(changed)
@@ -0,0 +1,107 @@
+# shop/changes.py
+"""
+Catalog change feed: products by (updated_at, id) plus ProductTombstone by id.
+
+Bulk ``queryset.update()`` calls on Product must set ``updated_at`` themselves and go
+through ``deactivate_products`` when they switch products off. The feed stops
+``SHOP_CHANGES_LAG_SECONDS`` before now, so rows from transactions still in flight
+(``updated_at`` is taken before commit) are not skipped by a cursor.
+"""
+import base64
+import binascii
+import json
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .categories import adjust_category_counts
+from .models import Product, ProductTombstone
+
+DEFAULT_CHANGES_LIMIT = 100
+MAX_CHANGES_LIMIT = 1000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def deactivate_products(queryset):
+    """``queryset.update(is_active=False)`` with tombstones; returns how many were switched off."""
+    with transaction.atomic():
+        products = list(queryset.filter(is_active=True).select_for_update().values_list("id", "sku", "category_id"))
+        Product.objects.filter(pk__in=[pk for pk, _, _ in products]).update(is_active=False, updated_at=timezone.now())
+        ProductTombstone.record([(pk, sku) for pk, sku, _ in products], ProductTombstone.Reason.DEACTIVATED)
+        removed = Counter(category_id for _, _, category_id in products)
+        adjust_category_counts({category_id: -n for category_id, n in removed.items()})
+    bump_catalog_version()
+    return len(products)
+
+
+def activate_products(queryset):
+    with transaction.atomic():
+        products = list(queryset.filter(is_active=False).select_for_update().values_list("id", "category_id"))
+        count = Product.objects.filter(pk__in=[pk for pk, _ in products]).update(
+            is_active=True, updated_at=timezone.now(),
+        )
+        adjust_category_counts(Counter(category_id for _, category_id in products))
+    bump_catalog_version()
+    return count
+
+
+def encode_cursor(position, tombstone_id):
+    updated_at, product_id = position or (None, 0)
+    raw = json.dumps([updated_at.isoformat() if updated_at else None, product_id, tombstone_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        updated_at, product_id, tombstone_id = json.loads(raw)
+        position = (datetime.fromisoformat(updated_at), int(product_id)) if updated_at else None
+        return position, int(tombstone_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def changes_page(products, since=None, cursor=None, limit=DEFAULT_CHANGES_LIMIT):
+    """
+    ``products`` is the Product queryset to page through (relations already attached).
+    Returns (changed products, tombstones, next cursor, has_more).
+    """
+    horizon = timezone.now() - timedelta(seconds=getattr(settings, "SHOP_CHANGES_LAG_SECONDS", 2))
+    products = products.filter(updated_at__lte=horizon)
+    tombstones = ProductTombstone.objects.filter(created_at__lte=horizon)
+
+    if cursor is not None:
+        position, tombstone_id = decode_cursor(cursor)
+    else:
+        position = (since, 0) if since is not None else None
+        tombstone_id = None
+
+    if position is not None:
+        updated_at, product_id = position
+        products = products.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=product_id))
+    if tombstone_id is not None:
+        tombstones = tombstones.filter(id__gt=tombstone_id)
+    elif since is not None:
+        tombstones = tombstones.filter(created_at__gte=since)
+
+    page = list(products.order_by("updated_at", "id")[:limit + 1])
+    removed = list(tombstones.order_by("id")[:limit + 1])
+    has_more = len(page) > limit or len(removed) > limit
+    page, removed = page[:limit], removed[:limit]
+
+    if page:
+        position = (page[-1].updated_at, page[-1].id)
+    if removed:
+        tombstone_id = removed[-1].id
+    elif tombstone_id is None:
+        # Дальше курсор идёт по id: всё, что старше горизонта, уже выдано или было до since
+        tombstone_id = ProductTombstone.objects.filter(created_at__lte=horizon).aggregate(last=Max("id"))["last"] or 0
+    return page, removed, encode_cursor(position, tombstone_id), has_more
@@ -0,0 +1,16 @@
+# shop/checks.py
+from django.core.checks import Tags, Warning, register
+
+from .cache import cache_is_shared
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """``manage.py check --deploy``: the catalog version must be seen by every worker."""
+    if cache_is_shared():
+        return []
+    return [Warning(
+        "CACHES['default'] is per-process: a catalog change made in one worker is not seen by the others.",
+        hint="Use Redis or Memcached (see CACHES in e_commerce/settings.py).",
+        id="shop.W001",
+    )]
@@ -0,0 +1,191 @@
+# shop/compiled.py
+"""
+Read-only "compiled" serialization for catalog lists.
+
+``CompiledSerializer(ProductSerializer)`` walks the serializer's readable fields once
+and turns them into ``values_list()`` columns plus per-field converters. Rows are then
+built from tuples; nested FK serializers are shared dicts looked up by id, and nested
+``many=True`` serializers come from one extra ``values_list()`` query grouped by FK.
+A serializer instance pruned by ``?fields=``/``?expand=`` compiles the same way;
+collapsed relations become ids.
+The result equals ``ProductSerializer(qs, many=True).data`` item by item and contains
+only str/int/bool/None, so ``FastJSONRenderer`` can encode it.
+"""
+from collections import defaultdict
+from functools import lru_cache
+
+from rest_framework import serializers
+
+from e_commerce.fieldsets import Fieldset
+
+from .serializers import ProductSerializer
+
+# Поля, у которых to_representation для значения из values_list — тождество
+_IDENTITY_FIELDS = (
+    serializers.BooleanField, serializers.CharField, serializers.IntegerField,
+    serializers.PrimaryKeyRelatedField, serializers.ReadOnlyField,
+)
+
+
+class _Plan:
+    def __init__(self, serializer, prefix, columns):
+        self.model = serializer.Meta.model
+        self.key = len(columns)
+        columns.append(f"{prefix}pk")
+        self.values, self.nested, self.many, self.order = [], [], [], []
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            self.order.append(name)
+            if isinstance(field, serializers.ListSerializer):
+                if prefix:
+                    raise ValueError(f"{name}: nested many=True is supported only at the top level")
+                self.many.append((name, CompiledSerializer(field.child, field.source)))
+            elif isinstance(field, serializers.ManyRelatedField):
+                if prefix:
+                    raise ValueError(f"{name}: nested many=True is supported only at the top level")
+                self.many.append((name, _RelatedIds(field.source)))
+            elif isinstance(field, serializers.BaseSerializer):
+                self.nested.append((name, _Plan(field, f"{prefix}{field.source}__", columns)))
+            elif isinstance(field, serializers.SerializerMethodField) or field.source == "*":
+                raise ValueError(f"{name}: {type(field).__name__} can't be compiled")
+            else:
+                index = len(columns)
+                columns.append(f"{prefix}{field.source.replace('.', '__')}")
+                self.values.append((name, index, field))
+
+    def converters(self, request):
+        result = []
+        for name, index, field in self.values:
+            if isinstance(field, serializers.FileField):
+                convert = _file_converter(field, self.model, request)
+            elif isinstance(field, _IDENTITY_FIELDS):
+                convert = None
+            else:
+                convert = field.to_representation
+            result.append((name, index, convert))
+        return result
+
+    def builder(self, request):
+        """Returns ``build(row) -> dict`` with keys in serializer order; many=True keys are left None."""
+        values = {name: (index, convert) for name, index, convert in self.converters(request)}
+        nested = dict(self.nested)
+        steps = []
+        for name in self.order:
+            if name in values:
+                steps.append((name, *values[name], None))
+            elif name in nested:
+                plan = nested[name]
+                # Одинаковые бренды/категории собираются один раз и переиспользуются
+                steps.append((name, plan.key, {}, plan.builder(request)))
+            else:
+                steps.append((name, None, None, None))
+
+        def build(row):
+            item = {}
+            for name, index, convert, build_nested in steps:
+                if build_nested is not None:
+                    key = row[index]
+                    if key is None:
+                        item[name] = None
+                    else:
+                        cached = convert.get(key)
+                        if cached is None:
+                            cached = convert[key] = build_nested(row)
+                        item[name] = cached
+                elif index is None:
+                    item[name] = None
+                else:
+                    value = row[index]
+                    item[name] = value if convert is None or value is None else convert(value)
+            return item
+        return build
+
+
+def _file_converter(field, model, request):
+    storage = model._meta.get_field(field.source).storage
+    use_url = getattr(field, "use_url", True)
+
+    def convert(name):
+        if not name:
+            return None
+        if not use_url:
+            return name
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+    return convert
+
+
+def _parent_fk(parent_model, related_name):
+    return next(
+        rel.field for rel in parent_model._meta.related_objects if rel.get_accessor_name() == related_name
+    )
+
+
+class _RelatedIds:
+    """``PrimaryKeyRelatedField(many=True)`` over a reverse FK: ids grouped by parent, ordered by id."""
+
+    def __init__(self, related_name):
+        self.related_name = related_name
+
+    def grouped(self, parent_model, parent_ids, request):
+        groups = defaultdict(list)
+        if not parent_ids:
+            return groups
+        fk = _parent_fk(parent_model, self.related_name)
+        queryset = fk.model._default_manager.filter(**{f"{fk.name}__in": parent_ids}).order_by("pk")
+        for parent_id, pk in queryset.values_list(fk.attname, "pk"):
+            groups[parent_id].append(pk)
+        return groups
+
+
+class CompiledSerializer:
+    """``serializer`` is a serializer class or an instance (e.g. one bound to a ``fieldset`` context)."""
+
+    def __init__(self, serializer, related_name=None):
+        if isinstance(serializer, type):
+            serializer = serializer()
+        self.serializer_class = type(serializer)
+        self.columns = []
+        self.plan = _Plan(serializer, "", self.columns)
+        # Для вложенного many=True: имя FK на родителя (productimage_set -> product)
+        self.related_name = related_name
+
+    def _rows(self, queryset):
+        return queryset.prefetch_related(None).values_list(*self.columns)
+
+    def serialize(self, queryset, request=None):
+        build = self.plan.builder(request)
+        rows = list(self._rows(queryset))
+        children = {
+            name: child.grouped(self.plan.model, [row[self.plan.key] for row in rows], request)
+            for name, child in self.plan.many
+        }
+        result = []
+        for row in rows:
+            item = build(row)
+            for name, groups in children.items():
+                item[name] = groups.get(row[self.plan.key], [])
+            result.append(item)
+        return result
+
+    def grouped(self, parent_model, parent_ids, request):
+        groups = defaultdict(list)
+        if not parent_ids:
+            return groups
+        fk = _parent_fk(parent_model, self.related_name)
+        # Тот же порядок, что у Prefetch в shop.queries.with_product_relations
+        queryset = self.plan.model._default_manager.filter(**{f"{fk.name}__in": parent_ids}).order_by("pk")
+        build = self.plan.builder(request)
+        for row in queryset.values_list(fk.attname, *self.columns):
+            groups[row[0]].append(build(row[1:]))
+        return groups
+
+
+@lru_cache(maxsize=128)
+def compiled_product_list(shape=None):
+    """``shape`` is ``e_commerce.fieldsets.fieldset_key()`` of the request; ``None`` — the full payload."""
+    if shape is None:
+        return CompiledSerializer(ProductSerializer)
+    return CompiledSerializer(ProductSerializer(context={"fieldset": Fieldset.parse(*shape)}))
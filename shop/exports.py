@@ -0,0 +1,124 @@
+# shop/exports.py
+import csv
+import json
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_SIZE = 64 * 1024
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+
+PRODUCT_EXPORT_FIELDS = [
+    "id", "sku", "name", "price", "quantity", "is_active",
+    "brand_id", "brand__name", "category_id", "category__name", "description",
+]
+ORDER_EXPORT_FIELDS = [
+    "id", "user_id", "status", "total_amount", "created_at", "delivery_method", "shipping_address",
+]
+ORDER_ITEM_EXPORT_FIELDS = ["product_id", "product__sku", "quantity", "unit_price", "subtotal"]
+# Плоская строка выгрузки заказов: поля заказа через order__ + поля позиции
+ORDER_ROW_FIELDS = (
+    ["order_id"] + [f"order__{f}" for f in ORDER_EXPORT_FIELDS[1:]] + ORDER_ITEM_EXPORT_FIELDS
+)
+
+
+class _Echo:
+    # csv.writer пишет в "файл", а мы просто возвращаем готовую строку
+    def write(self, value):
+        return value
+
+
+def _csv_lines(rows, fields):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([row[f] for f in fields])
+
+
+def _ndjson_lines(docs):
+    for doc in docs:
+        yield json.dumps(doc, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _buffered(lines):
+    # Отдаём блоками по ~64 КБ, а не по строке на write()
+    buf, size = [], 0
+    for line in lines:
+        buf.append(line)
+        size += len(line)
+        if size >= EXPORT_BUFFER_SIZE:
+            yield "".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf)
+
+
+def product_rows(queryset):
+    return queryset.order_by("id").values(*PRODUCT_EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def order_documents(order_queryset):
+    """Orders with their ``items`` list, including orders without items; one item query per chunk of orders."""
+    # Order или ArchivedOrder: позиции — модель обратной связи items
+    item_model = order_queryset.model._meta.get_field("items").related_model
+    orders = order_queryset.order_by("id").values(*ORDER_EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for chunk in _chunked(orders, EXPORT_CHUNK_SIZE):
+        items = defaultdict(list)
+        rows = (
+            item_model.objects.filter(order_id__in=[order["id"] for order in chunk])
+            .order_by("order_id", "id")
+            .values("order_id", *ORDER_ITEM_EXPORT_FIELDS)
+        )
+        for row in rows:
+            items[row.pop("order_id")].append(row)
+        for order in chunk:
+            order["items"] = items[order["id"]]
+            yield order
+
+
+def _order_rows(orders):
+    # Заказ без позиций — одна строка с пустыми полями позиции
+    empty = dict.fromkeys(ORDER_ITEM_EXPORT_FIELDS, "")
+    for order in orders:
+        head = {"order_id": order["id"], **{f"order__{f}": order[f] for f in ORDER_EXPORT_FIELDS[1:]}}
+        for item in order["items"] or [empty]:
+            yield {**head, **item}
+
+
+def export_response(lines, fmt, filename):
+    response = StreamingHttpResponse(_buffered(lines), content_type=EXPORT_FORMATS[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+def export_products(queryset, fmt):
+    rows = product_rows(queryset)
+    lines = _csv_lines(rows, PRODUCT_EXPORT_FIELDS) if fmt == "csv" else _ndjson_lines(rows)
+    return export_response(lines, fmt, "products")
+
+
+def export_orders(queryset, fmt):
+    orders = order_documents(queryset)
+    if fmt == "csv":
+        # В CSV одна строка на позицию заказа
+        lines = _csv_lines(_order_rows(orders), ORDER_ROW_FIELDS)
+    else:
+        lines = _ndjson_lines(orders)
+    return export_response(lines, fmt, "orders")
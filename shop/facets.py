@@ -0,0 +1,61 @@
+# shop/facets.py
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Min, Value
+from django.db.models.functions import Floor
+
+DEFAULT_PRICE_BUCKETS = 10
+MAX_PRICE_BUCKETS = 50
+
+
+def brand_facets(queryset):
+    rows = (
+        queryset.order_by()
+        .values("brand_id", "brand__name")
+        .annotate(count=Count("id"))
+        .order_by("-count", "brand__name")
+    )
+    return [{"id": r["brand_id"], "name": r["brand__name"], "count": r["count"]} for r in rows]
+
+
+def category_facets(queryset):
+    rows = (
+        queryset.order_by()
+        .values("category_id", "category__name", "category__slug")
+        .annotate(count=Count("id"))
+        .order_by("-count", "category__name")
+    )
+    return [
+        {"id": r["category_id"], "name": r["category__name"], "slug": r["category__slug"], "count": r["count"]}
+        for r in rows
+    ]
+
+
+def price_histogram(queryset, buckets=DEFAULT_PRICE_BUCKETS):
+    queryset = queryset.order_by()
+    bounds = queryset.aggregate(min_price=Min("price"), max_price=Max("price"))
+    low, high = bounds["min_price"], bounds["max_price"]
+    if low is None:
+        return {"min": None, "max": None, "buckets": []}
+
+    # Цены целые (decimal_places=0), поэтому и ширина корзины целая
+    width = max((high - low + buckets - 1) // buckets, 1)
+    bucket_expr = Floor(
+        ExpressionWrapper(
+            (F("price") - Value(low)) / Value(width),
+            output_field=DecimalField(max_digits=20, decimal_places=6),
+        )
+    )
+    counts = [0] * buckets
+    rows = queryset.annotate(bucket=bucket_expr).values("bucket").annotate(count=Count("id"))
+    for row in rows:
+        # Максимальная цена попадает ровно на правую границу — кладём её в последнюю корзину
+        index = min(int(row["bucket"]), buckets - 1)
+        counts[index] += row["count"]
+
+    return {
+        "min": str(low),
+        "max": str(high),
+        "buckets": [
+            {"from": str(low + width * i), "to": str(low + width * (i + 1)), "count": count}
+            for i, count in enumerate(counts)
+        ],
+    }
@@ -1,9 +1,11 @@
 # shop/filters.py (или где у тебя Product)
 import django_filters
+from .categories import subtree_path
 from .models import Product
 
 class ProductFilter(django_filters.FilterSet):
-    category = django_filters.NumberFilter(field_name="category_id")
+    # Категория со всеми подкатегориями: префиксный запрос по индексу Category.path
+    category = django_filters.NumberFilter(method="filter_category_subtree")
     brand = django_filters.NumberFilter(field_name="brand_id")
     sku = django_filters.CharFilter(field_name="sku", lookup_expr="iexact")
 
@@ -13,3 +15,12 @@ class ProductFilter(django_filters.FilterSet):
     class Meta:
         model = Product
         fields = ["category", "brand", "sku", "price_min", "price_max"]
+
+    def filter_category_subtree(self, queryset, name, value):
+        path = subtree_path(value)
+        if path is None:
+            return queryset.none()
+        if not path:
+            # Путь ещё не заполнен (bulk_create без fill_root_paths) — только сама категория
+            return queryset.filter(category_id=value)
+        return queryset.filter(category__path__startswith=path)
@@ -0,0 +1,47 @@
+import time
+from datetime import date, datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop.retention import DEFAULT_BATCH_SIZE, DEFAULT_ORDER_ARCHIVE_DAYS, archive_orders
+
+
+class Command(BaseCommand):
+    help = "Move old orders with their items to the archive tables in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--before", help="archive orders created before this day (YYYY-MM-DD)")
+        parser.add_argument("--older-than-days", type=int, default=DEFAULT_ORDER_ARCHIVE_DAYS,
+                            help="used when --before is not given")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument("--pause", type=float, default=0, help="seconds to sleep between batches")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1 or options["pause"] < 0:
+            raise CommandError("--batch-size must be positive and --pause >= 0")
+        if options["before"]:
+            try:
+                day = date.fromisoformat(options["before"])
+            except ValueError:
+                raise CommandError("--before must be YYYY-MM-DD")
+            cutoff = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        elif options["older_than_days"] < 0:
+            raise CommandError("--older-than-days must be >= 0")
+        else:
+            cutoff = timezone.now() - timedelta(days=options["older_than_days"])
+
+        started = time.monotonic()
+        orders = items = 0
+        for batch_orders, batch_items in archive_orders(cutoff, options["batch_size"]):
+            orders += batch_orders
+            items += batch_items
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{orders} orders, {items} items archived so far")
+            if options["pause"]:
+                time.sleep(options["pause"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {orders} orders with {items} items created before {cutoff:%Y-%m-%d %H:%M} "
+            f"in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,58 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from shop.models import ArchivedOrder, Order
+from shop.rollups import rebuild_days
+
+
+def _parse_day(value, name):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"--{name} must be YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = "Recompute daily product/category/brand sales rollups from orders, a few days per transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="First day (YYYY-MM-DD), defaults to the first order")
+        parser.add_argument("--end", help="Last day (YYYY-MM-DD), defaults to the last order")
+        parser.add_argument("--chunk-days", type=int, default=7)
+
+    def handle(self, *args, **options):
+        if options["chunk_days"] < 1:
+            raise CommandError("--chunk-days must be positive")
+
+        # Архивные заказы (archive_orders) тоже входят в историю
+        bounds = [
+            model.objects.aggregate(first=Min("created_at"), last=Max("created_at"))
+            for model in (Order, ArchivedOrder)
+        ]
+        firsts = [b["first"] for b in bounds if b["first"] is not None]
+        lasts = [b["last"] for b in bounds if b["last"] is not None]
+        if not firsts and not (options["start"] and options["end"]):
+            self.stdout.write("No orders, nothing to backfill")
+            return
+        first = _parse_day(options["start"], "start") if options["start"] else timezone.localdate(min(firsts))
+        last = _parse_day(options["end"], "end") if options["end"] else timezone.localdate(max(lasts))
+        if first > last:
+            raise CommandError("--start is after --end")
+
+        started = time.monotonic()
+        day, rows = first, 0
+        while day <= last:
+            chunk_end = min(day + timedelta(days=options["chunk_days"] - 1), last)
+            with transaction.atomic():
+                rows += rebuild_days(day, chunk_end)
+            self.stdout.write(f"{day}..{chunk_end}: {rows} rollup rows so far")
+            day = chunk_end + timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled {first}..{last}: {rows} rows in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+from shop.benchmark import Dataset, middleware_overhead, seed_dataset
+
+
+class Command(BaseCommand):
+    help = "Per-request overhead of the full middleware stack vs LEAN_API_MIDDLEWARE on catalog endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=20)
+        parser.add_argument("--iterations", type=int, default=500)
+        parser.add_argument("--warmup", type=int, default=20)
+
+    def handle(self, *args, **options):
+        if options["products"] < 1 or options["iterations"] < 2:
+            raise CommandError("--products must be positive and --iterations at least 2")
+        dataset = Dataset(products=options["products"], images_per_product=1, users=0, cart_items=0, orders=0)
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            seeded = seed_dataset(dataset)
+            product = seeded["products"][0]
+            paths = [
+                "/websec/products/",
+                f"/websec/products/{product.pk}/",
+                f"/websec/products/bulk-get/?ids={product.pk}",
+                "/websec/products/suggest/?q=Ph",
+                "/websec/categories/",
+            ]
+            results = middleware_overhead(paths, options["iterations"], options["warmup"])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'path':<40}{'full p50 ms':>12}{'lean p50 ms':>12}{'saved us':>10}{'queries':>10}")
+        for path, modes in results.items():
+            full, lean = modes["full"], modes["lean"]
+            self.stdout.write(
+                f"{path:<40}{full['p50_ms']:>12}{lean['p50_ms']:>12}"
+                f"{(full['p50_ms'] - lean['p50_ms']) * 1000:>10.0f}{full['queries']:>5}/{lean['queries']}"
+            )
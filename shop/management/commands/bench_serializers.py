@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+from shop.benchmark import Dataset, seed_dataset, serializer_microbench
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark product list serialization (DRF vs compiled path) on a throwaway test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=2000)
+        parser.add_argument("--images-per-product", type=int, default=2)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options["products"] < 1 or options["repeat"] < 1:
+            raise CommandError("--products and --repeat must be positive")
+        dataset = Dataset(
+            products=options["products"], images_per_product=options["images_per_product"],
+            users=0, cart_items=0, orders=0,
+        )
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            seed_dataset(dataset)
+            results = serializer_microbench(Product.objects.order_by("-id"), options["repeat"])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        baseline = results["drf"]["rows_per_sec"]
+        self.stdout.write(f"{'variant':<18}{'rows':>8}{'best ms':>10}{'rows/s':>12}{'speedup':>9}")
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<18}{r['rows']:>8}{r['best_ms']:>10}{r['rows_per_sec']:>12}{r['rows_per_sec'] / baseline:>8.1f}x"
+            )
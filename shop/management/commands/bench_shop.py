@@ -0,0 +1,86 @@
+import json
+import platform
+from dataclasses import asdict, fields
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from django.utils import timezone
+
+from shop.benchmark import Dataset, build_scenarios, compare, load_report, run_client, run_server, seed_dataset
+
+
+class Command(BaseCommand):
+    help = "Seed a throwaway test database and measure latency/queries of the shop API"
+
+    def add_arguments(self, parser):
+        for f in fields(Dataset):
+            parser.add_argument(f"--{f.name.replace('_', '-')}", type=int, default=f.default)
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--server", choices=["none", "wsgi", "asgi"], default="wsgi",
+                            help="Also measure through a local server (asgi needs uvicorn)")
+        parser.add_argument("--only", nargs="*", help="Scenario names to run")
+        parser.add_argument("--output", default="bench_results.json")
+        parser.add_argument("--baseline", help="Previous results JSON to compare against")
+        parser.add_argument("--threshold", type=float, default=0.2,
+                            help="Allowed p95 slowdown vs baseline, 0.2 = 20%%")
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 1:
+            raise CommandError("--iterations must be positive")
+        dataset = Dataset(**{f.name: options[f.name] for f in fields(Dataset)})
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        # Свой кэш: run_client очищает его, а данные тестовой БД не должны попасть в общий Redis
+        private_cache = override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+        private_cache.enable()
+        try:
+            self.stdout.write(f"Seeding {dataset}")
+            seeded = seed_dataset(dataset)
+            scenarios = build_scenarios(seeded)
+            if options["only"]:
+                scenarios = [s for s in scenarios if s.name in options["only"]]
+            user = seeded["users"][0]
+
+            results = run_client(scenarios, user, options["iterations"], options["warmup"])
+            if options["server"] != "none":
+                results.update(run_server(options["server"], scenarios, user, options["iterations"], options["warmup"]))
+            vendor = connection.vendor
+        finally:
+            private_cache.disable()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "django": django.get_version(),
+                "python": platform.python_version(),
+                "database": vendor,
+                "dataset": asdict(dataset),
+                "iterations": options["iterations"],
+            },
+            "results": results,
+        }
+        with open(options["output"], "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+
+        self.stdout.write(f"{'scenario':<28}{'p50 ms':>10}{'p95 ms':>10}{'rps':>10}{'queries':>9}{'warm':>6}")
+        for name, r in results.items():
+            queries = "" if r["queries"] is None else r["queries"]
+            warm = "" if r.get("warm_queries") is None else r["warm_queries"]
+            self.stdout.write(
+                f"{name:<28}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['throughput_rps']:>10}{queries:>9}{warm:>6}"
+            )
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if options["baseline"]:
+            regressions = compare(results, load_report(options["baseline"]), options["threshold"])
+            if regressions:
+                raise CommandError("Regressions vs baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions vs baseline"))
@@ -0,0 +1,36 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.storage import collect_garbage, recount_refs
+
+
+class Command(BaseCommand):
+    help = "Delete uploaded media that no ProductImage references any more (run from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace-hours", type=float, default=1,
+                            help="keep unreferenced files touched within this many hours")
+        parser.add_argument("--recount", action="store_true",
+                            help="recompute reference counts first (after bulk_create/update())")
+        parser.add_argument("--dry-run", action="store_true", help="list, do not delete")
+
+    def handle(self, *args, **options):
+        if options["grace_hours"] < 0:
+            raise CommandError("--grace-hours must be >= 0")
+
+        started = time.monotonic()
+        if options["recount"]:
+            self.stdout.write(f"Corrected {recount_refs()} reference counts")
+        files = size = 0
+        for name, file_size in collect_garbage(timedelta(hours=options["grace_hours"]), options["dry_run"]):
+            files += 1
+            size += file_size
+            if options["verbosity"] > 1:
+                self.stdout.write(name)
+
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {files} unreferenced files ({size / 1024 / 1024:.1f} MiB) in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,190 @@
+import csv
+import json
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop.cache import bump_catalog_version
+from shop.categories import fill_root_paths, refresh_category_counts
+from shop.models import Brand, Category, Product, ProductTombstone
+
+PRODUCT_UPDATE_FIELDS = ["name", "price", "description", "quantity", "is_active", "category", "brand", "updated_at"]
+TRUE_VALUES = {"1", "true", "yes", "y", "on"}
+
+
+class RowError(ValueError):
+    pass
+
+
+def _read_csv(stream, delimiter):
+    for row in csv.DictReader(stream, delimiter=delimiter):
+        yield row
+
+
+def _read_jsonl(stream):
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield RowError(f"line {line_no}: {exc.msg}")
+
+
+def _clean_row(row):
+    sku = str(row.get("sku") or "").strip()
+    name = str(row.get("name") or "").strip()
+    brand = str(row.get("brand") or "").strip()
+    category = str(row.get("category") or "").strip()
+    if not sku or not name or not brand or not category:
+        raise RowError(f"sku={sku!r}: sku, name, brand and category are required")
+
+    try:
+        price = Decimal(str(row.get("price", "")).strip())
+        quantity = int(row.get("quantity") or 0)
+    except (InvalidOperation, ValueError):
+        raise RowError(f"sku={sku!r}: invalid price or quantity")
+    if price < 0 or quantity < 0:
+        raise RowError(f"sku={sku!r}: price and quantity must be >= 0")
+
+    is_active = row.get("is_active", True)
+    if not isinstance(is_active, bool):
+        is_active = str(is_active).strip().lower() in TRUE_VALUES
+
+    return {
+        "sku": sku,
+        "name": name,
+        "price": price,
+        "description": str(row.get("description") or ""),
+        "quantity": quantity,
+        "is_active": is_active,
+        "brand": brand,
+        "category": category,
+    }
+
+
+class Command(BaseCommand):
+    help = "Stream products from a CSV/JSONL file and upsert them by sku in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or JSONL file, '-' for stdin")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension")
+        parser.add_argument("--delimiter", default=",")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--max-errors", type=int, default=100, help="Abort after this many bad rows")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+        chunk_size = options["chunk_size"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        self.brands = dict(Brand.objects.values_list("name", "id"))
+        self.categories = dict(Category.objects.values_list("name", "id"))
+        self.errors = 0
+        self.max_errors = options["max_errors"]
+
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        started = time.monotonic()
+        total = 0
+        try:
+            rows = _read_jsonl(stream) if fmt == "jsonl" else _read_csv(stream, options["delimiter"])
+            chunk = {}
+            for raw in rows:
+                row = self._parse(raw)
+                if row is None:
+                    continue
+                # Дубликаты sku внутри чанка схлопываем: ON CONFLICT не может обновить строку дважды
+                chunk[row["sku"]] = row
+                if len(chunk) >= chunk_size:
+                    total += self._flush(chunk)
+                    chunk = {}
+                    self._report(total, started)
+            if chunk:
+                total += self._flush(chunk)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        refresh_category_counts()
+        bump_catalog_version()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {total} products in {elapsed:.1f}s "
+            f"({total / elapsed if elapsed else total:.0f} rows/s), skipped {self.errors} bad rows"
+        ))
+
+    def _parse(self, raw):
+        try:
+            if isinstance(raw, RowError):
+                raise raw
+            if not isinstance(raw, dict):
+                raise RowError("row is not an object")
+            return _clean_row(raw)
+        except RowError as exc:
+            self.errors += 1
+            self.stderr.write(f"Skipped: {exc}")
+            if self.errors > self.max_errors:
+                raise CommandError(f"Too many bad rows ({self.errors}), aborting")
+            return None
+
+    def _resolve(self, model, mapping, names, **extra):
+        missing = {name for name in names if name not in mapping}
+        if not missing:
+            return
+        objs = [model(name=name, **{k: f(name) for k, f in extra.items()}) for name in missing]
+        model.objects.bulk_create(objs, ignore_conflicts=True)
+        mapping.update(model.objects.filter(name__in=missing).values_list("name", "id"))
+
+        # Имя новое, но slug уже занят ("Phones" и "phones") — создаём по одному с суффиксом
+        for obj in objs:
+            if obj.name in mapping:
+                continue
+            base_slug, n = obj.slug, 1
+            while model.objects.filter(slug=obj.slug).exists():
+                n += 1
+                obj.slug = f"{base_slug}-{n}"
+            obj.save()
+            mapping[obj.name] = obj.pk
+
+    def _flush(self, chunk):
+        rows = chunk.values()
+        with transaction.atomic():
+            self._resolve(Brand, self.brands, {r["brand"] for r in rows})
+            self._resolve(Category, self.categories, {r["category"] for r in rows}, slug=Category.make_slug)
+            fill_root_paths()
+
+            products = [
+                Product(
+                    sku=r["sku"],
+                    name=r["name"],
+                    price=r["price"],
+                    description=r["description"],
+                    quantity=r["quantity"],
+                    is_active=r["is_active"],
+                    brand_id=self.brands[r["brand"]],
+                    category_id=self.categories[r["category"]],
+                )
+                for r in rows
+            ]
+            # Товары, которые этот чанк снимает с продажи, — в ленту изменений
+            deactivated = list(Product.objects.filter(
+                sku__in=[r["sku"] for r in rows if not r["is_active"]], is_active=True,
+            ).values_list("id", "sku"))
+            Product.objects.bulk_create(
+                products,
+                update_conflicts=True,
+                unique_fields=["sku"],
+                update_fields=PRODUCT_UPDATE_FIELDS,
+            )
+            ProductTombstone.record(deactivated, ProductTombstone.Reason.DEACTIVATED)
+        return len(products)
+
+    def _report(self, total, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{total} rows, {total / elapsed if elapsed else total:.0f} rows/s")
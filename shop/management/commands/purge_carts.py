@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.retention import DEFAULT_BATCH_SIZE, DEFAULT_EMPTY_CART_DAYS, DEFAULT_STALE_CART_DAYS, purge_carts
+
+
+class Command(BaseCommand):
+    help = "Delete empty and abandoned carts in small batches (run from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--empty-days", type=int, default=DEFAULT_EMPTY_CART_DAYS,
+                            help="delete empty carts untouched for this many days")
+        parser.add_argument("--stale-days", type=int, default=DEFAULT_STALE_CART_DAYS,
+                            help="delete any cart untouched for this many days")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument("--pause", type=float, default=0, help="seconds to sleep between batches")
+        parser.add_argument("--dry-run", action="store_true", help="count, do not delete")
+
+    def handle(self, *args, **options):
+        if options["empty_days"] < 0 or options["stale_days"] < 0:
+            raise CommandError("--empty-days and --stale-days must be >= 0")
+        if options["batch_size"] < 1 or options["pause"] < 0:
+            raise CommandError("--batch-size must be positive and --pause >= 0")
+
+        started = time.monotonic()
+        carts = items = 0
+        for batch_carts, batch_items in purge_carts(
+            options["empty_days"], options["stale_days"], options["batch_size"], options["dry_run"],
+        ):
+            carts += batch_carts
+            items += batch_items
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{carts} carts, {items} items so far")
+            if options["pause"]:
+                time.sleep(options["pause"])
+
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {carts} carts with {items} items in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.cache import bump_catalog_version
+from shop.categories import fill_root_paths, refresh_category_counts
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized subtree product counts of categories (repairs drift after raw bulk writes)"
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        fill_root_paths()
+        changed = refresh_category_counts()
+        if changed:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Category counts refreshed: {changed} changed in {time.monotonic() - started:.1f}s"
+        ))
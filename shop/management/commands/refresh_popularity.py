@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.popularity import refresh_popularity
+
+
+class Command(BaseCommand):
+    help = "Recompute units sold over 7/30 days and wishlist counts on products (run from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+
+        started = time.monotonic()
+        seen = updated = 0
+        for seen, updated in refresh_popularity(options["batch_size"]):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{seen} products checked, {updated} updated")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Popularity refreshed: {seen} products, {updated} updated in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,112 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections
+from django.db.models import Max
+from django.utils import timezone
+
+from shop.cache import bump_catalog_version
+from shop.categories import refresh_category_counts
+from shop.models import Brand, Category, Product, ProductImage, Cart, CartItem, Order, OrderItem
+from shop.synthetic import SeedPlan, init_worker, run_chunk, seed_reference_data
+
+
+def _next_id(model):
+    return (model.objects.aggregate(m=Max("id"))["m"] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = "Generate a large deterministic synthetic dataset (catalog, users, carts, orders)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--brands", type=int, default=200)
+        parser.add_argument("--categories", type=int, default=100)
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--images-per-product", type=int, default=2, help="Average, actual count varies")
+        parser.add_argument("--users", type=int, default=50_000)
+        parser.add_argument("--cart-ratio", type=float, default=0.3, help="Share of users with a non-empty cart")
+        parser.add_argument("--orders", type=int, default=200_000)
+        parser.add_argument("--max-order-items", type=int, default=20)
+        parser.add_argument("--days", type=int, default=365, help="Spread orders over the last N days")
+        parser.add_argument("--chunk-size", type=int, default=10_000)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--no-copy", action="store_true", help="Use bulk_create even on PostgreSQL")
+        parser.add_argument("--password", default="password", help="Password for every generated user")
+
+    def handle(self, *args, **options):
+        for name in ("brands", "categories", "products", "users", "chunk_size", "max_order_items", "days"):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be positive")
+
+        workers = options["workers"]
+        if connection.vendor == "sqlite" and workers > 1:
+            # SQLite не переносит параллельную запись из нескольких процессов
+            self.stdout.write("SQLite detected, using a single worker")
+            workers = 1
+
+        User = get_user_model()
+        plan = SeedPlan(
+            seed=options["seed"],
+            brands=options["brands"],
+            categories=options["categories"],
+            products=options["products"],
+            images_per_product=options["images_per_product"],
+            users=options["users"],
+            cart_ratio=options["cart_ratio"],
+            orders=options["orders"],
+            max_order_items=options["max_order_items"],
+            days=options["days"],
+            chunk_size=options["chunk_size"],
+            use_copy=not options["no_copy"],
+        )
+        plan = replace(
+            plan,
+            brand_base=_next_id(Brand),
+            category_base=_next_id(Category),
+            product_base=_next_id(Product),
+            user_base=_next_id(User),
+            cart_base=_next_id(Cart),
+            order_base=_next_id(Order),
+            password_hash=make_password(options["password"]),
+            now_ts=timezone.now().timestamp(),
+        )
+
+        started = time.monotonic()
+        seed_reference_data(plan)
+        connections.close_all()
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            for phase, total, base in (
+                ("products", plan.products, plan.product_base),
+                ("users", plan.users, plan.user_base),
+                ("orders", plan.orders, plan.order_base),
+            ):
+                phase_started = time.monotonic()
+                futures = [
+                    pool.submit(run_chunk, phase, plan, chunk, base + offset, min(plan.chunk_size, total - offset))
+                    for chunk, offset in enumerate(range(0, total, plan.chunk_size))
+                ]
+                # Фазы строго по очереди: заказы ссылаются на товары и пользователей
+                done = sum(f.result() for f in futures)
+                elapsed = time.monotonic() - phase_started
+                self.stdout.write(f"{phase}: {done} rows in {elapsed:.1f}s ({done / elapsed if elapsed else done:.0f}/s)")
+
+        # Явные id не двигают sequence в PostgreSQL
+        sequence_sql = connection.ops.sequence_reset_sql(
+            no_style(), [Brand, Category, Product, ProductImage, User, Cart, CartItem, Order, OrderItem]
+        )
+        if sequence_sql:
+            with connection.cursor() as cursor:
+                for sql in sequence_sql:
+                    cursor.execute(sql)
+
+        refresh_category_counts()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Seeded in {time.monotonic() - started:.1f}s (seed={plan.seed})"))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.cache import cache_is_shared
+from shop.warmup import warm, warm_urls
+
+
+class Command(BaseCommand):
+    help = "Precompute cached catalog responses (brand/category lists, top product lists and facets) in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=10, help="categories, brands and their pairs to warm")
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--host", default="localhost", help="public host name: image URLs and cache keys use it")
+        parser.add_argument("--https", action="store_true")
+        parser.add_argument("--refresh", action="store_true", help="recompute entries that are still fresh (cron)")
+
+    def handle(self, *args, **options):
+        if options["top"] < 0 or options["workers"] < 1:
+            raise CommandError("--top must be >= 0 and --workers positive")
+        if not cache_is_shared():
+            # LocMemCache живёт в процессе команды и пропадает вместе с ним
+            raise CommandError("CACHES['default'] is per-process (LocMemCache): configure Redis or Memcached to warm it")
+
+        started = time.monotonic()
+        urls = warm_urls(options["top"])
+        failed = 0
+        for url, status, seconds in warm(
+            urls, options["host"], options["https"], options["workers"], options["refresh"],
+        ):
+            if status >= 400:
+                failed += 1
+                self.stderr.write(f"{url}: HTTP {status}")
+            elif options["verbosity"] > 1:
+                self.stdout.write(f"{url}: {seconds * 1000:.0f} ms")
+
+        message = f"Warmed {len(urls) - failed}/{len(urls)} catalog URLs in {time.monotonic() - started:.1f}s"
+        if failed:
+            raise CommandError(message)
+        self.stdout.write(self.style.SUCCESS(message))
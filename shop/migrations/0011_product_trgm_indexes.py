@@ -0,0 +1,35 @@
+from django.db import migrations
+
+TRGM_INDEXES = {
+    "shop_product_name_trgm": 'UPPER("name") gin_trgm_ops',
+    "shop_product_sku_trgm": 'UPPER("sku") gin_trgm_ops',
+}
+
+
+def create_trgm_indexes(apps, schema_editor):
+    # Только PostgreSQL: на SQLite подсказки строятся через in-memory префиксное дерево
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, expression in TRGM_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{name}" ON "shop_product" USING gin ({expression})'
+        )
+
+
+def drop_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in TRGM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_alter_order_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trgm_indexes, drop_trgm_indexes),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-19 17:36
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_media_files'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('previous_price', models.DecimalField(decimal_places=0, max_digits=10)),
+                ('price', models.DecimalField(decimal_places=0, max_digits=10)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='price_history', to='shop.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-changed_at'], name='shop_price_history_idx')],
+            },
+        ),
+    ]
@@ -1,6 +1,13 @@
-from django.db import models
+import os
+
+# Модулем, а не ValidationError: views/admin импортируют models через *
+from django.core import exceptions
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.core.validators import MinValueValidator
 from django.conf import settings
+from django.utils import timezone
 
 # Create your models here.
 class Brand(models.Model):
@@ -12,12 +19,66 @@ class Brand(models.Model):
 class Category(models.Model):
     name=models.CharField(max_length=128, unique=True)
     slug = models.SlugField(max_length=120, unique=True, blank=True)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    # Материализованный путь "1/5/9/" — id предков и свой; поддерево = path LIKE '1/5/%'
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Активные товары во всём поддереве, для меню (shop.categories)
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+
+    @staticmethod
+    def make_slug(name):
+        return '-'.join(name.lower().split())
+
+    @staticmethod
+    def path_ids(path):
+        """Ids of the category and its ancestors, root first."""
+        return [int(part) for part in path.split('/') if part]
+
+    def _parent_path(self):
+        if self.parent_id is None:
+            return ''
+        return Category.objects.values_list('path', flat=True).get(pk=self.parent_id)
+
+    def clean(self):
+        super().clean()
+        if self.pk is not None and self.parent_id is not None and self.pk in self.path_ids(self._parent_path()):
+            raise exceptions.ValidationError({'parent': 'Категория не может быть вложена в саму себя или в своё поддерево'})
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            words = self.name.lower().split()
-            self.slug = '-'.join(words)
-        super().save(*args, **kwargs)
+            self.slug = self.make_slug(self.name)
+        parent_path = self._parent_path()
+        if self.pk is not None and self.pk in self.path_ids(parent_path):
+            raise ValueError('Категория не может быть вложена в саму себя или в своё поддерево')
+        old = None
+        if not self._state.adding:
+            old = Category.objects.filter(pk=self.pk).values_list('path', 'depth', 'product_count').first()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            path = f'{parent_path}{self.pk}/'
+            if old is None or old[0] != path:
+                self._move(old, path)
+
+    def _move(self, old, path):
+        depth = len(self.path_ids(path)) - 1
+        Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+        if old is not None and old[0]:
+            old_path, old_depth, count = old
+            # Потомки переезжают одним UPDATE: меняется только префикс пути
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (depth - old_depth),
+            )
+            # Товары поддерева уходят из счётчиков старых предков и приходят к новым
+            if count:
+                Category.objects.filter(pk__in=self.path_ids(old_path)[:-1]).update(
+                    product_count=F('product_count') - count
+                )
+                Category.objects.filter(pk__in=self.path_ids(path)[:-1]).update(
+                    product_count=F('product_count') + count
+                )
+        self.path, self.depth = path, depth
 
     def __str__(self):
         return f'{self.name}'
@@ -39,24 +100,109 @@ class Product(models.Model):
         on_delete=models.CASCADE,
         related_name="products",
     )
+    # Денормализованная популярность для сортировки, пересчитывает команда refresh_popularity
+    units_sold_7d = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+    units_sold_30d = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+    wishlist_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+    # Для ленты изменений; queryset.update() должен выставлять его сам
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["updated_at", "id"], name="shop_product_changes_idx")]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем, был ли товар активен при загрузке: снятие с продажи пишет tombstone
+        instance._loaded_is_active = instance.__dict__.get("is_active")
+        # Для уведомлений об остатках (shop.stock_stream)
+        instance._loaded_quantity = instance.__dict__.get("quantity")
+        # Для PriceHistory
+        instance._loaded_price = instance.__dict__.get("price")
+        # Категория, в счётчике которой товар учтён (Category.product_count)
+        active = instance.__dict__.get("is_active")
+        instance._counted_category_id = instance.__dict__.get("category_id") if active else None
+        return instance
 
     def __str__(self):
         return f"({self.sku}) {self.name} "
     
+class PriceHistory(models.Model):
+    """Смена цены товара: пишут shop.bulk_update пачками и сохранение товара (shop.signals)."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="price_history", db_index=False)
+    previous_price = models.DecimalField(max_digits=10, decimal_places=0)
+    price = models.DecimalField(max_digits=10, decimal_places=0)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # Покрывает и FK: история товара читается по (product, changed_at)
+        indexes = [models.Index(fields=["product", "-changed_at"], name="shop_price_history_idx")]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.previous_price} -> {self.price}"
+
+
+class ProductTombstone(models.Model):
+    """Удалённый или снятый с продажи товар — для ленты изменений каталога."""
+    class Reason(models.TextChoices):
+        DELETED = "deleted", "Удалён"
+        DEACTIVATED = "deactivated", "Снят с продажи"
+
+    # Не FK: товара может уже не быть
+    product_id = models.IntegerField(db_index=True)
+    sku = models.CharField(max_length=50)
+    reason = models.CharField(max_length=20, choices=Reason.choices)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.sku}: {self.reason}"
+
+    @classmethod
+    def record(cls, products, reason):
+        """products: iterable of (id, sku)."""
+        return cls.objects.bulk_create(
+            cls(product_id=product_id, sku=sku, reason=reason) for product_id, sku in products
+        )
+
 class ProductImage(models.Model):
     image = models.ImageField(upload_to='product_images')
     name = models.CharField(blank=True, null=True)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Для подсчёта ссылок на файлы (shop.storage)
+        image = instance.__dict__.get("image")
+        instance._loaded_image = getattr(image, "name", image)
+        return instance
+
     def save(self, *args, **kwargs):
-        self.name = self.image.name.split('.')[0].capitalize()
+        # Имя берём из исходного имени загрузки: сохранённый файл называется хешем содержимого
+        if not self.name or not self.image._committed:
+            self.name = os.path.basename(self.image.name).split('.')[0].capitalize()
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f'{self.name}: {self.product}'
 
+
+class MediaFile(models.Model):
+    """Файл content-addressed хранилища (shop.storage); refs — сколько ProductImage на него ссылается."""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    refs = models.PositiveIntegerField(default=0)
+    # Последняя загрузка этого содержимого: gc_media не трогает свежие файлы без ссылок
+    touched_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refs})"
+
 class Cart(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Обновляется при любом изменении позиций (shop.signals) — валидатор для ETag
+    # Индекс — для purge_carts
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.user}'
@@ -141,4 +287,89 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.product} x {self.quantity}"
-    
+
+
+class ArchivedOrder(models.Model):
+    """Заказ, перенесённый командой archive_orders; id сохраняется, API истории читает оба места."""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="archived_orders")
+    status = models.CharField(max_length=20, choices=Order.Status.choices)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(db_index=True)
+    shipping_address = models.TextField()
+    delivery_method = models.CharField(max_length=20, choices=Order.DeliveryMethod.choices)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Архивный заказ #{self.pk} на {self.total_amount}"
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="archived_order_items")
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=0)
+    subtotal = models.DecimalField(max_digits=10, decimal_places=0)
+
+    def __str__(self):
+        return f"{self.product} x {self.quantity}"
+
+
+class DailySales(models.Model):
+    """Дневной срез продаж; пишется только из shop.rollups, читается аналитикой."""
+    day = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class ProductDailySales(DailySales):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="daily_sales")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["product", "day"], name="uniq_product_daily_sales")]
+        indexes = [models.Index(fields=["day"])]
+
+
+class CategoryDailySales(DailySales):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="daily_sales")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["category", "day"], name="uniq_category_daily_sales")]
+        indexes = [models.Index(fields=["day"])]
+
+
+class BrandDailySales(DailySales):
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE, related_name="daily_sales")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["brand", "day"], name="uniq_brand_daily_sales")]
+        indexes = [models.Index(fields=["day"])]
+
+
+class ProductRecommendation(models.Model):
+    """«Покупают вместе»: соседи товара по заказам, пересобирает команда build_recommendations."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="recommendations")
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    # Сколько заказов содержат оба товара
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "recommended"], name="uniq_product_recommendation"),
+        ]
+        indexes = [models.Index(fields=["product", "-score"], name="shop_rec_product_score_idx")]
+
+
+class JobCheckpoint(models.Model):
+    """Водяной знак инкрементальных фоновых задач (например, последний обработанный id заказа)."""
+    name = models.CharField(max_length=64, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
@@ -0,0 +1,77 @@
+# shop/multiget.py
+"""
+Batched product hydration with a per-product object cache.
+
+Each product is cached under ``shop:product:v<catalog version>:<id>`` as its
+``ProductSerializer`` representation with relative image URLs (hosts differ per
+request). A call reads all ids with one ``get_many``; only the misses are loaded,
+in one query through the compiled serializer, and written back with ``set_many``.
+Catalog version bumps (signals) and ``invalidate_products()`` keep entries fresh.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import catalog_cache_timeout, get_catalog_version
+from .compiled import compiled_product_list
+
+DEFAULT_MAX_IDS = 100
+# Больше bigint PostgreSQL не примет: OverflowError вместо пустого результата
+MAX_ID = 2 ** 63 - 1
+
+
+def max_ids():
+    return getattr(settings, "SHOP_BULK_GET_MAX_IDS", DEFAULT_MAX_IDS)
+
+
+def parse_ids(values):
+    """Unique positive ints (up to ``MAX_ID``) in request order; raises TypeError/ValueError on anything else."""
+    ids = []
+    for value in values:
+        # int(True) == 1 и int(1.5) == 1 — из JSON принимаем только целые и строки
+        if isinstance(value, (bool, float)):
+            raise TypeError(value)
+        pk = int(value)
+        if not 1 <= pk <= MAX_ID:
+            raise ValueError(value)
+        ids.append(pk)
+    return list(dict.fromkeys(ids))
+
+
+def product_cache_keys(ids):
+    version = get_catalog_version()
+    return {pk: f"shop:product:v{version}:{pk}" for pk in ids}
+
+
+def invalidate_products(ids):
+    """For ``queryset.update()`` paths that change products without bumping the catalog version."""
+    cache.delete_many(list(product_cache_keys(ids).values()))
+
+
+def _absolute(item, request):
+    images = item.get("images")
+    if request is None or not images:
+        return item
+    return {
+        **item,
+        "images": [
+            {**image, "image": request.build_absolute_uri(image["image"]) if image["image"] else None}
+            for image in images
+        ],
+    }
+
+
+def get_products(queryset, ids, request=None):
+    """Returns (representations in ``ids`` order, ids not found in ``queryset``)."""
+    keys = product_cache_keys(ids)
+    cached = cache.get_many(list(keys.values()))
+    found = {pk: cached[key] for pk, key in keys.items() if key in cached}
+
+    misses = [pk for pk in ids if pk not in found]
+    if misses:
+        loaded = {
+            item["id"]: item for item in compiled_product_list().serialize(queryset.filter(pk__in=misses))
+        }
+        cache.set_many({keys[pk]: item for pk, item in loaded.items()}, catalog_cache_timeout("product", 300))
+        found.update(loaded)
+
+    return [_absolute(found[pk], request) for pk in ids if pk in found], [pk for pk in ids if pk not in found]
@@ -0,0 +1,79 @@
+# shop/popularity.py
+"""
+Recomputes Product.units_sold_7d / units_sold_30d / wishlist_count.
+
+Sales come from the daily rollups (shop.rollups), wishlist counts from the
+User.wishlist through table; products are walked by id in batches and only
+changed rows are written.
+"""
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .models import Product, ProductDailySales
+
+POPULARITY_FIELDS = ["units_sold_7d", "units_sold_30d", "wishlist_count"]
+
+
+def _sales(product_ids, today):
+    rows = (
+        ProductDailySales.objects.filter(product_id__in=product_ids, day__gt=today - timedelta(days=30))
+        .values("product_id")
+        .annotate(
+            units_7d=Sum("units", filter=Q(day__gt=today - timedelta(days=7))),
+            units_30d=Sum("units"),
+        )
+        .order_by()
+    )
+    return {r["product_id"]: (r["units_7d"] or 0, r["units_30d"] or 0) for r in rows}
+
+
+def _wishlists(product_ids):
+    through = get_user_model().wishlist.through
+    rows = (
+        through.objects.filter(product_id__in=product_ids)
+        .values("product_id")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+    return {r["product_id"]: r["total"] for r in rows}
+
+
+def refresh_batch(products, today):
+    """Updates ``products`` (loaded with POPULARITY_FIELDS) in place; returns the changed ones."""
+    ids = [p.pk for p in products]
+    sales, wishlists = _sales(ids, today), _wishlists(ids)
+    changed = []
+    for product in products:
+        units_7d, units_30d = sales.get(product.pk, (0, 0))
+        values = (units_7d, units_30d, wishlists.get(product.pk, 0))
+        if values != tuple(getattr(product, f) for f in POPULARITY_FIELDS):
+            product.units_sold_7d, product.units_sold_30d, product.wishlist_count = values
+            changed.append(product)
+    if changed:
+        Product.objects.bulk_update(changed, POPULARITY_FIELDS)
+    return changed
+
+
+def refresh_popularity(batch_size=2000, today=None):
+    """Yields (products seen, products changed) after every batch."""
+    today = today or timezone.localdate()
+    last_id, seen, updated = 0, 0, 0
+    while True:
+        batch = list(
+            Product.objects.filter(pk__gt=last_id).order_by("pk").only("pk", *POPULARITY_FIELDS)[:batch_size]
+        )
+        if not batch:
+            if updated:
+                # Счётчики видны в ответах API: сбрасываем кэши и ETag каталога
+                bump_catalog_version()
+            return
+        with transaction.atomic():
+            updated += len(refresh_batch(batch, today))
+        seen += len(batch)
+        last_id = batch[-1].pk
+        yield seen, updated
@@ -0,0 +1,47 @@
+# shop/queries.py
+from django.db.models import Max, Prefetch, prefetch_related_objects
+
+from .models import Cart, CartItem, OrderItem, ProductImage
+
+
+def with_product_relations(queryset, prefix=""):
+    # Всё, что рендерит ProductSerializer: категория, бренд и картинки (по id — как в shop.compiled)
+    return queryset.select_related(f"{prefix}category", f"{prefix}brand").prefetch_related(
+        Prefetch(f"{prefix}productimage_set", queryset=ProductImage.objects.order_by("id"))
+    )
+
+
+def cart_items_prefetch():
+    return Prefetch("cartitem_set", queryset=with_product_relations(CartItem.objects.order_by("id"), "product__"))
+
+
+def order_items_prefetch(item_model=OrderItem):
+    """``item_model`` — ``ArchivedOrderItem`` for archived orders."""
+    return Prefetch("items", queryset=with_product_relations(item_model.objects.order_by("id"), "product__"))
+
+
+def get_cart(user, lookups=None):
+    """``lookups`` replaces the default prefetch (e.g. ``e_commerce.fieldsets.prefetch_lookups()``)."""
+    cart, _ = Cart.objects.get_or_create(user=user)
+    if lookups is None:
+        lookups = [cart_items_prefetch()]
+    prefetch_related_objects([cart], *lookups)
+    return cart
+
+
+def cart_version(user):
+    """
+    (id, last change) of the user's cart without loading items, or None if there is no
+    cart yet. The last change also covers the products in the cart (stock, price).
+    """
+    row = (
+        Cart.objects.filter(user=user)
+        .annotate(products_updated_at=Max("cartitem__product__updated_at"))
+        .values_list("id", "updated_at", "products_updated_at")
+        .first()
+    )
+    if row is None:
+        return None
+    cart_id, updated_at, products_updated_at = row
+    # Оформление чужого заказа меняет остаток товара в корзине, но не саму корзину
+    return cart_id, max(updated_at, products_updated_at or updated_at)
@@ -0,0 +1,207 @@
+# shop/recommendations.py
+"""
+Frequently-bought-together, precomputed from order history.
+
+Pair counts come from the basket matrix X (orders × products): XᵀX, counted with
+SciPy sparse matrices when NumPy/SciPy are installed and with a pure-Python counter
+otherwise. Every product keeps its ``KEEP_CANDIDATES`` strongest neighbours in
+``ProductRecommendation``.
+
+Archived orders (``shop.retention``) keep their ids and are read alongside the live ones.
+Incremental runs only read orders past the ``JobCheckpoint`` watermark and add their
+counts to the stored neighbours. The watermark stops at orders created
+``SHOP_RECOMMENDATIONS_LAG_SECONDS`` before now: ids are taken before commit, so a
+newer order could otherwise move it past an older one still in flight. Orders past
+the watermark are counted by a later run; a pair that had dropped out of a product's
+candidates starts again from zero, so ``build_recommendations --full`` should still
+run now and then to get exact counts.
+"""
+import heapq
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import chain, combinations, groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, ProductRecommendation, JobCheckpoint
+
+CHECKPOINT_NAME = "frequently_bought_together"
+KEEP_CANDIDATES = 50
+# Оптовые заказы дают O(n²) пар и мало говорят о сочетаемости товаров
+MAX_BASKET_SIZE = 50
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+ENGINES = ("auto", "numpy", "python")
+DEFAULT_LAG_SECONDS = 60
+# Заказ лежит либо в Order, либо в архиве с тем же id
+ORDER_SOURCES = ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem))
+
+
+class PythonPairCounter:
+    name = "python"
+
+    def __init__(self):
+        self.counts = defaultdict(Counter)
+
+    def add(self, baskets):
+        for basket in baskets:
+            for a, b in combinations(basket, 2):
+                self.counts[a][b] += 1
+                self.counts[b][a] += 1
+
+    def rows(self):
+        for product_id, neighbours in self.counts.items():
+            yield product_id, neighbours
+
+
+class SparsePairCounter:
+    name = "numpy"
+
+    def __init__(self):
+        import numpy  # опционально: без NumPy/SciPy работает PythonPairCounter
+        from scipy import sparse
+        self.np, self.sparse = numpy, sparse
+        self.matrix = None
+
+    def add(self, baskets):
+        if not baskets:
+            return
+        np = self.np
+        lengths = np.fromiter(map(len, baskets), dtype=np.int64, count=len(baskets))
+        columns = np.fromiter(chain.from_iterable(baskets), dtype=np.int64, count=int(lengths.sum()))
+        rows = np.repeat(np.arange(len(baskets)), lengths)
+        size = int(columns.max()) + 1
+        baskets_matrix = self.sparse.csr_matrix(
+            (np.ones(len(columns), dtype=np.int32), (rows, columns)), shape=(len(baskets), size),
+        )
+        pairs = (baskets_matrix.T @ baskets_matrix).tocsr()
+        pairs.setdiag(0)
+        pairs.eliminate_zeros()
+
+        if self.matrix is None:
+            self.matrix = pairs
+            return
+        size = max(size, self.matrix.shape[0])
+        self.matrix.resize((size, size))
+        pairs.resize((size, size))
+        self.matrix = self.matrix + pairs
+
+    def rows(self):
+        if self.matrix is None:
+            return
+        indptr, indices, data = self.matrix.indptr, self.matrix.indices, self.matrix.data
+        for product_id in self.np.flatnonzero(self.np.diff(indptr)).tolist():
+            start, end = indptr[product_id], indptr[product_id + 1]
+            yield product_id, dict(zip(indices[start:end].tolist(), data[start:end].tolist()))
+
+
+def make_counter(engine="auto"):
+    if engine != "python":
+        try:
+            return SparsePairCounter()
+        except ImportError:
+            if engine == "numpy":
+                raise
+    return PythonPairCounter()
+
+
+def iter_baskets(after_id, until_id, chunk_size):
+    """Yields (orders read, baskets) for orders in (after_id, until_id], ``chunk_size`` orders per table at a time."""
+    while after_id < until_id:
+        upper = until_id
+        for order_model, _ in ORDER_SOURCES:
+            ids = order_model.objects.filter(id__gt=after_id, id__lte=until_id).order_by("id")
+            ids = ids.values_list("id", flat=True)
+            upper = min(upper, ids[chunk_size - 1:chunk_size].first() or until_id)
+        orders, baskets = 0, []
+        for _, item_model in ORDER_SOURCES:
+            rows = (
+                item_model.objects.filter(order_id__gt=after_id, order_id__lte=upper)
+                .order_by("order_id")
+                .values_list("order_id", "product_id")
+            )
+            for _, group in groupby(rows.iterator(chunk_size=chunk_size * 4), key=itemgetter(0)):
+                orders += 1
+                basket = sorted({product_id for _, product_id in group})
+                if 1 < len(basket) <= MAX_BASKET_SIZE:
+                    baskets.append(basket)
+        yield orders, baskets
+        after_id = upper
+
+
+def _strongest(neighbours, keep):
+    # При равном счёте — меньший id, чтобы результат не зависел от движка подсчёта
+    return heapq.nlargest(keep, neighbours.items(), key=lambda pair: (pair[1], -pair[0]))
+
+
+def _store(rows, keep, merge, batch_size=500):
+    products = 0
+    batch = []
+
+    def flush():
+        ids = [product_id for product_id, _ in batch]
+        if merge:
+            stored = defaultdict(dict)
+            for product_id, other, score in ProductRecommendation.objects.filter(
+                product_id__in=ids,
+            ).values_list("product_id", "recommended_id", "score"):
+                stored[product_id][other] = score
+            for product_id, delta in batch:
+                merged = stored[product_id]
+                for other, count in delta.items():
+                    merged[other] = merged.get(other, 0) + count
+            batch[:] = [(product_id, stored[product_id]) for product_id in ids]
+            ProductRecommendation.objects.filter(product_id__in=ids).delete()
+        ProductRecommendation.objects.bulk_create(
+            [
+                ProductRecommendation(product_id=product_id, recommended_id=other, score=score)
+                for product_id, neighbours in batch
+                for other, score in _strongest(neighbours, keep)
+            ],
+            batch_size=2000,
+        )
+        batch.clear()
+
+    for row in rows:
+        batch.append(row)
+        products += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return products
+
+
+def settled_order_id():
+    """Largest order id created at least ``SHOP_RECOMMENDATIONS_LAG_SECONDS`` ago, in either table."""
+    lag = getattr(settings, "SHOP_RECOMMENDATIONS_LAG_SECONDS", DEFAULT_LAG_SECONDS)
+    horizon = timezone.now() - timedelta(seconds=lag)
+    # По индексу id с конца: пропускаются только заказы последних секунд
+    return max(
+        order_model.objects.filter(created_at__lt=horizon).order_by("-id").values_list("id", flat=True).first() or 0
+        for order_model, _ in ORDER_SOURCES
+    )
+
+
+def build_recommendations(full=False, chunk_size=5000, keep=KEEP_CANDIDATES, engine="auto"):
+    """Counts settled orders past the watermark (all settled orders with ``full``) and updates the table."""
+    counter = make_counter(engine)
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=CHECKPOINT_NAME)
+    after_id = 0 if full else checkpoint.position
+    until_id = settled_order_id()
+
+    orders = 0
+    for read, baskets in iter_baskets(after_id, until_id, chunk_size):
+        orders += read
+        counter.add(baskets)
+
+    with transaction.atomic():
+        if full:
+            ProductRecommendation.objects.all().delete()
+        products = _store(counter.rows(), keep, merge=not full)
+        checkpoint.position = max(until_id, after_id)
+        checkpoint.save(update_fields=["position", "updated_at"])
+    return {"engine": counter.name, "orders": orders, "products": products, "watermark": checkpoint.position}
@@ -0,0 +1,100 @@
+# shop/retention.py
+"""
+Batch jobs that keep the hot tables small: abandoned cart purge and order archival.
+
+Both walk the primary key in batches of ``batch_size`` rows, one short transaction
+per batch, so row locks are held briefly and only on the batch; concurrent checkouts
+and cart updates are never blocked behind a table-wide ``DELETE``. Rows locked by
+other transactions are skipped (``SKIP LOCKED``) and picked up by the next run.
+
+Archived orders keep their ids and are served by the order history API
+(``GET /orders/?archived=true``, ``GET /orders/{id}/``), the exports and
+``backfill_rollups``.
+"""
+from datetime import timedelta
+
+from django.db import connections, router, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, Cart, CartItem, Order, OrderItem
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_EMPTY_CART_DAYS = 7
+DEFAULT_STALE_CART_DAYS = 90
+DEFAULT_ORDER_ARCHIVE_DAYS = 365
+
+
+def purgeable_carts(empty_days=DEFAULT_EMPTY_CART_DAYS, stale_days=DEFAULT_STALE_CART_DAYS, now=None):
+    """Empty carts untouched for ``empty_days`` and any cart untouched for ``stale_days``."""
+    now = now or timezone.now()
+    empty = ~Exists(CartItem.objects.filter(cart=OuterRef("pk")))
+    return Cart.objects.filter(
+        Q(empty, updated_at__lt=now - timedelta(days=empty_days))
+        | Q(updated_at__lt=now - timedelta(days=stale_days))
+    )
+
+
+def _delete_ids(model, field_name, ids):
+    """``DELETE ... WHERE field IN (ids)`` without collecting rows or sending signals; returns the row count."""
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    column = model._meta.get_field(field_name).column
+    placeholders = ", ".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {qn(model._meta.db_table)} WHERE {qn(column)} IN ({placeholders})", ids)
+        return cursor.rowcount
+
+
+def _locked_batch(queryset, after, batch_size):
+    return list(
+        queryset.select_for_update(skip_locked=True)
+        .filter(pk__gt=after).order_by("pk").values_list("pk", flat=True)[:batch_size]
+    )
+
+
+def purge_carts(empty_days=DEFAULT_EMPTY_CART_DAYS, stale_days=DEFAULT_STALE_CART_DAYS,
+                batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """Deletes purgeable carts with their items; yields (carts, items) per batch."""
+    queryset = purgeable_carts(empty_days, stale_days)
+    after = 0
+    while True:
+        with transaction.atomic():
+            ids = _locked_batch(queryset, after, batch_size)
+            if not ids:
+                return
+            if dry_run:
+                deleted = len(ids), CartItem.objects.filter(cart_id__in=ids).count()
+            else:
+                # Без сигналов: touch_cart обновлял бы удаляемую корзину на каждую позицию
+                items_deleted = _delete_ids(CartItem, "cart", ids)
+                deleted = _delete_ids(Cart, "id", ids), items_deleted
+        after = ids[-1]
+        yield deleted
+
+
+def _copy(rows, model):
+    return [model(**row) for row in rows]
+
+
+def archive_orders(before, batch_size=DEFAULT_BATCH_SIZE):
+    """Moves orders created before ``before`` with their items to the archive; yields (orders, items) per batch."""
+    queryset = Order.objects.filter(created_at__lt=before)
+    order_fields = [f.attname for f in Order._meta.concrete_fields]
+    item_fields = [f.attname for f in OrderItem._meta.concrete_fields]
+    after = 0
+    while True:
+        with transaction.atomic():
+            ids = _locked_batch(queryset, after, batch_size)
+            if not ids:
+                return
+            orders = Order.objects.filter(pk__in=ids)
+            items = OrderItem.objects.filter(order_id__in=ids).order_by("pk")
+            ArchivedOrder.objects.bulk_create(_copy(orders.values(*order_fields), ArchivedOrder))
+            moved_items = len(ArchivedOrderItem.objects.bulk_create(
+                _copy(items.values(*item_fields), ArchivedOrderItem), batch_size=batch_size,
+            ))
+            # У OrderItem нет сигналов — позиции удаляются одним DELETE без выборки
+            orders.delete()
+        after = ids[-1]
+        yield len(ids), moved_items
@@ -0,0 +1,100 @@
+# shop/rollups.py
+"""
+Daily sales rollups (product / category / brand × day).
+
+``record_order`` adds a new order to the rollups inside the checkout transaction;
+``rebuild_days`` recomputes a day range from ``OrderItem`` and the order archive
+(used by ``backfill_rollups``).
+The analytics API reads only these tables.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import connections, router
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ArchivedOrderItem, OrderItem, ProductDailySales, CategoryDailySales, BrandDailySales
+
+# (модель, колонка ключа, путь от OrderItem)
+ROLLUPS = (
+    (ProductDailySales, "product_id", "product_id"),
+    (CategoryDailySales, "category_id", "product__category_id"),
+    (BrandDailySales, "brand_id", "product__brand_id"),
+)
+
+
+def _upsert_add(model, key_column, rows):
+    """rows: {(key, day): (units, revenue, orders)} — прибавляет к существующим строкам."""
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    columns = [key_column, "day", "units", "revenue", "orders"]
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))
+    params = []
+    for (key, day), (units, revenue, orders) in rows.items():
+        params.extend([key, day, units, revenue, orders])
+    updates = ", ".join(f"{qn(c)} = {table}.{qn(c)} + EXCLUDED.{qn(c)}" for c in ("units", "revenue", "orders"))
+    sql = (
+        f"INSERT INTO {table} ({', '.join(qn(c) for c in columns)}) VALUES {placeholders} "
+        f"ON CONFLICT ({qn(key_column)}, {qn('day')}) DO UPDATE SET {updates}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def record_order(order):
+    """Call inside the transaction that created ``order`` and its items."""
+    day = timezone.localdate(order.created_at)
+    items = list(order.items.values_list(
+        "product_id", "product__category_id", "product__brand_id", "quantity", "subtotal",
+    ))
+    for index, (model, key_column, _) in enumerate(ROLLUPS):
+        totals = defaultdict(lambda: [0, 0])
+        for item in items:
+            entry = totals[item[index]]
+            entry[0] += item[3]
+            entry[1] += item[4]
+        # Заказ считается один раз на ключ, даже если в нём несколько товаров категории/бренда
+        _upsert_add(model, key_column, {(key, day): (units, revenue, 1) for key, (units, revenue) in totals.items()})
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def rebuild_days(first_day, last_day, batch_size=2000):
+    """Replaces rollups for ``first_day..last_day`` (inclusive). Run inside a transaction."""
+    start, end = _day_start(first_day), _day_start(last_day + timedelta(days=1))
+    # Заказ лежит либо в Order, либо в архиве (shop.retention) — суммы по двум таблицам складываются
+    sources = [
+        model.objects.filter(order__created_at__gte=start, order__created_at__lt=end)
+        for model in (OrderItem, ArchivedOrderItem)
+    ]
+    written = 0
+    for model, key_column, path in ROLLUPS:
+        model.objects.filter(day__gte=first_day, day__lte=last_day).delete()
+        totals = defaultdict(lambda: [0, 0, 0])
+        for items in sources:
+            rows = (
+                items.annotate(day=TruncDate("order__created_at"))
+                .values(path, "day")
+                .annotate(total_units=Sum("quantity"), total_revenue=Sum("subtotal"),
+                          total_orders=Count("order", distinct=True))
+                .order_by()
+            )
+            for row in rows.iterator(chunk_size=batch_size):
+                entry = totals[(row[path], row["day"])]
+                entry[0] += row["total_units"]
+                entry[1] += row["total_revenue"]
+                entry[2] += row["total_orders"]
+        objs = [
+            model(**{key_column: key}, day=day, units=units, revenue=revenue, orders=orders)
+            for (key, day), (units, revenue, orders) in totals.items()
+        ]
+        model.objects.bulk_create(objs, batch_size=batch_size)
+        written += len(objs)
+    return written
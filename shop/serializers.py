@@ -1,28 +1,45 @@
 # serializers.py
+from django.db import transaction
 from rest_framework import serializers
+from e_commerce.fieldsets import SparseFieldsetMixin
+from e_commerce.instrumentation import InstrumentedSerializerMixin
 from .models import *
+from .rollups import record_order
 
 
-class BrandSerializer(serializers.ModelSerializer):
+class BrandSerializer(InstrumentedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Brand
         fields = ["id", "name"]
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(InstrumentedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ["id", "name", "slug"]
 
 
-class ProductImageSerializer(serializers.ModelSerializer):
+class CategoryTreeSerializer(CategorySerializer):
+    """Categories endpoint: the tree position and subtree product count for menus."""
+
+    class Meta(CategorySerializer.Meta):
+        fields = ["id", "name", "slug", "parent", "depth", "product_count"]
+        read_only_fields = ["depth", "product_count"]
+
+    def validate_parent(self, parent):
+        if parent is not None and self.instance is not None and self.instance.pk in Category.path_ids(parent.path):
+            raise serializers.ValidationError("Категория не может быть вложена в саму себя или в своё поддерево")
+        return parent
+
+
+class ProductImageSerializer(InstrumentedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = ProductImage
         fields = ["id", "image", "name", "product"]
         read_only_fields = ["id"]
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(InstrumentedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     brand = BrandSerializer(read_only=True)
     images = ProductImageSerializer(source="productimage_set", many=True, read_only=True)
@@ -40,10 +57,11 @@ class ProductSerializer(serializers.ModelSerializer):
             "id", "name", "price", "description", "is_active", "sku", "quantity",
             "category", "brand", "images",
             "category_id", "brand_id",
+            "units_sold_7d", "units_sold_30d", "wishlist_count", "updated_at",
         ]
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(InstrumentedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), source="product", write_only=True
@@ -55,7 +73,7 @@ class CartItemSerializer(serializers.ModelSerializer):
             "id", "cart", "product", "product_id",
             "quantity", "unit_price", "total_item_price",
         ]
-        read_only_fields = ["unit_price", "total_item_price"]
+        read_only_fields = ["cart", "unit_price", "total_item_price"]
 
     def validate_quantity(self, value):
         if value < 1:
@@ -63,7 +81,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         return value
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(InstrumentedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     items = CartItemSerializer(source="cartitem_set", many=True, read_only=True)
 
     class Meta:
@@ -72,7 +90,7 @@ class CartSerializer(serializers.ModelSerializer):
         read_only_fields = ["id"]
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(InstrumentedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), source="product", write_only=True
@@ -89,7 +107,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return value
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(InstrumentedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
@@ -101,7 +119,25 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ["created_at"]
 
 
-class OrderCreateSerializer(serializers.ModelSerializer):
+class ArchivedOrderItemSerializer(InstrumentedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    product = ProductSerializer(read_only=True)
+
+    class Meta:
+        model = ArchivedOrderItem
+        fields = ["id", "order", "product", "quantity", "unit_price", "subtotal"]
+        read_only_fields = fields
+
+
+class ArchivedOrderSerializer(InstrumentedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    items = ArchivedOrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = ArchivedOrder
+        fields = OrderSerializer.Meta.fields + ["archived_at"]
+        read_only_fields = fields
+
+
+class OrderCreateSerializer(InstrumentedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
 
     class Meta:
@@ -109,6 +145,7 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         fields = ["id", "user", "status", "shipping_address", "delivery_method", "total_amount", "items"]
         read_only_fields = ["id", "status", "total_amount"]
 
+    @transaction.atomic
     def create(self, validated_data):
         items_data = validated_data.pop("items")
         order = Order.objects.create(**validated_data)
@@ -120,4 +157,5 @@ class OrderCreateSerializer(serializers.ModelSerializer):
 
         order.total_amount = total
         order.save(update_fields=["total_amount"])
+        record_order(order)
         return order
@@ -0,0 +1,87 @@
+# shop/signals.py
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .categories import adjust_category_counts
+from .models import Brand, Category, Product, ProductImage, ProductTombstone, PriceHistory, Cart, CartItem
+from .stock_stream import notify_stock
+from .storage import adjust_refs
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+def record_deactivation(sender, instance, created, **kwargs):
+    was_active = getattr(instance, "_loaded_is_active", None)
+    if not created and was_active and not instance.is_active:
+        ProductTombstone.record([(instance.pk, instance.sku)], ProductTombstone.Reason.DEACTIVATED)
+    instance._loaded_is_active = instance.is_active
+
+
+@receiver(post_save, sender=Product)
+def announce_stock(sender, instance, created, **kwargs):
+    # Админка и PATCH через API; queryset.update() вызывает notify_stock сам
+    if created or instance.quantity != getattr(instance, "_loaded_quantity", None):
+        notify_stock({instance.pk: instance.quantity})
+    instance._loaded_quantity = instance.quantity
+
+
+@receiver(post_save, sender=Product)
+def record_price_change(sender, instance, created, **kwargs):
+    # Пачки пишет shop.bulk_update, здесь — админка и PATCH через API
+    previous = getattr(instance, "_loaded_price", None)
+    if not created and previous is not None and instance.price != previous:
+        PriceHistory.objects.create(product=instance, previous_price=previous, price=instance.price)
+    instance._loaded_price = instance.price
+
+
+@receiver(post_save, sender=Product)
+def count_category_products(sender, instance, created, **kwargs):
+    old = None if created else getattr(instance, "_counted_category_id", None)
+    new = instance.category_id if instance.is_active else None
+    if old != new:
+        adjust_category_counts({old: -1, new: 1})
+    instance._counted_category_id = new
+
+
+@receiver(post_delete, sender=Product)
+def uncount_category_product(sender, instance, **kwargs):
+    adjust_category_counts({getattr(instance, "_counted_category_id", None): -1})
+
+
+@receiver(post_delete, sender=Product)
+def record_deletion(sender, instance, **kwargs):
+    ProductTombstone.record([(instance.pk, instance.sku)], ProductTombstone.Reason.DELETED)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def touch_cart(sender, instance, **kwargs):
+    Cart.objects.filter(pk=instance.cart_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=ProductImage)
+def count_image_ref(sender, instance, created, **kwargs):
+    old = None if created else getattr(instance, "_loaded_image", None)
+    new = instance.image.name or None
+    if new != old:
+        adjust_refs(new, 1)
+        adjust_refs(old, -1)
+    instance._loaded_image = new
+
+
+@receiver(post_delete, sender=ProductImage)
+def release_image_ref(sender, instance, **kwargs):
+    adjust_refs(instance.image.name, -1)
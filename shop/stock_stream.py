@@ -0,0 +1,181 @@
+# shop/stock_stream.py
+"""
+Live stock levels: PostgreSQL LISTEN/NOTIFY fanned out to server-sent events.
+
+Writers call ``notify_stock({product_id: quantity})`` inside their transaction. On
+PostgreSQL that is ``pg_notify('shop_stock', ...)``, delivered only on commit; other
+backends publish to the current process on commit (development, tests).
+
+Every process keeps one listener thread with its own connection (``LISTEN shop_stock``)
+that hands changes to the subscribed clients. A client receives at most one event per
+``STOCK_STREAM_COALESCE_SECONDS`` with the latest quantity of each changed product, so a
+burst of checkouts turns into a single message.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import Product
+
+CHANNEL = "shop_stock"
+# NOTIFY принимает до 8000 байт: ~25 байт на пару id:остаток
+NOTIFY_CHUNK = 250
+DEFAULT_MAX_IDS = 50
+
+logger = logging.getLogger("shop.stock_stream")
+
+
+def max_ids():
+    return getattr(settings, "STOCK_STREAM_MAX_IDS", DEFAULT_MAX_IDS)
+
+
+def notify_stock(quantities, using="default"):
+    """Announces new stock levels after the current transaction commits."""
+    if not quantities:
+        return
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        changes = dict(quantities)
+        transaction.on_commit(lambda: hub.publish(changes), using=using)
+        return
+    items = list(quantities.items())
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), NOTIFY_CHUNK):
+            payload = json.dumps(dict(items[start:start + NOTIFY_CHUNK]), separators=(",", ":"))
+            cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, payload])
+
+
+class Subscription:
+    def __init__(self, hub, product_ids, loop):
+        self.hub = hub
+        self.product_ids = frozenset(product_ids)
+        self.loop = loop
+        self.pending = {}
+        self.event = asyncio.Event()
+
+    def push(self, changes):
+        # Вызывается из потока слушателя под hub.lock
+        self.pending.update(changes)
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            pass  # цикл клиента уже закрыт, отписка придёт из finally
+
+    async def next(self, timeout):
+        """Coalesced ``{product_id: quantity}``, or ``{}`` after ``timeout`` seconds without changes."""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        await asyncio.sleep(getattr(settings, "STOCK_STREAM_COALESCE_SECONDS", 0.25))
+        with self.hub.lock:
+            changes, self.pending = self.pending, {}
+            self.event.clear()
+        return changes
+
+
+class StockHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._by_product = defaultdict(set)
+        self._listener = None
+
+    def subscribe(self, product_ids, loop):
+        subscription = Subscription(self, product_ids, loop)
+        with self.lock:
+            for pk in subscription.product_ids:
+                self._by_product[pk].add(subscription)
+            if self._listener is None and connections["default"].vendor == "postgresql":
+                self._listener = threading.Thread(target=self._listen, name="stock-listener", daemon=True)
+                self._listener.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for pk in subscription.product_ids:
+                subscribers = self._by_product.get(pk)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_product[pk]
+
+    def subscriber_count(self):
+        with self.lock:
+            return len({s for subscribers in self._by_product.values() for s in subscribers})
+
+    def publish(self, changes):
+        with self.lock:
+            batches = defaultdict(dict)
+            for pk, quantity in changes.items():
+                for subscription in self._by_product.get(int(pk), ()):
+                    batches[subscription][int(pk)] = quantity
+            for subscription, batch in batches.items():
+                subscription.push(batch)
+
+    def _listen(self):
+        delay = 1
+        while True:
+            # Своё соединение: LISTEN живёт всё время процесса, не в пуле запросов
+            wrapper = connections.create_connection("default")
+            try:
+                wrapper.ensure_connection()
+                raw = wrapper.connection
+                with raw.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                delay = 1
+                while True:
+                    for payload in _notifications(raw, timeout=5):
+                        self.publish(json.loads(payload))
+            except Exception:
+                logger.exception("Stock listener failed, reconnecting in %s s", delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+            finally:
+                wrapper.close()
+
+
+def _notifications(raw, timeout):
+    if hasattr(raw, "poll"):  # psycopg2
+        if select.select([raw], [], [], timeout) != ([], [], []):
+            raw.poll()
+            while raw.notifies:
+                yield raw.notifies.pop(0).payload
+    else:  # psycopg 3
+        for notify in raw.notifies(timeout=timeout):
+            yield notify.payload
+
+
+hub = StockHub()
+
+
+def _event(changes):
+    data = json.dumps({str(pk): quantity for pk, quantity in changes.items()}, separators=(",", ":"))
+    return f"event: stock\ndata: {data}\n\n"
+
+
+async def stock_events(product_ids):
+    """SSE stream: the current levels first, then coalesced changes and heartbeats."""
+    subscription = hub.subscribe(product_ids, asyncio.get_running_loop())
+    try:
+        yield "retry: 3000\n\n"
+        # Подписка раньше снимка: изменение между ними придёт следующим событием
+        snapshot = {
+            pk: quantity
+            async for pk, quantity in Product.objects.filter(pk__in=product_ids, is_active=True)
+            .values_list("pk", "quantity")
+        }
+        yield _event(snapshot)
+        heartbeat = getattr(settings, "STOCK_STREAM_HEARTBEAT_SECONDS", 15)
+        while True:
+            changes = await subscription.next(heartbeat)
+            # Комментарий-пинг держит соединение через прокси
+            yield _event(changes) if changes else ": ping\n\n"
+    finally:
+        hub.unsubscribe(subscription)
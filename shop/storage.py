@@ -0,0 +1,114 @@
+# shop/storage.py
+"""
+Content-addressed media storage with reference counting.
+
+``ContentAddressedStorage`` hashes an upload (SHA-256) while streaming it to a
+temporary file under ``MEDIA_ROOT``, then moves it to
+``<upload_to>/<first 2 hex>/<sha256>.<ext>``. The same bytes uploaded again are
+not written a second time: the new row gets the existing name. Names never change
+content, so their URLs are served with an immutable ``Cache-Control``
+(``e_commerce.media``).
+
+Each stored file has a ``MediaFile`` row. ``refs`` counts the ``ProductImage`` rows
+that point at it (kept by ``shop.signals``; ``recount_refs()`` repairs it after
+``bulk_create``/``update()``). ``collect_garbage()`` (``gc_media``) deletes files
+that have had no references for the grace period; the grace period protects an
+upload whose row is not committed yet.
+"""
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from e_commerce.media import INCOMING_DIR, content_addressed_name, is_content_addressed
+from .models import MediaFile, ProductImage
+
+DEFAULT_GRACE = timedelta(hours=1)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя — хеш содержимого, известен только в _save; совпадение имён = тот же файл
+        return name
+
+    def _save(self, name, content):
+        incoming = os.path.join(self.location, INCOMING_DIR)
+        os.makedirs(incoming, exist_ok=True)
+        digest, size = hashlib.sha256(), 0
+        # Временный файл на той же ФС: os.replace ниже атомарен
+        with tempfile.NamedTemporaryFile(dir=incoming, delete=False) as tmp:
+            try:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+
+        ext = os.path.splitext(name)[1].lower()
+        if not (ext[1:].isascii() and ext[1:].isalnum()):
+            ext = ""
+        name = content_addressed_name(os.path.dirname(name), digest.hexdigest(), ext)
+        try:
+            # Сначала строка (блокирует gc_media для этого имени), потом проверка файла
+            with transaction.atomic():
+                MediaFile.objects.update_or_create(name=name, defaults={"size": size})
+                path = self.path(name)
+                if os.path.exists(path):
+                    os.unlink(tmp.name)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.chmod(tmp.name, self.file_permissions_mode or 0o644)
+                    os.replace(tmp.name, path)
+        except BaseException:
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+            raise
+        return name
+
+
+def adjust_refs(name, delta):
+    if not is_content_addressed(name):
+        return
+    files = MediaFile.objects.filter(name=name)
+    if delta < 0:
+        files = files.filter(refs__gte=-delta)
+    files.update(refs=F("refs") + delta)
+
+
+def recount_refs(batch_size=1000):
+    """Recomputes ``MediaFile.refs`` from ``ProductImage``; returns the number of corrected rows."""
+    counts = dict(
+        ProductImage.objects.exclude(image="").values("image").annotate(n=Count("id")).values_list("image", "n")
+    )
+    changed = []
+    for media in MediaFile.objects.only("id", "name", "refs").iterator(chunk_size=batch_size):
+        refs = counts.get(media.name, 0)
+        if media.refs != refs:
+            media.refs = refs
+            changed.append(media)
+    MediaFile.objects.bulk_update(changed, ["refs"], batch_size=batch_size)
+    return len(changed)
+
+
+def collect_garbage(grace=DEFAULT_GRACE, dry_run=False):
+    """Deletes unreferenced files untouched for ``grace``; yields (name, size) of each."""
+    storage = ProductImage._meta.get_field("image").storage
+    cutoff = timezone.now() - grace
+    candidates = MediaFile.objects.filter(refs=0, touched_at__lt=cutoff)
+    for pk in list(candidates.values_list("pk", flat=True)):
+        with transaction.atomic():
+            # Повторная загрузка того же содержимого ждёт на этой строке или уже обновила touched_at
+            media = candidates.select_for_update().filter(pk=pk).first()
+            if media is None:
+                continue
+            if not dry_run:
+                storage.delete(media.name)
+                media.delete()
+        yield media.name, media.size
@@ -0,0 +1,142 @@
+# shop/suggest.py
+"""
+Type-ahead product suggestions.
+
+A product matches when the query is a prefix of its SKU, of its name, or of any
+word-start suffix of its name ("blue sh" matches "Big blue shoes"). Results are
+ranked: exact SKU, then name prefix, then the other matches, each group by name.
+
+On PostgreSQL this is one query (``istartswith`` / ``icontains(" " + q)`` use the
+trigram GIN indexes from migration 0011). Other backends (SQLite in tests) use an
+in-process ``SuggestIndex`` with the same matching and ranking, rebuilt lazily on a
+request after the catalog version changed, at most once per
+``SHOP_SUGGEST_INDEX_TTL`` seconds, so a product save does not trigger a full rebuild.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .cache import get_catalog_version
+from .models import Product
+
+SUGGEST_MIN_LENGTH = 2
+SUGGEST_DEFAULT_LIMIT = 8
+SUGGEST_MAX_LIMIT = 20
+DEFAULT_INDEX_TTL = 60
+
+
+def _word_suffixes(name):
+    # "big blue shoes" -> "blue shoes", "shoes" (сам name — отдельный ранг)
+    words = name.lower().split()
+    return {" ".join(words[i:]) for i in range(1, len(words))}
+
+
+class PrefixTree:
+    """Prefix -> ids in insertion order; every node keeps at most ``cap`` ids, so a search never walks a subtree."""
+
+    def __init__(self, cap):
+        self.root = {}
+        self.cap = cap
+
+    def add(self, key, pk):
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+            ids = node.setdefault("", [])
+            if len(ids) < self.cap and (not ids or ids[-1] != pk):
+                ids.append(pk)
+
+    def search(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        return node.get("", [])
+
+
+class SuggestIndex:
+    """In-memory equivalent of ``suggest_queryset()``; rows must be added in name order."""
+
+    def __init__(self):
+        self.rows = {}
+        self.skus = {}
+        # +1: одно из совпадений в узле может оказаться точным SKU, уже стоящим первым
+        self.names = PrefixTree(SUGGEST_MAX_LIMIT + 1)
+        self.others = PrefixTree(SUGGEST_MAX_LIMIT + 1)
+
+    def add(self, pk, name, sku):
+        self.rows[pk] = (pk, name, sku)
+        self.skus.setdefault(sku.lower(), pk)
+        self.names.add(name.lower(), pk)
+        for key in sorted({sku.lower(), *_word_suffixes(name)}):
+            self.others.add(key, pk)
+
+    def search(self, query, limit):
+        query = query.lower()
+        exact = self.skus.get(query)
+        ranked = [exact] if exact is not None else []
+        for pk in self.names.search(query) + self.others.search(query):
+            if pk not in ranked:
+                ranked.append(pk)
+        return [self.rows[pk] for pk in ranked[:limit]]
+
+
+_index_lock = threading.Lock()
+_index = None
+_index_version = None
+_index_built_at = 0.0
+
+
+def _build_index():
+    index = SuggestIndex()
+    rows = Product.objects.filter(is_active=True).order_by("name", "id").values_list("id", "name", "sku")
+    for pk, name, sku in rows.iterator(chunk_size=2000):
+        index.add(pk, name, sku)
+    return index
+
+
+def _get_index():
+    global _index, _index_version, _index_built_at
+    version = get_catalog_version()
+    ttl = getattr(settings, "SHOP_SUGGEST_INDEX_TTL", DEFAULT_INDEX_TTL)
+    if _index is not None and (_index_version == version or time.monotonic() - _index_built_at < ttl):
+        return _index
+    # Пока один поток перестраивает индекс, остальные отвечают по старому
+    if not _index_lock.acquire(blocking=_index is None):
+        return _index
+    try:
+        if _index is None or _index_version != version:
+            _index, _index_version, _index_built_at = _build_index(), version, time.monotonic()
+    finally:
+        _index_lock.release()
+    return _index
+
+
+def suggest_queryset(query, limit):
+    # UPPER(col) LIKE UPPER(...) — покрывается GIN-индексами из миграции 0011
+    return (
+        Product.objects.filter(is_active=True)
+        .filter(Q(sku__istartswith=query) | Q(name__istartswith=query) | Q(name__icontains=f" {query}"))
+        .annotate(
+            rank=Case(
+                When(sku__iexact=query, then=Value(0)),
+                When(name__istartswith=query, then=Value(1)),
+                default=Value(2),
+                output_field=IntegerField(),
+            )
+        )
+        .order_by("rank", "name", "id")
+        .values_list("id", "name", "sku")[:limit]
+    )
+
+
+def suggest_products(query, limit=SUGGEST_DEFAULT_LIMIT):
+    if connection.vendor != "postgresql":
+        rows = _get_index().search(query, limit)
+    else:
+        rows = suggest_queryset(query, limit)
+    return [{"id": pk, "name": name, "sku": sku} for pk, name, sku in rows]
@@ -0,0 +1,237 @@
+# shop/synthetic.py
+"""Deterministic synthetic catalog/users/orders for load testing (used by ``seed_shop``)."""
+import bisect
+import csv
+import io
+import random
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .categories import fill_root_paths
+from .models import Brand, Category, Product, ProductImage, Cart, CartItem, Order, OrderItem
+
+ADJECTIVES = ["Pro", "Max", "Mini", "Ultra", "Lite", "Plus", "Air", "Neo", "Prime", "Smart"]
+NOUNS = ["Phone", "Laptop", "Tablet", "Watch", "Camera", "Headphones", "Speaker", "Monitor", "Router", "Console"]
+PLACEHOLDER_IMAGE = "product_images/seed/placeholder.jpg"
+
+
+@dataclass(frozen=True)
+class SeedPlan:
+    seed: int
+    brands: int
+    categories: int
+    products: int
+    images_per_product: int
+    users: int
+    cart_ratio: float
+    orders: int
+    max_order_items: int
+    days: int
+    chunk_size: int
+    use_copy: bool
+    # Первые id, начиная с которых пишем (берутся как MAX(id)+1 перед стартом)
+    brand_base: int = 1
+    category_base: int = 1
+    product_base: int = 1
+    user_base: int = 1
+    cart_base: int = 1
+    order_base: int = 1
+    password_hash: str = ""
+    now_ts: float = 0.0
+
+
+def _rng(plan, phase, chunk):
+    return random.Random(f"{plan.seed}:{phase}:{chunk}")
+
+
+@lru_cache(maxsize=4)
+def _zipf_cum_weights(n, s=1.1):
+    return list(accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def _pick(rng, cum_weights):
+    return bisect.bisect_left(cum_weights, rng.random() * cum_weights[-1])
+
+
+def product_price(plan, product_id):
+    # Цена — чистая функция от (seed, id): заказы и корзины в других процессах получают ту же цену
+    return 10 + zlib.crc32(f"{plan.seed}:{product_id}".encode()) % 5000
+
+
+def _power_law_size(rng, limit, alpha=1.6):
+    return min(limit, int(rng.paretovariate(alpha)))
+
+
+@contextmanager
+def _keep_explicit_values(model, *field_names):
+    # bulk_create вызывает pre_save(add=True), и auto_now_add затёр бы сгенерированные даты
+    fields = [model._meta.get_field(name) for name in field_names]
+    saved = [(f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, (auto_now, auto_now_add) in zip(fields, saved):
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+def write_objects(model, objs, use_copy, keep=()):
+    if not objs:
+        return 0
+    connection = connections["default"]
+    if not (use_copy and connection.vendor == "postgresql"):
+        with _keep_explicit_values(model, *keep):
+            model.objects.bulk_create(objs, batch_size=2000)
+        return len(objs)
+
+    fields = [f for f in model._meta.concrete_fields if not (f.primary_key and getattr(objs[0], f.attname) is None)]
+    now = timezone.now()
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for obj in objs:
+        row = []
+        for f in fields:
+            value = getattr(obj, f.attname)
+            if value is None and (getattr(f, "auto_now", False) or getattr(f, "auto_now_add", False)):
+                value = now
+            value = f.get_db_prep_save(value, connection)
+            # В CSV-режиме COPY пустое поле без кавычек = NULL
+            row.append(r"\N" if value is None else value)
+        writer.writerow(row)
+    buf.seek(0)
+    columns = ", ".join(connection.ops.quote_name(f.column) for f in fields)
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert(
+            f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) "
+            f"FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buf,
+        )
+    return len(objs)
+
+
+def seed_reference_data(plan):
+    Brand.objects.bulk_create(
+        Brand(id=plan.brand_base + i, name=f"Brand {plan.seed}-{i}") for i in range(plan.brands)
+    )
+    Category.objects.bulk_create(
+        Category(id=plan.category_base + i, name=f"Category {plan.seed}-{i}", slug=f"category-{plan.seed}-{i}")
+        for i in range(plan.categories)
+    )
+    fill_root_paths()
+
+
+def seed_products_chunk(plan, chunk, start, count):
+    rng = _rng(plan, "products", chunk)
+    brand_weights = _zipf_cum_weights(plan.brands)
+    products, images = [], []
+    for pid in range(start, start + count):
+        products.append(Product(
+            id=pid,
+            name=f"{rng.choice(NOUNS)} {rng.choice(ADJECTIVES)} {pid}",
+            sku=f"SEED{plan.seed}-{pid}",
+            description=f"Synthetic product {pid}",
+            price=product_price(plan, pid),
+            quantity=rng.randint(0, 500),
+            is_active=rng.random() > 0.05,
+            brand_id=plan.brand_base + _pick(rng, brand_weights),
+            category_id=plan.category_base + rng.randrange(plan.categories),
+        ))
+        images.extend(
+            ProductImage(image=PLACEHOLDER_IMAGE, name=f"Seed {pid}-{n}", product_id=pid)
+            for n in range(rng.randint(0, plan.images_per_product * 2))
+        )
+    with transaction.atomic():
+        write_objects(Product, products, plan.use_copy)
+        write_objects(ProductImage, images, plan.use_copy)
+    return count
+
+
+def seed_users_chunk(plan, chunk, start, count):
+    User = get_user_model()
+    rng = _rng(plan, "users", chunk)
+    product_weights = _zipf_cum_weights(plan.products)
+    users, carts, items = [], [], []
+    for uid in range(start, start + count):
+        users.append(User(
+            id=uid,
+            email=f"seed{plan.seed}.{uid}@example.com",
+            username=f"seed{plan.seed}_{uid}",
+            first_name="Seed",
+            last_name=str(uid),
+            password=plan.password_hash,
+            is_active=True,
+        ))
+        if rng.random() < plan.cart_ratio:
+            cart_id = plan.cart_base + (uid - plan.user_base)
+            carts.append(Cart(id=cart_id, user_id=uid))
+            picked = {plan.product_base + _pick(rng, product_weights)
+                      for _ in range(_power_law_size(rng, plan.max_order_items))}
+            for pid in sorted(picked):
+                quantity = rng.randint(1, 3)
+                price = product_price(plan, pid)
+                items.append(CartItem(cart_id=cart_id, product_id=pid, quantity=quantity,
+                                      unit_price=price, total_item_price=price * quantity))
+    with transaction.atomic():
+        write_objects(User, users, plan.use_copy)
+        write_objects(Cart, carts, plan.use_copy)
+        write_objects(CartItem, items, plan.use_copy)
+    return count
+
+
+def seed_orders_chunk(plan, chunk, start, count):
+    rng = _rng(plan, "orders", chunk)
+    product_weights = _zipf_cum_weights(plan.products)
+    now = datetime.fromtimestamp(plan.now_ts, tz=dt_timezone.utc)
+    statuses = [s for s, _ in Order.Status.choices]
+    methods = [m for m, _ in Order.DeliveryMethod.choices]
+    orders, items = [], []
+    for oid in range(start, start + count):
+        picked = {plan.product_base + _pick(rng, product_weights)
+                  for _ in range(_power_law_size(rng, plan.max_order_items))}
+        total = 0
+        for pid in sorted(picked):
+            quantity = _power_law_size(rng, 10, alpha=2.5)
+            price = product_price(plan, pid)
+            total += price * quantity
+            items.append(OrderItem(order_id=oid, product_id=pid, quantity=quantity,
+                                   unit_price=price, subtotal=price * quantity))
+        orders.append(Order(
+            id=oid,
+            user_id=plan.user_base + rng.randrange(plan.users),
+            status=rng.choice(statuses),
+            total_amount=total,
+            created_at=now - timedelta(seconds=rng.randrange(plan.days * 86400)),
+            shipping_address=f"Synthetic street {rng.randint(1, 999)}",
+            delivery_method=rng.choice(methods),
+        ))
+    with transaction.atomic():
+        write_objects(Order, orders, plan.use_copy, keep=("created_at",))
+        write_objects(OrderItem, items, plan.use_copy)
+    return count
+
+
+PHASES = {
+    "products": seed_products_chunk,
+    "users": seed_users_chunk,
+    "orders": seed_orders_chunk,
+}
+
+
+def run_chunk(phase, plan, chunk, start, count):
+    return PHASES[phase](plan, chunk, start, count)
+
+
+def init_worker():
+    import django
+    django.setup()
+    # Соединения родителя после fork использовать нельзя
+    connections.close_all()
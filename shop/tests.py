@@ -1,3 +1,1993 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import replace
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connections, transaction
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from e_commerce.db_router import PIN_COOKIE, PrimaryReplicaRouter, ReplicaRoutingMiddleware
+from e_commerce.instrumentation import QueryBudgetExceeded, resolve_query_budget
+from e_commerce.media import serve_media
+from e_commerce.renderers import FastJSONRenderer
+from e_commerce.testing import QueryBudgetTestMixin
+from .admin import CustomProductAdmin
+from .benchmark import Dataset, build_scenarios, compare, run_client, seed_dataset
+from .bulk_update import MAX_QUANTITY, parse_updates
+from .cache import (
+    CATALOG_VERSION_KEY, bump_catalog_version, cache_is_shared, force_refresh, get_catalog_version, get_or_compute,
+)
+from .categories import fill_root_paths, refresh_category_counts
+from .checks import check_shared_cache
+from .changes import deactivate_products, encode_cursor
+from .compiled import CompiledSerializer
+from .models import (
+    Brand, Category, Product, ProductImage, Cart, CartItem, Order, OrderItem, ArchivedOrder,
+    ProductDailySales, CategoryDailySales, BrandDailySales, ProductRecommendation, MediaFile, PriceHistory,
+    ProductTombstone,
+)
+from .multiget import MAX_ID, invalidate_products
+from .popularity import refresh_popularity
+from .queries import with_product_relations
+from .recommendations import build_recommendations
+from .retention import archive_orders, purge_carts
+from .rollups import ROLLUPS, rebuild_days, record_order
+from .serializers import BrandSerializer, CartItemSerializer, ProductSerializer
+from .stock_stream import hub, notify_stock, stock_events
+from .suggest import _get_index, suggest_queryset
+from .synthetic import SeedPlan, run_chunk, seed_reference_data
+from .views import ProductViewSet
+from .urls import router
+
+
+class ShopTestCase(TestCase):
+    """
+    Shared catalog fixture: ``brand``, ``category``, ``product_count`` products
+    (``SKU-0``, ``SKU-1``, ...; ``product_fields(i)`` overrides their fields) and a
+    ``user``. ``auth(user)`` returns JWT headers for the test client.
+    """
+
+    product_count = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name="Brand")
+        cls.category = Category.objects.create(name="Category")
+        cls.products = [cls.make_product(i, **cls.product_fields(i)) for i in range(cls.product_count)]
+        cls.user = cls.make_user("buyer")
+
+    @classmethod
+    def product_fields(cls, i):
+        return {}
+
+    @classmethod
+    def make_product(cls, i, **fields):
+        return Product.objects.create(**{
+            "name": f"Product {i}", "sku": f"SKU-{i}", "price": 100, "quantity": 10,
+            "brand": cls.brand, "category": cls.category, **fields,
+        })
+
+    @classmethod
+    def make_user(cls, username, **fields):
+        return get_user_model().objects.create_user(
+            username=username, email=f"{username}@example.com", password="password",
+            first_name=username.title(), last_name="User", **fields,
+        )
+
+    def setUp(self):
+        # Версия каталога и кэши списков живут в общем locmem-кэше
+        cache.clear()
+
+    def auth(self, user=None):
+        return {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(user or self.user).access_token}"}
+
+
+class FacetTests(ShopTestCase):
+    product_count = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.other_brand = Brand.objects.create(name="Other")
+        super().setUpTestData()
+
+    @classmethod
+    def product_fields(cls, i):
+        return {"price": (100, 105, 110, 200)[i], "brand": cls.brand if i < 3 else cls.other_brand}
+
+    def _facets(self, query=""):
+        response = self.client.get(f"/websec/products/facets/{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_counts_ignore_the_facets_own_filter(self):
+        data = self._facets(f"?brand={self.other_brand.pk}")
+        self.assertEqual(data["count"], 1)
+        # Фильтр по бренду не сужает список брендов, но сужает категории и цены
+        self.assertEqual(
+            [(b["name"], b["count"]) for b in data["brands"]], [("Brand", 3), ("Other", 1)],
+        )
+        self.assertEqual(
+            data["categories"],
+            [{"id": self.category.pk, "name": "Category", "slug": self.category.slug, "count": 1}],
+        )
+        self.assertEqual((data["price"]["min"], data["price"]["max"]), ("200", "200"))
+
+        empty = self._facets("?search=nothing-matches")
+        self.assertEqual((empty["count"], empty["price"]), (0, {"min": None, "max": None, "buckets": []}))
+        self.assertEqual(len(empty["brands"]), 0)
+
+    def test_price_bucket_edges(self):
+        price = self._facets("?buckets=4")["price"]
+        self.assertEqual(
+            [(b["from"], b["to"], b["count"]) for b in price["buckets"]],
+            [("100", "125", 3), ("125", "150", 0), ("150", "175", 0), ("175", "200", 1)],
+        )
+        # Максимальная цена — в последней корзине, а не в лишней пятой
+        self.assertEqual(len(self._facets("?buckets=1000")["price"]["buckets"]), 50)
+        self.assertEqual(self._facets("?buckets=1000")["price"]["buckets"][-1]["count"], 1)
+        self.assertEqual([b["count"] for b in self._facets("?buckets=0")["price"]["buckets"]], [4])
+        self.assertEqual(self.client.get("/websec/products/facets/?buckets=x").status_code, 400)
+
+    def test_cached_until_catalog_changes(self):
+        self.assertEqual(self._facets()["count"], 4)
+        with CaptureQueriesContext(connections["default"]) as queries:
+            self.assertEqual(self._facets()["count"], 4)
+        self.assertEqual(len(queries), 0)
+        self.make_product(4, price=300)
+        self.assertEqual(self._facets()["count"], 5)
+
+
+class SuggestTests(ShopTestCase):
+    product_count = 0
+    queries = ["sh", "SH", "shirt", "shirt 0", "blue sh", "red", "rs-0", "bear", "ash", "zz"]
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        names = [
+            ("Shoe rack", "SH-1"), ("Big blue shoes", "BB-1"), ("Zebra shirt", "SHIRT"),
+            ("Bashful bear", "BEAR-2"), ("Shop sign", "SH"), ("Shoe polish", "SP-1"),
+        ] + [(f"Red shirt {i:02d}", f"RS-{i:02d}") for i in range(25)]
+        for i, (name, sku) in enumerate(names):
+            cls.make_product(i, name=name, sku=sku)
+        cls.make_product(99, name="Shoe hidden", sku="SH-99", is_active=False)
+
+    def setUp(self):
+        super().setUp()
+        # Индекс — глобальный на процесс, а id товаров у каждого тест-класса свои
+        patcher = mock.patch.multiple("shop.suggest", _index=None, _index_version=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _suggest(self, query, **params):
+        response = self.client.get("/websec/products/suggest/", {"q": query, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [p["sku"] for p in response.json()]
+
+    def test_index_matches_database_query(self):
+        for query in self.queries:
+            for limit in (1, 3, 8, 20):
+                with self.subTest(query=query, limit=limit):
+                    self.assertEqual(
+                        [row[2] for row in _get_index().search(" ".join(query.split()), limit)],
+                        [row[2] for row in suggest_queryset(query, limit)],
+                    )
+        self.assertEqual(self._suggest("sh", limit=4), ["SH", "SP-1", "SH-1", "BB-1"])
+        # Середина слова не совпадает, слово в середине названия — совпадает
+        self.assertEqual(self._suggest("ash"), [])
+        self.assertEqual(self._suggest("blue sh"), ["BB-1"])
+
+    def test_limit(self):
+        self.assertEqual(len(self._suggest("shirt", limit=100)), 20)
+        self.assertEqual(self._suggest("shirt", limit=0), ["SHIRT"])
+        self.assertEqual(self._suggest("s"), [])
+        self.assertEqual(self.client.get("/websec/products/suggest/?q=sh&limit=x").status_code, 400)
+
+    def test_cached_and_index_rebuilt_at_most_once_per_ttl(self):
+        self.assertEqual(self._suggest("zebra"), ["SHIRT"])
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = self.client.get("/websec/products/suggest/?q=zebra")
+        self.assertEqual(len(queries), 0)
+        self.assertIn("max-age", response["Cache-Control"])
+
+        self.make_product(100, name="Zebra mug", sku="ZM-1")
+        # Версия каталога сменилась, но индекс моложе SHOP_SUGGEST_INDEX_TTL
+        self.assertEqual(self._suggest("zebra"), ["SHIRT"])
+        with override_settings(SHOP_SUGGEST_INDEX_TTL=0):
+            bump_catalog_version()
+            self.assertEqual(self._suggest("zebra"), ["ZM-1", "SHIRT"])
+
+
+class ImportProductsTests(ShopTestCase):
+    def _import(self, content, suffix=".csv", *args):
+        path = tempfile.mkstemp(suffix=suffix)[1]
+        self.addCleanup(os.remove, path)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        out, err = StringIO(), StringIO()
+        call_command("import_products", path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_upsert_with_duplicate_sku_and_slug_collisions_in_one_chunk(self):
+        out, err = self._import(
+            "sku,name,price,quantity,brand,category,is_active\n"
+            "SKU-0,Renamed,150,3,Brand,Category,1\n"
+            "NEW-1,First,10,1,Brand,Category,1\n"
+            "NEW-2,Speaker,15,1,Brand,Home Audio,1\n"
+            "NEW-1,Second,20,2,New brand,home  audio,yes\n"
+            "NEW-3,Third,30,0,Brand,CATEGORY,0\n"
+            "BAD-1,Broken,-5,1,Brand,Category,1\n"
+            "SKU-1,Off sale,100,10,Brand,Category,false\n"
+        )
+        self.assertIn("Imported 5 products", out)
+        self.assertIn("skipped 1 bad rows", out)
+        self.assertIn("BAD-1", err)
+
+        products = {p.sku: p for p in Product.objects.select_related("brand", "category")}
+        self.assertEqual(len(products), 6)
+        self.assertEqual((products["SKU-0"].name, products["SKU-0"].price, products["SKU-0"].quantity), ("Renamed", 150, 3))
+        # Дубликат sku в чанке: побеждает последняя строка
+        new = products["NEW-1"]
+        self.assertEqual((new.name, new.price, new.brand.name, new.category.name), ("Second", 20, "New brand", "home  audio"))
+        # Новые имена с одинаковым slug ("Home Audio" и "home  audio") — в одном чанке
+        slugs = dict(Category.objects.values_list("name", "slug"))
+        self.assertEqual((slugs["Category"], slugs["CATEGORY"]), ("category", "category-2"))
+        self.assertEqual(sorted([slugs["Home Audio"], slugs["home  audio"]]), ["home-audio", "home-audio-2"])
+        self.assertFalse(products["SKU-1"].is_active)
+        self.assertEqual(
+            list(ProductTombstone.objects.values_list("sku", "reason")), [("SKU-1", ProductTombstone.Reason.DEACTIVATED)],
+        )
+        self.assertEqual(Category.objects.get(name="Category").product_count, 2)
+        self.assertTrue(all(c.path == f"{c.pk}/" for c in Category.objects.all()))
+
+    def test_jsonl_rerun_is_idempotent(self):
+        content = (
+            '{"sku": "J-1", "name": "Json", "price": "12", "quantity": 4, "brand": "Brand", "category": "Category"}\n'
+            "not json\n"
+        )
+        self._import(content, ".jsonl")
+        first = list(Product.objects.order_by("sku").values_list("sku", "name", "price", "quantity"))
+        out, err = self._import(content, ".jsonl", "--chunk-size", "1")
+        self.assertIn("line 2", err)
+        self.assertEqual(list(Product.objects.order_by("sku").values_list("sku", "name", "price", "quantity")), first)
+        self.assertEqual(Product.objects.filter(sku="J-1").count(), 1)
+
+        with self.assertRaises(CommandError):
+            self._import(content, ".jsonl", "--max-errors", "0")
+
+
+class ExportTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.staff = cls.make_user("staff", is_staff=True)
+        deactivate_products(Product.objects.filter(sku="SKU-2"))
+        cls.orders = [
+            Order.objects.create(
+                user=cls.user, total_amount=total, shipping_address="Street, 1",
+                delivery_method=Order.DeliveryMethod.COURIER,
+            )
+            for total in (300, 0)
+        ]
+        for product, quantity in zip(cls.products, (1, 2)):
+            OrderItem.objects.create(order=cls.orders[0], product=product, quantity=quantity)
+
+    def _export(self, url, user):
+        response = self.client.get(url, **self.auth(user))
+        self.assertEqual(response.status_code, 200, getattr(response, "content", b""))
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_product_export_bodies_include_deactivated(self):
+        self.assertEqual(self.client.get("/websec/products/export/", **self.auth()).status_code, 403)
+
+        response, body = self._export("/websec/products/export/?output=csv", self.staff)
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="products.csv"')
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual([(r["sku"], r["is_active"], r["brand__name"]) for r in rows], [
+            ("SKU-0", "True", "Brand"), ("SKU-1", "True", "Brand"), ("SKU-2", "False", "Brand"),
+        ])
+
+        response, body = self._export("/websec/products/export/?output=ndjson&price_min=100", self.staff)
+        self.assertTrue(response["Content-Type"].startswith("application/x-ndjson"))
+        docs = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(docs[0], {
+            "id": self.products[0].pk, "sku": "SKU-0", "name": "Product 0", "price": "100", "quantity": 10,
+            "is_active": True, "brand_id": self.brand.pk, "brand__name": "Brand",
+            "category_id": self.category.pk, "category__name": "Category", "description": "",
+        })
+        self.assertEqual(len(docs), 3)
+        self.assertEqual(self.client.get("/websec/products/export/?output=xml", **self.auth(self.staff)).status_code, 400)
+
+    def test_order_export_bodies_keep_orders_without_items(self):
+        with_items, empty = self.orders
+        _, body = self._export("/websec/orders/export/?output=csv", self.user)
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual(
+            [(r["order_id"], r["order__shipping_address"], r["product__sku"], r["quantity"]) for r in rows],
+            [(str(with_items.pk), "Street, 1", "SKU-0", "1"), (str(with_items.pk), "Street, 1", "SKU-1", "2"),
+             (str(empty.pk), "Street, 1", "", "")],
+        )
+
+        _, body = self._export("/websec/orders/export/?output=ndjson", self.user)
+        docs = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([(d["id"], len(d["items"])) for d in docs], [(with_items.pk, 2), (empty.pk, 0)])
+        self.assertEqual(docs[0]["items"][1], {
+            "product_id": self.products[1].pk, "product__sku": "SKU-1", "quantity": 2, "unit_price": "100", "subtotal": "200",
+        })
+        # Чужие заказы в выгрузку не попадают
+        _, body = self._export("/websec/orders/export/?output=ndjson", self.staff)
+        self.assertEqual(body, "")
+
+    def test_staff_order_export_covers_all_users_with_admin_filters(self):
+        with_items, empty = self.orders
+        other = Order.objects.create(
+            user=self.staff, total_amount=0, shipping_address="Other", delivery_method=Order.DeliveryMethod.PICKUP,
+            status=Order.Status.PAID,
+        )
+        url = "/websec/orders/export-all/?output=ndjson"
+        self.assertEqual(self.client.get(url, **self.auth()).status_code, 403)
+
+        def exported(query=""):
+            _, body = self._export(url + query, self.staff)
+            return [json.loads(line)["id"] for line in body.splitlines()]
+
+        self.assertEqual(exported(), [with_items.pk, empty.pk, other.pk])
+        self.assertEqual(exported("&status=paid"), [other.pk])
+        self.assertEqual(exported("&delivery_method=courier"), [with_items.pk, empty.pk])
+        self.assertEqual(exported(f"&user={self.user.pk}"), [with_items.pk, empty.pk])
+        self.assertEqual(exported("&archived=true"), [])
+        for query in ("&status=lost", "&user=x", "&output=xml"):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(url + query, **self.auth(self.staff)).status_code, 400)
+
+        # То же из админки: действие над выбранными заказами
+        self.client.force_login(self.make_user("admin", is_staff=True, is_superuser=True))
+        response = self.client.post("/websec/admin/shop/order/", {
+            "action": "export_orders_csv", admin.helpers.ACTION_CHECKBOX_NAME: [with_items.pk, other.pk],
+        })
+        rows = list(csv.DictReader(StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual([(r["order_id"], r["product__sku"]) for r in rows],
+                         [(str(with_items.pk), "SKU-0"), (str(with_items.pk), "SKU-1"), (str(other.pk), "")])
+
+
+class AdminChangelistTests(ShopTestCase):
+    changelists = ["product", "productimage", "cart", "cartitem", "order", "orderitem", "archivedorder"]
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.staff = cls.make_user("staff", is_staff=True, is_superuser=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.staff)
+        self.rows = 0
+
+    def _add_rows(self, count):
+        for i in range(self.rows, self.rows + count):
+            # Без create_user: хеширование пароля тут только замедляет тест
+            user = get_user_model().objects.create(
+                username=f"customer{i}", email=f"customer{i}@example.com", first_name="C", last_name="U",
+            )
+            product = self.make_product(100 + i)
+            ProductImage.objects.create(image=f"product_images/{product.sku}.jpg", product=product)
+            CartItem.objects.create(cart=Cart.objects.create(user=user), product=product, quantity=1)
+            order = Order.objects.create(
+                user=user, total_amount=100, shipping_address="Street", delivery_method=Order.DeliveryMethod.COURIER,
+            )
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+            ArchivedOrder.objects.create(
+                id=10_000 + i, user=user, status=Order.Status.DELIVERED, total_amount=100, created_at=timezone.now(),
+                shipping_address="Street", delivery_method=Order.DeliveryMethod.COURIER,
+            )
+        self.rows += count
+
+    def _queries(self, url):
+        with CaptureQueriesContext(connections["default"]) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return [q["sql"] for q in queries]
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self._add_rows(2)
+        urls = [f"/websec/admin/shop/{name}/" for name in self.changelists]
+        expected = {url: len(self._queries(url)) for url in urls}
+        self._add_rows(10)
+        for url in urls:
+            with self.subTest(url=url), self.assertNumQueries(expected[url]):
+                self.client.get(url)
+
+    def test_search_skips_the_full_result_count(self):
+        self._add_rows(3)
+        for url in ("/websec/admin/shop/product/?q=Product", "/websec/admin/shop/order/?q=customer1%40example.com"):
+            with self.subTest(url=url):
+                counts = [sql for sql in self._queries(url) if "COUNT(" in sql.upper()]
+                # Только COUNT отфильтрованного списка, без второго COUNT(*) по всей таблице
+                self.assertEqual(len(counts), 1)
+        # sku — точное совпадение, без LIKE '%...%'
+        sql = " ".join(self._queries("/websec/admin/shop/product/?q=SKU-1"))
+        self.assertIn('"shop_product"."name" LIKE \'%SKU-1%\'', sql)
+        self.assertNotIn('"shop_product"."sku" LIKE \'%', sql)
+
+
+class InstrumentationTests(ShopTestCase):
+    label = '{view="websec/products/$",method="GET"}'
+
+    def _metrics(self, **extra):
+        response = self.client.get("/websec/metrics/", **extra)
+        return response, response.content.decode()
+
+    def _count(self, body, metric):
+        for line in body.splitlines():
+            if line.startswith(f"shop_http_{metric}_count{self.label} "):
+                return int(line.rsplit(" ", 1)[1])
+        return 0
+
+    def test_server_timing_reports_queries_and_sections(self):
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = self.client.get("/websec/products/")
+        self.assertRegex(
+            response["Server-Timing"],
+            rf'^db;dur=\d+\.\d\d;desc="{len(queries)} queries", serialize;dur=\d+\.\d\d, '
+            r"render;dur=\d+\.\d\d, total;dur=\d+\.\d\d$",
+        )
+        # Закэшированный список: ни SQL, ни сериализатора
+        self.assertTrue(self.client.get("/websec/products/")["Server-Timing"].startswith('db;dur=0.00;desc="0 queries", serialize;dur=0.00'))
+        with override_settings(INSTRUMENTATION_SERVER_TIMING=False):
+            self.assertNotIn("Server-Timing", self.client.get("/websec/products/").headers)
+
+    def test_metrics_endpoint(self):
+        before = self._count(self._metrics()[1], "request_duration_seconds")
+        self.client.get("/websec/products/")
+        self.client.get("/websec/products/")
+        response, body = self._metrics()
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        for metric in ("request_duration_seconds", "db_duration_seconds", "serialize_duration_seconds",
+                       "render_duration_seconds", "db_queries"):
+            with self.subTest(metric=metric):
+                self.assertIn(f"# TYPE shop_http_{metric} histogram", body)
+                self.assertEqual(self._count(body, metric), before + 2)
+        self.assertIn(f'shop_http_db_queries_bucket{self.label[:-1]},le="+Inf"}} {before + 2}', body)
+        # Только с разрешённых адресов; X-Forwarded-For не учитывается
+        self.assertEqual(self._metrics(REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="127.0.0.1")[0].status_code, 403)
+
+
+class BenchmarkTests(TestCase):
+    def test_scenarios_run_against_small_dataset(self):
+        seeded = seed_dataset(Dataset(brands=2, categories=2, products=10, images_per_product=1,
+                                      users=2, cart_items=2, orders=3))
+        scenarios = build_scenarios(seeded)
+        results = run_client(scenarios, seeded["users"][0], iterations=2, warmup=1)
+        self.assertEqual(list(results), [f"client:{s.name}" for s in scenarios])
+        for name, result in results.items():
+            with self.subTest(scenario=name):
+                self.assertEqual(result["iterations"], 2)
+                self.assertIsInstance(result["queries"], int)
+                self.assertIsInstance(result["warm_queries"], int)
+                self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+        # Список кэшируется: запросы к БД видны только на холодном запросе
+        self.assertGreater(results["client:product_list"]["queries"], 0)
+        self.assertEqual(results["client:product_list"]["warm_queries"], 0)
+
+    def test_compare_reports_slowdowns_and_extra_queries(self):
+        baseline = {"results": {
+            "client:a": {"p95_ms": 10.0, "queries": 3},
+            "client:b": {"p95_ms": 10.0, "queries": 3},
+            "client:gone": {"p95_ms": 1.0, "queries": 1},
+        }}
+        results = {
+            "client:a": {"p95_ms": 11.9, "queries": 3},
+            "client:b": {"p95_ms": 12.1, "queries": 4},
+        }
+        self.assertEqual(compare(results, baseline, 0.2), [
+            "client:b: p95 10.0ms -> 12.1ms",
+            "client:b: queries 3 -> 4",
+        ])
+        baseline["results"]["client:a"]["warm_queries"] = 0
+        results["client:a"]["warm_queries"] = 2
+        self.assertEqual(compare(results, baseline, 0.2)[0], "client:a: warm queries 0 -> 2")
+
+    def test_command_rejects_non_positive_iterations(self):
+        with self.assertRaisesMessage(CommandError, "--iterations must be positive"):
+            call_command("bench_shop", iterations=0, stdout=StringIO())
+
+
+class SyntheticSeedTests(TestCase):
+    plan = SeedPlan(seed=7, brands=3, categories=4, products=30, images_per_product=1, users=10,
+                    cart_ratio=0.5, orders=20, max_order_items=5, days=30, chunk_size=8,
+                    use_copy=False, password_hash="!", now_ts=1_700_000_000.0)
+
+    def _seed(self, plan):
+        seed_reference_data(plan)
+        for phase, total in (("products", plan.products), ("users", plan.users), ("orders", plan.orders)):
+            for chunk, offset in enumerate(range(0, total, plan.chunk_size)):
+                run_chunk(phase, plan, chunk, offset + 1, min(plan.chunk_size, total - offset))
+        return {
+            "products": list(Product.objects.order_by("id").values_list(
+                "id", "name", "sku", "price", "quantity", "is_active", "brand_id", "category_id")),
+            "images": sorted(ProductImage.objects.values_list("product_id", "name")),
+            "carts": sorted(CartItem.objects.values_list("cart__user_id", "product_id", "quantity", "total_item_price")),
+            "orders": list(Order.objects.order_by("id").values_list(
+                "id", "user_id", "status", "total_amount", "created_at", "delivery_method")),
+            "order_items": sorted(OrderItem.objects.values_list("order_id", "product_id", "quantity", "subtotal")),
+        }
+
+    def _wipe(self):
+        for model in (OrderItem, Order, CartItem, Cart, ProductImage, Product, Category, Brand):
+            model.objects.all().delete()
+        get_user_model().objects.all().delete()
+
+    def test_same_seed_produces_same_dataset(self):
+        first = self._seed(self.plan)
+        self.assertEqual(len(first["products"]), 30)
+        self.assertEqual(len(first["orders"]), 20)
+        # Цены в заказах совпадают с ценами товаров, хотя считаются в другом чанке
+        prices = {pk: price for pk, _, _, price, *_ in first["products"]}
+        for _, product_id, quantity, subtotal in first["order_items"]:
+            self.assertEqual(subtotal, prices[product_id] * quantity)
+        self._wipe()
+        self.assertEqual(self._seed(self.plan), first)
+        self._wipe()
+        self.assertNotEqual(self._seed(replace(self.plan, seed=8))["orders"], first["orders"])
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, ShopTestCase):
+    product_count = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for product in cls.products:
+            ProductImage.objects.create(image=f"product_images/{product.sku}.jpg", product=product)
+        cls.budget_user = cls.user
+        cart = Cart.objects.create(user=cls.user)
+        order = Order.objects.create(
+            user=cls.user, total_amount=0, shipping_address="Street",
+            delivery_method=Order.DeliveryMethod.COURIER,
+        )
+        for product in cls.products[:3]:
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+
+    def test_router_endpoints_within_budget(self):
+        self.assertRouterQueryBudgets(router)
+
+    def test_me_within_budget(self):
+        self.assertQueryBudget("/websec/auth/me/")
+
+    def test_bulk_get_within_budget(self):
+        ids = ",".join(str(product.pk) for product in self.products)
+        self.assertQueryBudget(f"/websec/products/bulk-get/?ids={ids}")
+
+    def test_resolve_budget(self):
+        detail = f"/websec/products/{self.products[0].pk}/"
+        # Словарь по action, декоратор на обработчике, метод без бюджета
+        self.assertEqual(resolve_query_budget(resolve(detail).func, "GET"), 4)
+        self.assertIsNone(resolve_query_budget(resolve(detail).func, "DELETE"))
+        self.assertEqual(resolve_query_budget(resolve("/websec/auth/me/").func, "GET"), 5)
+        self.assertEqual(resolve_query_budget(resolve("/websec/brands/").func, "POST"), 2)
+
+    def test_exceeded_budget_raises_or_logs_with_call_sites(self):
+        url = f"/websec/products/{self.products[0].pk}/"
+        with mock.patch.object(ProductViewSet, "max_queries", {"retrieve": 1}):
+            with override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_MODE="raise"):
+                with self.assertRaises(QueryBudgetExceeded) as raised:
+                    self.client.get(url)
+            report = str(raised.exception)
+            self.assertRegex(report, rf"^GET {url}: \d+ queries, budget 1\n")
+            self.assertIn("shop/", report)
+
+            with override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_MODE="log"):
+                with self.assertLogs("e_commerce.query_budget", "WARNING") as logs:
+                    response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("budget 1", logs.output[0])
+
+            # Выключено — SQL не собирается и ничего не проверяется
+            with override_settings(QUERY_BUDGET_ENABLED=False, QUERY_BUDGET_MODE="raise"):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ReplicaRoutingTests(TestCase):
+    router = PrimaryReplicaRouter()
+
+    def _route(self, method, model=Product, cookies=None, write_first=False, aliases=("replica",)):
+        seen = {}
+
+        def view(request):
+            if write_first:
+                self.router.db_for_write(Cart)
+            seen["db"] = self.router.db_for_read(model)
+            return HttpResponse()
+
+        request = RequestFactory().generic(method, "/")
+        request.COOKIES.update(cookies or {})
+        with mock.patch("e_commerce.db_router.replicas", return_value=list(aliases)):
+            response = ReplicaRoutingMiddleware(view)(request)
+        return seen["db"], response
+
+    def test_catalog_reads_on_safe_methods_use_replica(self):
+        self.assertEqual(self._route("GET")[0], "replica")
+        self.assertEqual(self._route("HEAD")[0], "replica")
+        self.assertEqual(self._route("GET", model=Cart)[0], "default")
+        self.assertEqual(self._route("POST")[0], "default")
+        self.assertEqual(self._route("GET", aliases=())[0], "default")
+
+    def test_pinned_to_primary_after_write(self):
+        db, response = self._route("GET", write_first=True)
+        self.assertEqual(db, "default")
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self._route("GET", cookies={PIN_COOKIE: "1"})[0], "default")
+
+    def test_pin_cookie_expires_after_configured_seconds(self):
+        cookie = self._route("POST", write_first=True)[1].cookies[PIN_COOKIE]
+        self.assertEqual(cookie["max-age"], 5)
+        self.assertTrue(cookie["httponly"])
+        with override_settings(DATABASE_REPLICA_PIN_SECONDS=30):
+            self.assertEqual(self._route("POST", write_first=True)[1].cookies[PIN_COOKIE]["max-age"], 30)
+        # 0 — не закреплять; без реплик закреплять незачем
+        with override_settings(DATABASE_REPLICA_PIN_SECONDS=0):
+            self.assertNotIn(PIN_COOKIE, self._route("POST", write_first=True)[1].cookies)
+        self.assertNotIn(PIN_COOKIE, self._route("POST", write_first=True, aliases=())[1].cookies)
+        # Чтение без записи cookie не ставит
+        self.assertNotIn(PIN_COOKIE, self._route("GET")[1].cookies)
+
+    def test_state_does_not_leak_out_of_request(self):
+        self._route("GET")
+        self.assertEqual(self.router.db_for_read(Product), "default")
+
+    def test_select_for_update_reads_primary(self):
+        seen = {}
+
+        def view(request):
+            seen["db"] = Product.objects.select_for_update().db
+            seen["after"] = self.router.db_for_read(Product)
+            return HttpResponse()
+
+        with mock.patch("e_commerce.db_router.replicas", return_value=["replica"]):
+            ReplicaRoutingMiddleware(view)(RequestFactory().get("/"))
+        self.assertEqual(seen, {"db": "default", "after": "default"})
+
+
+@skipUnless("replica" in settings.DATABASES, "needs DATABASES['replica']")
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaIntegrationTests(ShopTestCase):
+    """Needs a second, non-mirror database ``replica`` in DATABASES (not listed in DATABASE_REPLICAS)."""
+
+    databases = "__all__"
+
+    @classmethod
+    def setUpTestData(cls):
+        for alias in ("default", "replica"):
+            brand = Brand.objects.using(alias).create(name="Brand")
+            category = Category.objects.using(alias).create(name="Category")
+            Product.objects.using(alias).create(
+                id=1, name="Product", sku="SKU-1", price=100, quantity=10, brand=brand, category=category,
+            )
+        # Только на "реплике" — по нему видно, откуда читала вьюха
+        Product.objects.using("replica").create(
+            id=2, name="Replica only", sku="SKU-2", price=100, quantity=10, brand_id=brand.pk, category_id=category.pk,
+        )
+        cls.user = cls.make_user("buyer")
+
+    def test_catalog_reads_from_replica(self):
+        response = self.client.get("/websec/products/")
+        self.assertEqual({p["sku"] for p in response.json()}, {"SKU-1", "SKU-2"})
+
+    def test_checkout_locks_on_primary_and_pins_client(self):
+        response = self.client.post("/websec/cart-items/", {"product_id": 1, "quantity": 1}, **self.auth())
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        with CaptureQueriesContext(connections["default"]) as primary:
+            response = self.client.post("/websec/orders/from_cart/", {"shipping_address": "Street"}, **self.auth())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Product.objects.using("default").get(pk=1).quantity, 9)
+        self.assertTrue(any('"shop_product"' in q["sql"] for q in primary.captured_queries))
+
+        response = self.client.get("/websec/products/")
+        self.assertEqual({p["sku"] for p in response.json()}, {"SKU-1"})
+
+
+class SalesRollupTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.other_category = Category.objects.create(name="Other category")
+        super().setUpTestData()
+        cls.staff = cls.make_user("staff", is_staff=True)
+
+    @classmethod
+    def product_fields(cls, i):
+        fields = {"price": 100 * (i + 1), "quantity": 100}
+        if i % 2:
+            fields["category"] = cls.other_category
+        return fields
+
+    def _checkout(self, quantities):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        for product, quantity in zip(self.products, quantities):
+            if quantity:
+                CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        response = self.client.post("/websec/orders/from_cart/", {"shipping_address": "Street"}, **self.auth())
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.get(pk=response.json()["id"])
+
+    def _snapshot(self):
+        return {
+            model.__name__: sorted(model.objects.values_list(key, "day", "units", "revenue", "orders"))
+            for model, key, _ in ROLLUPS
+        }
+
+    def test_checkout_updates_rollups_and_backfill_matches(self):
+        self._checkout([1, 2, 0])
+        self._checkout([3, 0, 1])
+        today = timezone.localdate()
+        self.assertEqual(
+            sorted(ProductDailySales.objects.values_list("product_id", "units", "revenue", "orders")),
+            [(self.products[0].pk, 4, 400, 2), (self.products[1].pk, 2, 400, 1), (self.products[2].pk, 1, 300, 1)],
+        )
+        self.assertEqual(BrandDailySales.objects.get(brand=self.brand, day=today).orders, 2)
+        # SKU-0 и SKU-2 из одной категории: заказ считается один раз, штуки и выручка складываются
+        self.assertEqual(
+            CategoryDailySales.objects.filter(category=self.category).values_list("units", "revenue", "orders").get(),
+            (5, 700, 2),
+        )
+
+        incremental = self._snapshot()
+        for model, _, _ in ROLLUPS:
+            model.objects.all().delete()
+        rebuild_days(today, today)
+        self.assertEqual(self._snapshot(), incremental)
+
+    def test_rebuild_reads_archive_and_keeps_days_outside_range(self):
+        self._checkout([1, 0, 0])
+        self._checkout([0, 2, 0])
+        today = timezone.localdate()
+        yesterday = today - timedelta(days=1)
+        ProductDailySales.objects.create(product=self.products[2], day=yesterday, units=7, revenue=2100, orders=1)
+        incremental = self._snapshot()
+
+        self.assertEqual(list(archive_orders(timezone.now() + timedelta(seconds=1), batch_size=1)), [(1, 1), (1, 1)])
+        self.assertFalse(Order.objects.exists())
+        rebuild_days(today, today)
+        self.assertEqual(self._snapshot(), incremental)
+
+    @override_settings(TIME_ZONE="Europe/Moscow")
+    def test_day_is_local_date(self):
+        order = self._checkout([1, 0, 0])
+        # 22:30 UTC — уже следующий день по Москве
+        late = timezone.make_aware(datetime(2026, 1, 1, 22, 30), dt_timezone.utc)
+        Order.objects.filter(pk=order.pk).update(created_at=late)
+        ProductDailySales.objects.all().delete()
+        record_order(Order.objects.get(pk=order.pk))
+        recorded = self._snapshot()
+        self.assertEqual(ProductDailySales.objects.get().day, date(2026, 1, 2))
+
+        rebuild_days(date(2026, 1, 1), date(2026, 1, 2))
+        self.assertEqual(self._snapshot(), recorded)
+        rebuild_days(date(2026, 1, 1), date(2026, 1, 1))
+        self.assertEqual(self._snapshot(), recorded)
+
+    def test_analytics_api_is_staff_only(self):
+        self._checkout([1, 2, 0])
+        self.assertEqual(self.client.get("/websec/analytics/products/", **self.auth()).status_code, 403)
+
+        auth = self.auth(self.staff)
+        data = self.client.get("/websec/analytics/products/?order_by=revenue", **auth).json()
+        self.assertEqual([r["sku"] for r in data["results"]], ["SKU-1", "SKU-0"])
+        daily = self.client.get("/websec/analytics/daily/", **auth).json()["results"]
+        self.assertEqual([(r["units"], r["revenue"]) for r in daily], [(3, 500)])
+
+
+class PopularityTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user.wishlist.add(cls.products[0])
+
+    def _sales(self, product, *days_ago_units):
+        today = timezone.localdate()
+        ProductDailySales.objects.bulk_create(
+            ProductDailySales(product=product, day=today - timedelta(days=ago), units=units, revenue=0, orders=1)
+            for ago, units in days_ago_units
+        )
+
+    def _counters(self):
+        return list(Product.objects.order_by("pk").values_list("units_sold_7d", "units_sold_30d", "wishlist_count"))
+
+    def test_refresh_and_ordering(self):
+        self._sales(self.products[1], (0, 5))
+        self._sales(self.products[2], (10, 9), (40, 50))
+        self.assertEqual(list(refresh_popularity(batch_size=2)), [(2, 2), (3, 3)])
+        self.assertEqual(self._counters(), [(0, 0, 1), (5, 5, 0), (0, 9, 0)])
+        # Повторный прогон ничего не пишет
+        self.assertEqual(list(refresh_popularity(batch_size=2))[-1], (3, 0))
+
+        response = self.client.get("/websec/products/?ordering=-units_sold_30d")
+        self.assertEqual([p["sku"] for p in response.json()], ["SKU-2", "SKU-1", "SKU-0"])
+
+    def test_window_edges(self):
+        # 6 дней назад — ещё в 7-дневном окне, 7 — уже нет; то же для 29/30 в 30-дневном
+        self._sales(self.products[1], (6, 1), (7, 10), (29, 100), (30, 1000))
+        list(refresh_popularity())
+        self.assertEqual(self._counters()[1], (1, 111, 0))
+
+    def test_counters_decay_and_version_bumps_only_on_change(self):
+        self._sales(self.products[1], (0, 5))
+        list(refresh_popularity())
+        version = get_catalog_version()
+        list(refresh_popularity())
+        self.assertEqual(get_catalog_version(), version)
+
+        # Через неделю продажи выпадают из 7-дневного окна, сняли товар из избранного
+        self.user.wishlist.remove(self.products[0])
+        list(refresh_popularity(today=timezone.localdate() + timedelta(days=7)))
+        self.assertEqual(self._counters(), [(0, 0, 0), (0, 5, 0), (0, 0, 0)])
+        self.assertNotEqual(get_catalog_version(), version)
+
+
+@override_settings(SHOP_RECOMMENDATIONS_LAG_SECONDS=0)
+class RecommendationTests(ShopTestCase):
+    product_count = 4
+
+    def _order(self, *indexes, **fields):
+        order = Order.objects.create(
+            user=self.user, total_amount=0, shipping_address="Street", delivery_method=Order.DeliveryMethod.COURIER,
+            **fields,
+        )
+        for i in indexes:
+            OrderItem.objects.create(order=order, product=self.products[i], quantity=1)
+        return order
+
+    def _table(self):
+        return sorted(ProductRecommendation.objects.values_list("product_id", "recommended_id", "score"))
+
+    def test_engines_and_incremental_agree(self):
+        p = [product.pk for product in self.products]
+        self._order(0, 1, 2)
+        self._order(0, 1)
+        build_recommendations(engine="python")
+        self._order(0, 3)
+        self._order(1, 1)  # одна позиция дважды — пары нет
+        stats = build_recommendations(engine="python")
+        self.assertEqual(stats["orders"], 2)
+        incremental = self._table()
+        self.assertEqual(incremental, sorted([
+            (p[0], p[1], 2), (p[1], p[0], 2), (p[0], p[2], 1), (p[2], p[0], 1),
+            (p[1], p[2], 1), (p[2], p[1], 1), (p[0], p[3], 1), (p[3], p[0], 1),
+        ]))
+
+        for engine in ("python", "numpy"):
+            with self.subTest(engine=engine):
+                try:
+                    build_recommendations(full=True, engine=engine)
+                except ImportError:
+                    self.skipTest("NumPy/SciPy not installed")
+                self.assertEqual(self._table(), incremental)
+
+    @override_settings(SHOP_RECOMMENDATIONS_LAG_SECONDS=60)
+    def test_watermark_waits_for_orders_still_in_flight(self):
+        p = [product.pk for product in self.products]
+        self._order(0, 1, pk=10)
+        Order.objects.filter(pk=10).update(created_at=timezone.now() - timedelta(minutes=5))
+        self._order(0, 2, pk=12)
+        stats = build_recommendations(engine="python")
+        self.assertEqual((stats["orders"], stats["watermark"]), (1, 10))
+
+        # Заказ 11 закоммитился после заказа 12 — следующий прогон его не пропускает
+        self._order(1, 2, pk=11)
+        Order.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        stats = build_recommendations(engine="python")
+        self.assertEqual((stats["orders"], stats["watermark"]), (2, 12))
+        self.assertEqual(self._table(), sorted([
+            (p[0], p[1], 1), (p[1], p[0], 1), (p[0], p[2], 1), (p[2], p[0], 1), (p[1], p[2], 1), (p[2], p[1], 1),
+        ]))
+
+    def test_bought_together_action(self):
+        self._order(0, 1, 2)
+        self._order(0, 1)
+        build_recommendations(engine="python")
+        Product.objects.filter(pk=self.products[2].pk).update(is_active=False)
+        response = self.client.get(f"/websec/products/{self.products[0].pk}/bought-together/")
+        self.assertEqual([(r["sku"], r["score"]) for r in response.json()], [("SKU-1", 2)])
+
+    def test_chunking_basket_cap_and_tie_break(self):
+        p = [product.pk for product in self.products]
+        self._order(0, 1)
+        self._order(2, 3)
+        self._order(0, 1, 2, 3)  # больше MAX_BASKET_SIZE — пропускается
+        self._order(3)
+        with mock.patch("shop.recommendations.MAX_BASKET_SIZE", 3):
+            # Границы чанков не делят заказ; прочитаны все, включая одиночный
+            stats = build_recommendations(chunk_size=1, keep=1, engine="python")
+        self.assertEqual((stats["orders"], stats["watermark"]), (4, Order.objects.latest("id").pk))
+        # keep=1 и равные счёты: остаётся сосед с меньшим id
+        self.assertEqual(self._table(), sorted([(p[0], p[1], 1), (p[1], p[0], 1), (p[2], p[3], 1), (p[3], p[2], 1)]))
+
+        # Без новых заказов инкрементальный прогон ничего не читает и не меняет
+        self.assertEqual(build_recommendations(engine="python")["orders"], 0)
+        self.assertEqual(len(self._table()), 4)
+
+    def test_bought_together_limit(self):
+        self._order(0, 1, 2, 3)
+        self._order(0, 1)
+        build_recommendations(engine="python")
+        url = f"/websec/products/{self.products[0].pk}/bought-together/"
+        self.assertEqual([r["sku"] for r in self.client.get(url + "?limit=1").json()], ["SKU-1"])
+        self.assertEqual(len(self.client.get(url + "?limit=0").json()), 1)
+        self.assertEqual(len(self.client.get(url + "?limit=1000").json()), 3)
+        self.assertEqual(self.client.get(url + "?limit=x").status_code, 400)
+
+
+@override_settings(SHOP_CHANGES_LAG_SECONDS=0)
+class ChangeFeedTests(ShopTestCase):
+    def _page(self, **params):
+        response = self.client.get("/websec/products/changes/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_cursor_pages_and_tombstones(self):
+        first = self._page(limit=2)
+        self.assertEqual([p["sku"] for p in first["results"]], ["SKU-0", "SKU-1"])
+        self.assertTrue(first["has_more"])
+        second = self._page(limit=2, cursor=first["next_cursor"])
+        self.assertEqual([p["sku"] for p in second["results"]], ["SKU-2"])
+        self.assertFalse(second["has_more"])
+
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.price = 150
+        product.save()
+        CustomProductAdmin(Product, admin.site).make_unactive(None, Product.objects.filter(pk=self.products[1].pk))
+        self.products[2].delete()
+
+        third = self._page(cursor=second["next_cursor"])
+        # Неактивные товары в выдаче не видны — только их tombstone
+        self.assertEqual([p["sku"] for p in third["results"]], ["SKU-0"])
+        self.assertEqual(
+            [(t["sku"], t["reason"]) for t in third["removed"]], [("SKU-1", "deactivated"), ("SKU-2", "deleted")],
+        )
+        empty = self._page(cursor=third["next_cursor"])
+        self.assertEqual((empty["results"], empty["removed"]), ([], []))
+
+    def test_updated_since_and_save_deactivation(self):
+        since = timezone.now()
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.is_active = False
+        product.save()
+        CustomProductAdmin(Product, admin.site).make_active(None, Product.objects.filter(pk=self.products[1].pk))
+        data = self._page(updated_since=since.isoformat())
+        self.assertEqual(data["results"], [])
+        self.assertEqual([(t["sku"], t["reason"]) for t in data["removed"]], [("SKU-0", "deactivated")])
+
+        CustomProductAdmin(Product, admin.site).make_active(None, Product.objects.filter(pk=self.products[0].pk))
+        data = self._page(cursor=data["next_cursor"])
+        self.assertEqual([p["sku"] for p in data["results"]], ["SKU-0"])
+
+    def test_equal_timestamps_and_tombstones_page_separately(self):
+        Product.objects.update(updated_at=timezone.now() - timedelta(minutes=1))
+        first = self._page(limit=2)
+        second = self._page(limit=2, cursor=first["next_cursor"])
+        # Одинаковый updated_at: порядок и продолжение — по id
+        self.assertEqual([p["sku"] for p in first["results"] + second["results"]], ["SKU-0", "SKU-1", "SKU-2"])
+
+        deactivate_products(Product.objects.all())
+        third = self._page(limit=2, cursor=second["next_cursor"])
+        self.assertEqual((third["results"], [t["sku"] for t in third["removed"]]), ([], ["SKU-0", "SKU-1"]))
+        self.assertTrue(third["has_more"])
+        fourth = self._page(limit=2, cursor=third["next_cursor"])
+        self.assertEqual([t["sku"] for t in fourth["removed"]], ["SKU-2"])
+        self.assertFalse(fourth["has_more"])
+
+    def test_lag_horizon_does_not_skip_recent_rows(self):
+        deactivate_products(Product.objects.filter(pk=self.products[0].pk))
+        with override_settings(SHOP_CHANGES_LAG_SECONDS=60):
+            # Всё моложе горизонта: ни товаров, ни tombstone, но курсор их не перескакивает
+            first = self._page()
+        self.assertEqual((first["results"], first["removed"]), ([], []))
+        later = self._page(cursor=first["next_cursor"])
+        self.assertEqual([p["sku"] for p in later["results"]], ["SKU-1", "SKU-2"])
+        self.assertEqual([t["sku"] for t in later["removed"]], ["SKU-0"])
+
+    def test_invalid_parameters(self):
+        for query in (
+            "cursor=garbage",
+            f"cursor={encode_cursor(None, 0)[:-2]}",
+            "cursor=" + base64.urlsafe_b64encode(b'["yesterday", 1, 0]').decode(),
+            "updated_since=yesterday",
+            "limit=x",
+        ):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f"/websec/products/changes/?{query}").status_code, 400)
+
+
+class ConditionalGetTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.product = cls.products[0]
+        Cart.objects.create(user=cls.user)
+
+    def _revalidate(self, url, **headers):
+        first = self.client.get(url, **headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("ETag", first.headers)
+        return first["ETag"], self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"], **headers)
+
+    def test_product_detail(self):
+        url = f"/websec/products/{self.product.pk}/"
+        etag, response = self._revalidate(url)
+        self.assertEqual(response.status_code, 304)
+
+        self.product.price = 120
+        self.product.save()
+        etag = self.client.get(url)["ETag"]
+        # Вложенный бренд меняется через версию каталога
+        bump_catalog_version()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_catalog_change_moves_last_modified(self):
+        urls = {f"/websec/products/{self.product.pk}/": {}, "/websec/cart/": self.auth(), "/websec/auth/me/": self.auth()}
+        since = {url: self.client.get(url, **headers)["Last-Modified"] for url, headers in urls.items()}
+        for url, headers in urls.items():
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=since[url], **headers).status_code, 304)
+
+        # Переименование бренда не трогает updated_at товара, но меняет тело ответа
+        brand = Brand.objects.get(pk=self.brand.pk)
+        brand.name = "Renamed"
+        with mock.patch("shop.cache.time.time", return_value=time.time() + 5):
+            brand.save()
+        for url, headers in urls.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since[url], **headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["Last-Modified"], since[url])
+
+    def test_cart_and_me_skip_serializers_when_unchanged(self):
+        for url in ("/websec/cart/", "/websec/auth/me/"):
+            with self.subTest(url=url):
+                etag, response = self._revalidate(url, **self.auth())
+                self.assertEqual(response.status_code, 304)
+                self.assertIn("private", response["Cache-Control"])
+                with CaptureQueriesContext(connections["default"]) as queries:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth())
+                self.assertEqual(response.status_code, 304)
+                # Пользователь по JWT + версия корзины
+                self.assertEqual(len(queries), 2)
+
+                CartItem.objects.create(cart=self.user.cart, product=self.product, quantity=1)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth()).status_code, 200)
+                CartItem.objects.all().delete()
+
+    def test_checkout_by_another_user_changes_cart_etag(self):
+        CartItem.objects.create(cart=self.user.cart, product=self.product, quantity=1)
+        other = self.make_user("other")
+        CartItem.objects.create(cart=Cart.objects.create(user=other), product=self.product, quantity=3)
+        etags = {url: self.client.get(url, **self.auth())["ETag"] for url in ("/websec/cart/", "/websec/auth/me/")}
+
+        response = self.client.post("/websec/orders/from_cart/", {"shipping_address": "Street"}, **self.auth(other))
+        self.assertEqual(response.status_code, 201)
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth())
+                self.assertEqual(response.status_code, 200)
+                cart = response.json() if url == "/websec/cart/" else response.json()["cart"]
+                self.assertEqual(cart["items"][0]["product"]["quantity"], 7)
+
+
+class CompiledSerializerTests(ShopTestCase):
+    product_count = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.other_brand = Brand.objects.create(name="Brand 1")
+        super().setUpTestData()
+        for i, product in enumerate(cls.products):
+            for j in range(i):
+                ProductImage.objects.create(image=f"product_images/{product.sku}-{j}.jpg", product=product)
+
+    @classmethod
+    def product_fields(cls, i):
+        return {
+            "name": f"Товар {i} ", "price": 100 + i, "quantity": i, "description": "",
+            "brand": cls.other_brand if i % 2 else cls.brand, "is_active": i != 3,
+        }
+
+    def test_byte_compatible_with_product_serializer(self):
+        request = RequestFactory().get("/websec/products/")
+        queryset = with_product_relations(Product.objects.order_by("-id"))
+        expected = JSONRenderer().render(ProductSerializer(queryset, many=True, context={"request": request}).data)
+        data = CompiledSerializer(ProductSerializer).serialize(queryset, request)
+        for encoder in ("json", "auto"):
+            with self.subTest(encoder=encoder), override_settings(FAST_JSON_ENCODER=encoder):
+                self.assertEqual(FastJSONRenderer().render(data), expected)
+
+    def test_list_endpoint_matches_regular_path(self):
+        url = "/websec/products/?ordering=price&search=Товар"
+        fast = self.client.get(url)
+        cache.clear()
+        with mock.patch.object(ProductViewSet, "fast_list", False):
+            slow = self.client.get(url)
+        self.assertEqual(fast.content, slow.content)
+        self.assertEqual(len(fast.json()), 3)
+
+    def test_fixed_query_count_and_shared_nested_dicts(self):
+        compiled = CompiledSerializer(ProductSerializer)
+        with self.assertNumQueries(1):
+            self.assertEqual(compiled.serialize(Product.objects.filter(sku="missing")), [])
+        with self.assertNumQueries(2):
+            data = compiled.serialize(Product.objects.order_by("id"))
+        # Бренд собирается один раз на id и разделяется между товарами
+        self.assertIs(data[0]["brand"], data[2]["brand"])
+        self.assertEqual(data[1]["brand"], {"id": self.other_brand.pk, "name": "Brand 1"})
+        self.assertEqual([len(item["images"]) for item in data], [0, 1, 2, 3])
+        # Без запроса — относительные URL, с запросом — абсолютные
+        url = f"{settings.MEDIA_URL}product_images/SKU-1-0.jpg"
+        self.assertEqual(data[1]["images"][0]["image"], url)
+        request = RequestFactory().get("/")
+        self.assertEqual(
+            compiled.serialize(Product.objects.filter(pk=self.products[1].pk), request)[0]["images"][0]["image"],
+            f"http://testserver{url}",
+        )
+
+    def test_uncompilable_serializers_rejected(self):
+        class BrandWithLabel(BrandSerializer):
+            label = serializers.SerializerMethodField()
+
+            class Meta(BrandSerializer.Meta):
+                fields = ["id", "label"]
+
+            def get_label(self, brand):
+                return brand.name.upper()
+
+        with self.assertRaisesMessage(ValueError, "label: SerializerMethodField can't be compiled"):
+            CompiledSerializer(BrandWithLabel)
+        # Картинки товара внутри позиции корзины — вложенный many=True
+        with self.assertRaisesMessage(ValueError, "images: nested many=True is supported only at the top level"):
+            CompiledSerializer(CartItemSerializer)
+
+
+class SparseFieldsetTests(ShopTestCase):
+    product_count = 1
+
+    @classmethod
+    def product_fields(cls, i):
+        return {"description": "Длинное описание"}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.product = cls.products[0]
+        cls.image = ProductImage.objects.create(image="product_images/SKU-0.jpg", product=cls.product)
+        cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.create(cart=cart, product=cls.product, quantity=2)
+        order = Order.objects.create(
+            user=cls.user, total_amount=200, shipping_address="Addr", delivery_method=Order.DeliveryMethod.POST,
+        )
+        OrderItem.objects.create(order=order, product=cls.product, quantity=2)
+
+    def _get(self, url, **headers):
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json(), [q["sql"] for q in queries]
+
+    def test_fields_prune_payload_and_columns(self):
+        for url in ("/websec/products/", f"/websec/products/{self.product.pk}/"):
+            with self.subTest(url=url):
+                data, queries = self._get(url + "?fields=id,name,price,brand.name")
+                item = data[0] if isinstance(data, list) else data
+                self.assertEqual(item, {"id": self.product.pk, "name": "Product 0", "price": "100", "brand": {"name": "Brand"}})
+                self.assertFalse(any("description" in sql or "shop_productimage" in sql for sql in queries))
+
+    def test_expand_collapses_other_relations_to_ids(self):
+        fast, _ = self._get("/websec/products/?expand=brand")
+        with mock.patch.object(ProductViewSet, "fast_list", False):
+            slow, _ = self._get("/websec/products/?expand=brand")
+        self.assertEqual(fast, slow)
+        self.assertEqual(fast[0]["brand"], {"id": self.product.brand_id, "name": "Brand"})
+        self.assertEqual(fast[0]["category"], self.product.category_id)
+        self.assertEqual(fast[0]["images"], [self.image.pk])
+
+    def test_cart_and_orders(self):
+        cart, queries = self._get("/websec/cart/?fields=items.quantity,items.product.name", **self.auth())
+        self.assertEqual(cart, {"items": [{"quantity": 2, "product": {"name": "Product 0"}}]})
+        self.assertFalse(any("shop_productimage" in sql for sql in queries))
+
+        items, _ = self._get("/websec/cart-items/?fields=id,product&expand=", **self.auth())
+        self.assertEqual(items[0]["product"], self.product.pk)
+
+        orders, queries = self._get("/websec/orders/?fields=id,items.product.sku", **self.auth())
+        self.assertEqual(orders[0]["items"], [{"product": {"sku": "SKU-0"}}])
+        self.assertFalse(any("shipping_address" in sql for sql in queries))
+
+    def test_unknown_fields_rejected(self):
+        self.assertEqual(self.client.get("/websec/products/?fields=id,secret").status_code, 400)
+        self.assertEqual(self.client.get("/websec/products/?expand=name").status_code, 400)
+        # Только для записи — не выбирается
+        self.assertEqual(self.client.get("/websec/products/?fields=brand_id").status_code, 400)
+        response = self.client.get("/websec/products/?fields=brand.secret,category.slug")
+        self.assertEqual(response.json(), {"fields": ["Неизвестное поле: brand.secret"]})
+        response = self.client.get("/websec/products/?expand=brand.name")
+        self.assertEqual(response.json(), {"expand": ["Нельзя развернуть: brand.name"]})
+
+    def test_equivalent_shapes_share_cache_entry(self):
+        first, _ = self._get("/websec/products/?fields=name,id,brand.name&expand=brand")
+        # Порядок и повторы не важны: тот же ключ кэша, ни одного запроса
+        second, queries = self._get("/websec/products/?fields=brand.name,id,name,id&expand=brand,brand")
+        self.assertEqual((second, queries), (first, []))
+        self.assertEqual(first[0], {"id": self.product.pk, "name": "Product 0", "brand": {"name": "Brand"}})
+
+    def test_empty_expand_collapses_every_relation(self):
+        item, queries = self._get(f"/websec/products/{self.product.pk}/?expand=")
+        self.assertEqual(
+            (item["brand"], item["category"], item["images"]),
+            (self.product.brand_id, self.product.category_id, [self.image.pk]),
+        )
+        self.assertFalse(any("shop_brand" in sql or "shop_category" in sql for sql in queries))
+        # Пустой expand и его отсутствие — разные записи кэша списка
+        collapsed, _ = self._get("/websec/products/?expand=")
+        full, _ = self._get("/websec/products/")
+        self.assertEqual(collapsed[0]["brand"], self.product.brand_id)
+        self.assertEqual(full[0]["brand"], {"id": self.product.brand_id, "name": "Brand"})
+        # brand.name в fields разворачивает brand, даже если expand пуст
+        item, _ = self._get(f"/websec/products/{self.product.pk}/?fields=brand.name,category&expand=")
+        self.assertEqual(item, {"category": self.product.category_id, "brand": {"name": "Brand"}})
+
+
+class BulkGetTests(ShopTestCase):
+    product_count = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        ProductImage.objects.create(image="product_images/SKU-0.jpg", product=cls.products[0])
+
+    @classmethod
+    def product_fields(cls, i):
+        return {"price": 100 + i, "is_active": i != 2}
+
+    def _post(self, ids):
+        return self.client.post("/websec/products/bulk-get/", {"ids": ids}, content_type="application/json")
+
+    def test_order_missing_and_cache(self):
+        a, b, inactive, d = (p.pk for p in self.products)
+        url = f"/websec/products/bulk-get/?ids={d},{a},999,{inactive},{a}"
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual([p["id"] for p in first.json()["results"]], [d, a])
+        self.assertEqual(first.json()["missing"], [999, inactive])
+        detail = self.client.get(f"/websec/products/{a}/").json()
+        self.assertEqual(first.json()["results"][1], detail)
+
+        with CaptureQueriesContext(connections["default"]) as queries:
+            second = self._post([d, a, 999, inactive])
+        self.assertEqual(second.json(), first.json())
+        # Промахи (999, неактивный) идут в базу, закэшированные — нет
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn(str(a), queries[0]["sql"].split("IN")[-1])
+
+    def test_stock_change_invalidates(self):
+        pk = self.products[0].pk
+        self.client.get(f"/websec/products/bulk-get/?ids={pk}")
+        Product.objects.filter(pk=pk).update(quantity=3)
+        invalidate_products([pk])
+        self.assertEqual(self.client.get(f"/websec/products/bulk-get/?ids={pk}").json()["results"][0]["quantity"], 3)
+
+    def test_cached_entries_keep_relative_image_urls(self):
+        pk = self.products[0].pk
+        url = f"{settings.MEDIA_URL}product_images/SKU-0.jpg"
+        first = self.client.get(f"/websec/products/bulk-get/?ids={pk}")
+        self.assertEqual(first.json()["results"][0]["images"][0]["image"], f"http://testserver{url}")
+        # Запись в кэше не зависит от хоста запроса
+        second = self.client.get(f"/websec/products/bulk-get/?ids={pk}", HTTP_HOST="shop.example.com")
+        self.assertEqual(second.json()["results"][0]["images"][0]["image"], f"http://shop.example.com{url}")
+
+    def test_validation(self):
+        for ids in ("1,x", "0", "-1", "1.5", str(MAX_ID + 1), "99999999999999999999999"):
+            with self.subTest(ids=ids):
+                self.assertEqual(self.client.get(f"/websec/products/bulk-get/?ids={ids}").status_code, 400)
+        for ids in ([True], [1.0], [None], [[1]], "1,2"):
+            with self.subTest(ids=ids):
+                self.assertEqual(self._post(ids).status_code, 400)
+        self.assertEqual(self.client.get(f"/websec/products/bulk-get/?ids={MAX_ID}").json()["missing"], [MAX_ID])
+        self.assertEqual(self._post(["1", 1]).json()["results"][0]["id"], 1)
+        self.assertEqual(self.client.get("/websec/products/bulk-get/").json(), {"results": [], "missing": []})
+        with override_settings(SHOP_BULK_GET_MAX_IDS=2):
+            self.assertEqual(self.client.get("/websec/products/bulk-get/?ids=1,2,3").status_code, 400)
+            # Лимит считается после удаления повторов
+            self.assertEqual(self.client.get("/websec/products/bulk-get/?ids=1,2,1,2").status_code, 200)
+
+
+class ScopedMiddlewareTests(TestCase):
+    def test_api_skips_browser_stack(self):
+        response = self.client.get("/websec/products/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(hasattr(response.wsgi_request, "session"))
+        self.assertNotIn("Cookie", response.headers.get("Vary", ""))
+
+        with override_settings(LEAN_API_MIDDLEWARE=False):
+            self.assertTrue(hasattr(self.client.get("/websec/products/").wsgi_request, "session"))
+
+    def test_admin_and_csrf_keep_full_stack(self):
+        self.assertIn("csrftoken", self.client.get("/websec/auth/csrf/").cookies)
+        response = self.client.get("/websec/admin/login/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(hasattr(response.wsgi_request, "user"))
+
+        # process_view у ScopedCsrfViewMiddleware срабатывает в админке, но не в API
+        client = self.client_class(enforce_csrf_checks=True)
+        self.assertEqual(client.post("/websec/admin/login/", {"username": "x", "password": "y"}).status_code, 403)
+        self.assertEqual(client.post("/websec/auth/register/", {}, content_type="application/json").status_code, 400)
+
+    def test_full_stack_paths_read_per_request(self):
+        with override_settings(FULL_STACK_PATHS=["/websec/products/"]):
+            self.assertTrue(hasattr(self.client.get("/websec/products/").wsgi_request, "session"))
+            self.assertFalse(hasattr(self.client.get("/websec/brands/").wsgi_request, "session"))
+
+    def test_cors_wraps_axes_lockout(self):
+        origin = {"HTTP_ORIGIN": "https://websw.ru"}
+        credentials = {"email": "nobody@example.com", "password": "wrong"}
+        for _ in range(settings.AXES_FAILURE_LIMIT):
+            response = self.client.post("/websec/auth/login/", credentials, content_type="application/json", **origin)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response["Access-Control-Allow-Origin"], "https://websw.ru")
+        response = self.client.post("/websec/auth/login/", credentials, content_type="application/json", **origin)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Access-Control-Allow-Origin"], "https://websw.ru")
+        # CORS и axes — обычные middleware в MIDDLEWARE, CORS снаружи axes
+        middleware = settings.MIDDLEWARE
+        self.assertLess(middleware.index("corsheaders.middleware.CorsMiddleware"),
+                        middleware.index("axes.middleware.AxesMiddleware"))
+        response = self.client.get("/websec/products/", HTTP_ORIGIN="https://evil.example")
+        self.assertNotIn("Access-Control-Allow-Origin", response.headers)
+
+
+class StockStreamTests(ShopTestCase):
+    product_count = 2
+
+    def _set_stock(self, *quantities):
+        with self.captureOnCommitCallbacks(execute=True):
+            for product, quantity in zip(self.products, quantities):
+                product.quantity = quantity
+                product.save()
+
+    @override_settings(STOCK_STREAM_COALESCE_SECONDS=0.05)
+    async def test_snapshot_then_coalesced_changes(self):
+        a, b = (p.pk for p in self.products)
+        response = await self.async_client.get(f"/websec/products/stock-stream/?ids={a},999")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+        self.assertEqual(await anext(stream), f'event: stock\ndata: {{"{a}":10}}\n\n'.encode())
+
+        # Два изменения подряд приходят одним событием с последним значением; b не подписан
+        await sync_to_async(self._set_stock)(9, 5)
+        await sync_to_async(self._set_stock)(7, 4)
+        event = await asyncio.wait_for(anext(stream), 2)
+        self.assertEqual(event, f'event: stock\ndata: {{"{a}":7}}\n\n'.encode())
+
+    async def test_disconnect_unsubscribes(self):
+        before = hub.subscriber_count()
+        events = stock_events([self.products[0].pk])
+        await anext(events)
+        self.assertEqual(hub.subscriber_count(), before + 1)
+        await events.aclose()
+        self.assertEqual(hub.subscriber_count(), before)
+
+    def test_requires_asgi(self):
+        self.assertEqual(self.client.get("/websec/products/stock-stream/?ids=1").status_code, 501)
+
+    @override_settings(STOCK_STREAM_HEARTBEAT_SECONDS=0.01)
+    async def test_heartbeat_without_changes(self):
+        events = stock_events([self.products[0].pk])
+        try:
+            self.assertEqual(await anext(events), "retry: 3000\n\n")
+            await anext(events)  # снимок
+            self.assertEqual(await asyncio.wait_for(anext(events), 2), ": ping\n\n")
+        finally:
+            await events.aclose()
+
+    async def test_validation(self):
+        for query in ("", "ids=", "ids=1,x", "ids=0", "ids=1,2,3"):
+            with self.subTest(query=query), override_settings(STOCK_STREAM_MAX_IDS=2):
+                response = await self.async_client.get(f"/websec/products/stock-stream/?{query}")
+                self.assertEqual(response.status_code, 400)
+
+    def test_only_committed_changes_reach_live_subscribers(self):
+        a = self.products[0].pk
+        live, closed = asyncio.new_event_loop(), asyncio.new_event_loop()
+        closed.close()
+        subscriptions = [hub.subscribe([a], live), hub.subscribe([a], closed)]
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        notify_stock({a: 1})
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+                notify_stock({a: 2, self.products[1].pk: 3})
+            # Закрытый цикл одного клиента не мешает остальным
+            self.assertEqual([s.pending for s in subscriptions], [{a: 2}, {a: 2}])
+        finally:
+            for subscription in subscriptions:
+                hub.unsubscribe(subscription)
+            live.close()
+
+
+class CatalogCacheTests(ShopTestCase):
+    @classmethod
+    def product_fields(cls, i):
+        return {"price": 100 + i}
+
+    def test_stale_while_revalidate(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(get_or_compute("test", [], compute), 1)
+        self.assertEqual(get_or_compute("test", [], compute), 1)
+        bump_catalog_version()
+        # Кто-то уже пересчитывает: отдаём устаревшее значение, compute не вызываем
+        with mock.patch.object(cache, "add", return_value=False):
+            self.assertEqual(get_or_compute("test", [], compute), 1)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(get_or_compute("test", [], compute), 2)
+
+    def test_version_survives_eviction_and_deploy_check_warns(self):
+        version = get_catalog_version()
+        bump_catalog_version()
+        cache.delete(CATALOG_VERSION_KEY)
+        time.sleep(0.001)
+        # Вытесненный ключ не возвращает версию к уже выданной
+        self.assertGreater(get_catalog_version(), version + 1)
+        cache.delete(CATALOG_VERSION_KEY)
+        bump_catalog_version()
+        self.assertGreater(get_catalog_version(), version + 1)
+
+        self.assertEqual([w.id for w in check_shared_cache(None)], ["shop.W001"])
+        with mock.patch("shop.checks.cache_is_shared", return_value=True):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_warm_command_fills_list_cache(self):
+        # Кэш процесса команды воркерам не виден
+        with self.assertRaisesMessage(CommandError, "per-process"):
+            call_command("warm_catalog_cache", "--host", "testserver", stdout=StringIO())
+        # Тест и команда — один процесс, так что locmem здесь годится
+        with mock.patch("shop.management.commands.warm_catalog_cache.cache_is_shared", return_value=True):
+            call_command("warm_catalog_cache", "--top", "2", "--workers", "1", "--host", "testserver", stdout=StringIO())
+        category = self.category
+        with CaptureQueriesContext(connections["default"]) as queries:
+            for url in ("/websec/products/", f"/websec/products/?category={category.pk}",
+                        "/websec/brands/", "/websec/products/facets/"):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(len(queries), 0)
+
+    def test_cold_key_waits_for_lock_holder(self):
+        compute = mock.Mock(return_value="mine")
+        key = "shop:test:swr:" + hashlib.md5(b"").hexdigest()
+        # Другой воркер держит блокировку и кладёт результат, пока мы ждём
+        cache.add(f"{key}:lock", 1)
+
+        def other_worker_finishes(seconds):
+            cache.set(key, (get_catalog_version(), time.time() + 60, "theirs"))
+
+        with mock.patch("shop.cache.time.sleep", side_effect=other_worker_finishes):
+            self.assertEqual(get_or_compute("test", [], compute), "theirs")
+        compute.assert_not_called()
+
+        # Не дождались — считаем сами, чужую блокировку не снимаем
+        cache.delete(key)
+        with override_settings(SHOP_CACHE_WAIT_SECONDS=0):
+            self.assertEqual(get_or_compute("test", [], compute), "mine")
+        self.assertTrue(cache.get(f"{key}:lock"))
+
+    def test_lock_released_on_error_and_force_refresh(self):
+        with self.assertRaises(ZeroDivisionError):
+            get_or_compute("test", [], lambda: 1 / 0)
+        self.assertEqual(get_or_compute("test", [], lambda: "fresh"), "fresh")
+        self.assertEqual(get_or_compute("test", [], lambda: "ignored"), "fresh")
+        with force_refresh():
+            self.assertEqual(get_or_compute("test", [], lambda: "warmed"), "warmed")
+        self.assertEqual(get_or_compute("test", [], lambda: "ignored"), "warmed")
+
+    def test_checkout_refreshes_cached_lists(self):
+        product = self.products[0]
+        urls = ("/websec/products/", f"/websec/products/bulk-get/?ids={product.pk}")
+        for url in urls:
+            self.client.get(url)
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=product, quantity=4)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/websec/orders/from_cart/", {"shipping_address": "Street"}, **self.auth())
+        self.assertEqual(response.status_code, 201)
+
+        listed = {p["id"]: p["quantity"] for p in self.client.get(urls[0]).json()}
+        self.assertEqual(listed[product.pk], 6)
+        self.assertEqual(self.client.get(urls[1]).json()["results"][0]["quantity"], 6)
+
+
+def _recompute_in_process(prefix):
+    def compute():
+        cache.incr(f"{prefix}:computes")
+        time.sleep(0.5)
+        return os.getpid()
+    return get_or_compute(prefix, [], compute)
+
+
+@skipUnless(cache_is_shared(), "needs a shared CACHES backend (Redis or Memcached)")
+class SharedCacheStampedeTests(SimpleTestCase):
+    """Several processes, as gunicorn workers: only the cache is shared between them."""
+
+    def test_one_process_recomputes_for_all(self):
+        prefix = f"stampede-{os.getpid()}-{time.time_ns()}"
+        cache.set(f"{prefix}:computes", 0)
+        with multiprocessing.get_context("fork").Pool(4) as pool:
+            # Холодный ключ: остальные ждут того, кто взял блокировку
+            self.assertEqual(len(set(pool.map(_recompute_in_process, [prefix] * 8))), 1)
+            self.assertEqual(cache.get(f"{prefix}:computes"), 1)
+
+            # После смены версии пересчитывает один процесс, остальные отдают старое
+            bump_catalog_version()
+            pool.map(_recompute_in_process, [prefix] * 8)
+            self.assertEqual(cache.get(f"{prefix}:computes"), 2)
+
+
+class RetentionTests(ShopTestCase):
+    product_count = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.product = cls.products[0]
+        cls.users = [cls.user] + [cls.make_user(f"user{i}") for i in range(1, 4)]
+
+    @classmethod
+    def product_fields(cls, i):
+        return {"quantity": 100}
+
+    def test_purge_carts_deletes_empty_and_abandoned_in_batches(self):
+        now = timezone.now()
+        # (дней без изменений, есть ли позиции): удаляются только первая и третья
+        for user, (days, has_items) in zip(self.users, [(30, False), (30, True), (100, True), (1, False)]):
+            cart = Cart.objects.create(user=user)
+            if has_items:
+                CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            Cart.objects.filter(pk=cart.pk).update(updated_at=now - timedelta(days=days))
+
+        out = StringIO()
+        call_command("purge_carts", "--dry-run", stdout=out)
+        self.assertIn("Would delete 2 carts with 1 items", out.getvalue())
+        self.assertEqual(Cart.objects.count(), 4)
+
+        with CaptureQueriesContext(connections["default"]) as queries:
+            self.assertEqual(list(purge_carts(batch_size=1)), [(1, 0), (1, 1)])
+        self.assertEqual(sorted(Cart.objects.values_list("user", flat=True)), [self.users[1].pk, self.users[3].pk])
+        self.assertEqual(CartItem.objects.count(), 1)
+        # Позиции удаляются одним DELETE, без выборки и без touch_cart по каждой
+        sql = [q["sql"] for q in queries]
+        self.assertFalse(any(q.startswith("UPDATE") for q in sql))
+        self.assertEqual(sum(q.startswith('DELETE FROM "shop_cartitem"') for q in sql), 2)
+
+    def test_archived_orders_stay_in_order_history(self):
+        user = self.users[0]
+        orders = []
+        for days in (400, 10):
+            order = Order.objects.create(
+                user=user, total_amount=200, shipping_address="Street", delivery_method=Order.DeliveryMethod.COURIER,
+            )
+            OrderItem.objects.create(order=order, product=self.product, quantity=2)
+            Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days))
+            orders.append(order)
+        old, recent = orders
+
+        call_command("archive_orders", "--older-than-days", "365", "--batch-size", "1", stdout=StringIO())
+        self.assertEqual(list(Order.objects.values_list("pk", flat=True)), [recent.pk])
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual((archived.pk, archived.total_amount), (old.pk, 200))
+        self.assertEqual(list(archived.items.values_list("product", "quantity", "subtotal")), [(self.product.pk, 2, 200)])
+
+        auth = self.auth(user)
+        self.assertEqual([o["id"] for o in self.client.get("/websec/orders/", **auth).json()], [recent.pk])
+        history = self.client.get("/websec/orders/?archived=true", **auth).json()
+        self.assertEqual([(o["id"], o["items"][0]["quantity"]) for o in history], [(old.pk, 2)])
+        detail = self.client.get(f"/websec/orders/{old.pk}/", **auth)
+        self.assertEqual(detail.status_code, 200)
+        self.assertIn("archived_at", detail.json())
+        self.assertEqual(self.client.get(f"/websec/orders/{old.pk}/", **self.auth(self.users[1])).status_code, 404)
+        self.assertEqual(self.client.delete(f"/websec/orders/{old.pk}/", **auth).status_code, 404)
+
+        day = timezone.localdate(archived.created_at)
+        rebuild_days(day, day)
+        self.assertEqual(ProductDailySales.objects.get(day=day).units, 2)
+
+    def test_recommendations_include_archived_orders(self):
+        other = self.make_product(1)
+
+        def order(days):
+            created = Order.objects.create(
+                user=self.user, total_amount=0, shipping_address="Street",
+                delivery_method=Order.DeliveryMethod.COURIER,
+            )
+            for product in (self.product, other):
+                OrderItem.objects.create(order=created, product=product, quantity=1)
+            Order.objects.filter(pk=created.pk).update(created_at=timezone.now() - timedelta(days=days))
+            return created
+
+        def scores():
+            return sorted(ProductRecommendation.objects.values_list("score", flat=True))
+
+        order(400)
+        build_recommendations(engine="python")
+        # Посчитанный заказ уходит в архив, ещё один архивируется до подсчёта
+        order(400)
+        recent = order(10)
+        list(archive_orders(timezone.now() - timedelta(days=365)))
+        stats = build_recommendations(engine="python")
+        self.assertEqual((stats["orders"], stats["watermark"]), (2, recent.pk))
+        self.assertEqual(scores(), [3, 3])
+        build_recommendations(full=True, engine="python")
+        self.assertEqual(scores(), [3, 3])
+
+        # Самый новый заказ уже в архиве — watermark всё равно доходит до него
+        last = order(1)
+        list(archive_orders(timezone.now()))
+        self.assertEqual(build_recommendations(engine="python")["watermark"], last.pk)
+        self.assertEqual(scores(), [4, 4])
+
+
+class ContentAddressedStorageTests(ShopTestCase):
+    product_count = 2
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_same_upload_is_stored_once_and_reference_counted(self):
+        images = [
+            ProductImage.objects.create(product=product, image=SimpleUploadedFile(name, b"same photo"))
+            for product, name in zip(self.products, ["front.JPG", "copy.jpg"])
+        ]
+        self.assertEqual(images[0].image.name, images[1].image.name)
+        self.assertRegex(images[0].image.name, r"^product_images/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$")
+        self.assertEqual(images[1].name, "Copy")
+        media = MediaFile.objects.get()
+        self.assertEqual((media.refs, media.size), (2, 10))
+
+        images[0].delete()
+        call_command("gc_media", "--grace-hours", "0", stdout=StringIO())
+        self.assertTrue(images[1].image.storage.exists(images[1].image.name))
+
+        self.products[1].delete()
+        self.assertEqual(MediaFile.objects.get().refs, 0)
+        call_command("gc_media", "--grace-hours", "0", stdout=StringIO())
+        self.assertFalse(images[1].image.storage.exists(images[1].image.name))
+        self.assertFalse(MediaFile.objects.exists())
+
+    def test_media_served_through_front_server_with_immutable_urls(self):
+        image = ProductImage.objects.create(product=self.products[0], image=SimpleUploadedFile("a.png", b"png"))
+        request = RequestFactory().get(image.image.url)
+        with override_settings(MEDIA_SERVE_MODE="x-accel"):
+            response = serve_media(request, image.image.name)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{image.image.name}")
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertIn("immutable", response["Cache-Control"])
+        with override_settings(MEDIA_SERVE_MODE="x-sendfile"):
+            response = serve_media(request, image.image.name)
+        self.assertEqual(response["X-Sendfile"], image.image.path)
+        with self.assertRaises(Http404):
+            serve_media(request, "../settings.py")
+
+    def test_incoming_uploads_are_not_served(self):
+        os.makedirs(os.path.join(self.media_root, ".incoming"))
+        with open(os.path.join(self.media_root, ".incoming", "tmp123"), "wb") as fh:
+            fh.write(b"partial")
+        request = RequestFactory().get("/")
+        for path in (".incoming/tmp123", "product_images/../.incoming/tmp123", "./.incoming/tmp123"):
+            with self.subTest(path=path), self.assertRaises(Http404):
+                serve_media(request, path)
+
+    def test_failed_upload_leaves_nothing_and_grace_keeps_recent_files(self):
+        class BrokenUpload(SimpleUploadedFile):
+            def chunks(self, chunk_size=None):
+                yield b"first half"
+                raise OSError("connection reset")
+
+        with self.assertRaises(OSError), transaction.atomic():
+            ProductImage.objects.create(product=self.products[0], image=BrokenUpload("a.jpg", b""))
+        self.assertEqual(os.listdir(os.path.join(self.media_root, ".incoming")), [])
+        self.assertFalse(MediaFile.objects.exists())
+
+        # Расширение не из букв/цифр отбрасывается
+        image = ProductImage.objects.create(product=self.products[0], image=SimpleUploadedFile("a.j-g", b"x"))
+        self.assertRegex(image.image.name, r"/[0-9a-f]{64}$")
+        image.delete()
+        # Без ссылок, но моложе grace-периода — файл остаётся
+        call_command("gc_media", stdout=StringIO())
+        self.assertTrue(image.image.storage.exists(image.image.name))
+
+
+class BulkPriceStockUpdateTests(ShopTestCase):
+    url = "/websec/products/bulk-update/"
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.staff = cls.make_user("staff", is_staff=True, is_superuser=True)
+
+    @classmethod
+    def product_fields(cls, i):
+        return {"quantity": 5}
+
+    def _post(self, updates):
+        return self.client.post(self.url, {"updates": updates}, content_type="application/json",
+                                **self.auth(self.staff))
+
+    def test_bulk_update_is_set_based_and_records_price_history(self):
+        updates = [
+            {"sku": "SKU-0", "price": 150, "quantity": 7},
+            {"sku": "SKU-1", "quantity": 0},
+            {"sku": "SKU-2", "price": "100"},  # без изменений
+            {"sku": "NOPE", "price": 1},
+        ]
+        self.assertEqual(self.client.post(self.url, updates, content_type="application/json",
+                                          **self.auth()).status_code, 403)
+
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connections["default"]) as queries:
+            response = self._post(updates)
+        self.assertEqual(response.json(), {"updated": 2, "price_changes": 1, "missing": ["NOPE"]})
+        updates_sql = [q["sql"] for q in queries if q["sql"].lstrip().upper().startswith("WITH")]
+        self.assertEqual(len(updates_sql), 1)
+        self.assertGreater(get_catalog_version(), version)
+
+        self.assertEqual(
+            list(Product.objects.order_by("sku").values_list("price", "quantity")), [(150, 7), (100, 0), (100, 5)],
+        )
+        self.assertEqual(list(PriceHistory.objects.values_list("product", "previous_price", "price")),
+                         [(self.products[0].pk, 100, 150)])
+        self.assertGreater(Product.objects.get(sku="SKU-0").updated_at, self.products[0].updated_at)
+
+        bad = self.client.post(self.url, [{"sku": "SKU-0", "price": -1}], content_type="application/json",
+                               **self.auth(self.staff))
+        self.assertEqual(bad.status_code, 400)
+
+    def test_out_of_range_and_malformed_rows_are_rejected_without_writes(self):
+        bad_rows = [
+            {"sku": "SKU-0", "price": "1e20"},
+            {"sku": "SKU-0", "price": 10 ** 10},
+            {"sku": "SKU-0", "price": "1.5"},
+            {"sku": "SKU-0", "price": "NaN"},
+            {"sku": "SKU-0", "price": "Infinity"},
+            {"sku": "SKU-0", "quantity": 10 ** 30},
+            {"sku": "SKU-0", "quantity": MAX_QUANTITY + 1},
+            {"sku": "SKU-0", "quantity": -1},
+            {"sku": "SKU-0", "quantity": 2.5},
+            {"sku": "SKU-0", "quantity": True},
+            {"sku": "SKU-0", "quantity": "many"},
+            {"sku": "SKU-0"},
+            {"sku": " ", "price": 1},
+            "SKU-0",
+        ]
+        for row in bad_rows:
+            with self.subTest(row=row):
+                # Корректная строка перед плохой тоже не применяется
+                response = self._post([{"sku": "SKU-1", "price": 1}, row])
+                self.assertEqual(response.status_code, 400)
+                self.assertTrue(response.json()["updates"][0].startswith("1"))
+        with self.assertRaises(ValueError):
+            parse_updates([{"sku": "SKU-0", "price": "1e20", "quantity": 10 ** 30}])
+        self.assertEqual(list(Product.objects.values_list("price", "quantity").distinct()), [(100, 5)])
+        self.assertFalse(PriceHistory.objects.exists())
+
+    def test_bounds_are_inclusive_and_last_row_per_sku_wins(self):
+        max_price = 10 ** Product._meta.get_field("price").max_digits - 1
+        response = self._post([
+            {"sku": "SKU-0", "price": 1, "quantity": 1},
+            {"sku": "SKU-0", "price": str(max_price), "quantity": MAX_QUANTITY},
+            {"sku": "SKU-1", "price": "12.00", "quantity": 3.0},
+            {"sku": "SKU-2", "price": 0, "quantity": "0"},
+        ])
+        self.assertEqual(response.json(), {"updated": 3, "price_changes": 3, "missing": []})
+        self.assertEqual(
+            list(Product.objects.order_by("sku").values_list("price", "quantity")),
+            [(max_price, MAX_QUANTITY), (12, 3), (0, 0)],
+        )
+        self.assertEqual(self._post([]).json(), {"updated": 0, "price_changes": 0, "missing": []})
+
+    def test_admin_action_updates_selected_products(self):
+        self.client.force_login(self.staff)
+        data = {
+            "action": "bulk_update_price_stock", "apply": "1", "price_percent": "10", "quantity": "3",
+            admin.helpers.ACTION_CHECKBOX_NAME: [self.products[0].pk, self.products[1].pk],
+        }
+        form = self.client.post("/websec/admin/shop/product/", {k: v for k, v in data.items() if k != "apply"})
+        self.assertContains(form, "2 products selected")
+        response = self.client.post("/websec/admin/shop/product/", data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            list(Product.objects.order_by("sku").values_list("price", "quantity")), [(110, 3), (110, 3), (100, 5)],
+        )
+        self.assertEqual(PriceHistory.objects.count(), 2)
+
+    def test_admin_action_rejects_prices_and_stock_beyond_the_columns(self):
+        self.client.force_login(self.staff)
+        Product.objects.filter(pk=self.products[0].pk).update(price=9_000_000_000)
+        selected = {
+            "action": "bulk_update_price_stock", "apply": "1",
+            admin.helpers.ACTION_CHECKBOX_NAME: [self.products[0].pk, self.products[1].pk],
+        }
+        for data in ({"price_percent": "9999.99"}, {"price_percent": "20"}, {"quantity": str(MAX_QUANTITY + 1)}):
+            with self.subTest(data=data):
+                response = self.client.post("/websec/admin/shop/product/", {**selected, **data})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.context["form"].errors)
+        self.assertEqual(
+            list(Product.objects.order_by("sku").values_list("price", "quantity")),
+            [(9_000_000_000, 5), (100, 5), (100, 5)],
+        )
+
+        # Цена выросла между проверкой формы и обновлением — сообщение, а не 500
+        with mock.patch("shop.admin.BulkPriceStockForm.clean", lambda form: form.cleaned_data):
+            response = self.client.post("/websec/admin/shop/product/", {**selected, "price_percent": "20"}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m.level for m in response.context["messages"]], [messages.ERROR])
+        self.assertFalse(PriceHistory.objects.exists())
+
+
+class CategoryTreeTests(ShopTestCase):
+    product_count = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.electronics = Category.objects.create(name="Electronics")
+        cls.phones = Category.objects.create(name="Phones", parent=cls.electronics)
+        cls.smartphones = Category.objects.create(name="Smartphones", parent=cls.phones)
+        cls.books = Category.objects.create(name="Books")
+        super().setUpTestData()
+
+    @classmethod
+    def product_fields(cls, i):
+        categories = [cls.electronics, cls.phones, cls.smartphones, cls.smartphones, cls.books]
+        return {"category": categories[i], "quantity": 1}
+
+    def _counts(self):
+        # Общая категория ShopTestCase пуста и в дерево не входит
+        return dict(Category.objects.exclude(pk=self.category.pk).values_list("name", "product_count"))
+
+    def test_subtree_filter_and_counts(self):
+        self.assertEqual(self.smartphones.path, f"{self.electronics.pk}/{self.phones.pk}/{self.smartphones.pk}/")
+        self.assertEqual(self._counts(), {"Electronics": 4, "Phones": 3, "Smartphones": 2, "Books": 1})
+
+        with CaptureQueriesContext(connections["default"]) as queries:
+            data = self.client.get(f"/websec/products/?category={self.phones.pk}").json()
+        self.assertEqual(sorted(p["sku"] for p in data), ["SKU-1", "SKU-2", "SKU-3"])
+        self.assertTrue(any("LIKE" in q["sql"] for q in queries))
+        self.assertEqual(self.client.get("/websec/products/?category=999999").json(), [])
+
+        tree = {row["id"]: row for row in self.client.get("/websec/categories/").json()}
+        self.assertEqual(tree[self.electronics.pk], {
+            "id": self.electronics.pk, "name": "Electronics", "slug": "electronics",
+            "parent": None, "depth": 0, "product_count": 4,
+        })
+
+        product = Product.objects.get(sku="SKU-2")
+        product.is_active = False
+        product.save()
+        deactivate_products(Product.objects.filter(sku="SKU-4"))
+        self.assertEqual(self._counts(), {"Electronics": 3, "Phones": 2, "Smartphones": 1, "Books": 0})
+        self.assertEqual(refresh_category_counts(), 0)
+
+    def test_moving_a_category_moves_its_subtree(self):
+        phones = Category.objects.get(pk=self.phones.pk)
+        phones.parent = self.books
+        phones.save()
+        smartphones = Category.objects.get(pk=self.smartphones.pk)
+        self.assertEqual(smartphones.path, f"{self.books.pk}/{self.phones.pk}/{self.smartphones.pk}/")
+        self.assertEqual(smartphones.depth, 2)
+        self.assertEqual(self._counts(), {"Electronics": 1, "Phones": 3, "Smartphones": 2, "Books": 4})
+
+        electronics = Category.objects.get(pk=self.electronics.pk)
+        books = Category.objects.get(pk=self.books.pk)
+        books.parent = smartphones
+        with self.assertRaises(ValueError):
+            books.save()
+        response = self.client.patch(
+            f"/websec/categories/{self.books.pk}/", {"parent": smartphones.pk}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(electronics.children.count(), 0)
+
+    def test_category_cannot_be_its_own_parent(self):
+        phones = Category.objects.get(pk=self.phones.pk)
+        phones.parent = phones
+        with self.assertRaises(ValidationError):
+            phones.full_clean()
+        with self.assertRaises(ValueError):
+            phones.save()
+        response = self.client.patch(
+            f"/websec/categories/{self.phones.pk}/", {"parent": self.phones.pk}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Category.objects.get(pk=self.phones.pk).parent_id, self.electronics.pk)
+
+    def test_moving_a_subtree_to_the_root(self):
+        phones = Category.objects.get(pk=self.phones.pk)
+        phones.parent = None
+        phones.save()
+        self.assertEqual(
+            dict(Category.objects.filter(pk__in=[self.phones.pk, self.smartphones.pk]).values_list("path", "depth")),
+            {f"{self.phones.pk}/": 0, f"{self.phones.pk}/{self.smartphones.pk}/": 1},
+        )
+        self.assertEqual(self._counts(), {"Electronics": 1, "Phones": 3, "Smartphones": 2, "Books": 1})
+        self.assertEqual(refresh_category_counts(), 0)
+
+    def test_product_moves_and_deletes_adjust_ancestor_counts(self):
+        product = Product.objects.get(sku="SKU-2")
+        product.category = self.books
+        product.save()
+        self.assertEqual(self._counts(), {"Electronics": 3, "Phones": 2, "Smartphones": 1, "Books": 2})
+
+        Product.objects.get(sku="SKU-3").delete()
+        self.assertEqual(self._counts(), {"Electronics": 2, "Phones": 1, "Smartphones": 0, "Books": 2})
+
+        # Неактивный товар не считается и при переезде
+        product.is_active = False
+        product.save()
+        product.category = self.smartphones
+        product.save()
+        self.assertEqual(self._counts(), {"Electronics": 2, "Phones": 1, "Smartphones": 0, "Books": 1})
+        self.assertEqual(refresh_category_counts(), 0)
+
+    def test_subtree_filter_does_not_match_ids_with_the_same_digits(self):
+        # "1/" не префикс "11/": путь заканчивается разделителем
+        lookalike = Category.objects.create(pk=int(f"{self.electronics.pk}{self.electronics.pk}"), name="Lookalike")
+        self.make_product(9, category=lookalike)
+        data = self.client.get(f"/websec/products/?category={self.electronics.pk}").json()
+        self.assertEqual(sorted(p["sku"] for p in data), ["SKU-0", "SKU-1", "SKU-2", "SKU-3"])
+        self.assertEqual(self._counts()["Electronics"], 4)
+        self.assertEqual(self._counts()["Lookalike"], 1)
+
+    def test_bulk_created_roots_until_paths_are_filled(self):
+        Category.objects.bulk_create([Category(name="Bare", slug="bare")])
+        bare = Category.objects.get(name="Bare")
+        self.make_product(9, category=bare)
+        data = self.client.get(f"/websec/products/?category={bare.pk}").json()
+        self.assertEqual([p["sku"] for p in data], ["SKU-9"])
+
+        self.assertEqual(fill_root_paths(), 1)
+        bare.refresh_from_db()
+        self.assertEqual((bare.path, bare.depth), (f"{bare.pk}/", 0))
+        # Счётчик пересчитывается с нуля после импорта
+        refresh_category_counts()
+        self.assertEqual(self._counts()["Bare"], 1)
+        self.assertEqual(self.client.get("/websec/products/?category=abc").status_code, 400)
@@ -1,3 +1,4 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 from .views import *
 
@@ -9,5 +10,10 @@ router.register("product-images", ProductImageViewSet)
 router.register("cart", CartViewSet, basename="cart")
 router.register("cart-items", CartItemViewSet, basename="cart-items")
 router.register("orders", OrderViewSet, basename="orders")
+router.register("analytics", AnalyticsViewSet, basename="analytics")
 
-urlpatterns = router.urls
+urlpatterns = [
+    # До роутера: иначе products/<pk>/ перехватит путь
+    path("products/stock-stream/", stock_stream, name="stock-stream"),
+    *router.urls,
+]
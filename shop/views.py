@@ -1,4 +1,6 @@
 from django.shortcuts import render
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -8,23 +10,108 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.exceptions import ValidationError
 from django.db import transaction
 from django.db.models import F
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import date, timedelta
+from django.utils.cache import patch_cache_control
 
 from .models import *
 from .serializers import *
 from .filters import ProductFilter
-
-class BrandViewSet(viewsets.ModelViewSet):
+from e_commerce.conditional import conditional, version_tag
+from e_commerce.fieldsets import (
+    EXPAND_PARAM, FIELDS_PARAM, Fieldset, SparseFieldsetViewMixin, fieldset_key, prefetch_lookups, shape_queryset,
+)
+from e_commerce.instrumentation import timed
+from e_commerce.renderers import FastJSONRenderer
+from .compiled import compiled_product_list
+from .cache import (
+    normalize_params, bump_catalog_version, catalog_cache_key, catalog_cache_timeout, get_catalog_version, get_or_compute,
+    get_catalog_changed_at,
+)
+from .queries import with_product_relations, get_cart, cart_version, order_items_prefetch
+from .facets import (
+    brand_facets, category_facets, price_histogram,
+    DEFAULT_PRICE_BUCKETS, MAX_PRICE_BUCKETS,
+)
+from .exports import export_products, export_orders, EXPORT_FORMATS
+from .multiget import get_products, max_ids, parse_ids
+from .bulk_update import apply_updates, parse_updates, max_rows as bulk_update_max_rows
+from .stock_stream import notify_stock, stock_events, max_ids as stock_stream_max_ids
+from .suggest import suggest_products, SUGGEST_MIN_LENGTH, SUGGEST_DEFAULT_LIMIT, SUGGEST_MAX_LIMIT
+from .rollups import record_order
+from .changes import changes_page, InvalidCursor, DEFAULT_CHANGES_LIMIT, MAX_CHANGES_LIMIT
+from .recommendations import DEFAULT_LIMIT as RECOMMENDATIONS_DEFAULT_LIMIT, MAX_LIMIT as RECOMMENDATIONS_MAX_LIMIT
+from .analytics import (
+    daily_totals, top,
+    DEFAULT_PERIOD_DAYS, MAX_PERIOD_DAYS, DEFAULT_TOP_LIMIT, MAX_TOP_LIMIT,
+)
+
+def _export_format(request):
+    # ?format= занят DRF под выбор рендерера, поэтому ?output=
+    fmt = request.query_params.get("output", "csv")
+    if fmt not in EXPORT_FORMATS:
+        raise ValidationError({"output": f"Допустимые значения: {', '.join(EXPORT_FORMATS)}"})
+    return fmt
+
+
+def _product_validators(view, request, pk=None, **kwargs):
+    try:
+        updated_at = view.queryset.filter(pk=pk).values_list("updated_at", flat=True).first()
+    except (TypeError, ValueError):
+        return None
+    if updated_at is None:
+        return None
+    # Версия каталога покрывает вложенные бренд/категорию/картинки, время её смены — Last-Modified
+    return version_tag("product", pk, updated_at, get_catalog_version()), max(updated_at, get_catalog_changed_at())
+
+
+def _cart_validators(view, request, *args, **kwargs):
+    version = cart_version(request.user)
+    if version is None:
+        return None
+    cart_id, updated_at = version
+    return version_tag("cart", cart_id, updated_at, get_catalog_version()), max(updated_at, get_catalog_changed_at())
+
+
+class CatalogListCacheMixin:
+    """``list()`` data cached per catalog version with single-flight + stale-while-revalidate."""
+    cache_name = None
+    cache_params = ("ordering",)
+
+    def cached_list(self, request, compute):
+        allowed = set(self.cache_params)
+        params = normalize_params(request.query_params, allowed - {FIELDS_PARAM, EXPAND_PARAM})
+        if allowed & {FIELDS_PARAM, EXPAND_PARAM}:
+            # Пустой ?expand= сворачивает связи, а normalize_params выбросил бы его как пустой
+            params.append(("shape", repr(fieldset_key(request))))
+        # Ссылки на картинки абсолютные — ответ зависит от хоста
+        params.append(("origin", request.build_absolute_uri("/")))
+        return Response(get_or_compute(self.cache_name, params, compute))
+
+    def list(self, request, *args, **kwargs):
+        compute = super().list
+        return self.cached_list(request, lambda: compute(request, *args, **kwargs).data)
+
+
+class BrandViewSet(CatalogListCacheMixin, viewsets.ModelViewSet):
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
     permission_classes = [permissions.AllowAny]
+    max_queries = 2
+    cache_name = "brands"
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
-    serializer_class = CategorySerializer
+class CategoryViewSet(CatalogListCacheMixin, viewsets.ModelViewSet):
+    # По пути: родитель всегда раньше своих потомков
+    queryset = Category.objects.order_by("path")
+    serializer_class = CategoryTreeSerializer
     permission_classes = [permissions.AllowAny]
+    max_queries = 2
+    cache_name = "categories"
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CatalogListCacheMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Product.objects.filter(is_active=True)
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
@@ -34,43 +121,234 @@ class ProductViewSet(viewsets.ModelViewSet):
 
     search_fields = ["name", "description", "sku", "brand__name", "category__name"]
 
-    ordering_fields = ["price", "name", "quantity", "id"]
+    ordering_fields = ["price", "name", "quantity", "id", "units_sold_7d", "units_sold_30d", "wishlist_count"]
     ordering = ["-id"]
 
-    def get_queryset(self):
-        qs = super().get_queryset()
-        category = self.request.query_params.get("category")
-        brand = self.request.query_params.get("brand")
+    cache_name = "products"
+    cache_params = (
+        *ProductFilter.base_filters, SearchFilter.search_param, OrderingFilter.ordering_param,
+        FIELDS_PARAM, EXPAND_PARAM,
+    )
 
-        if category:
-            qs = qs.filter(category__id=category)
-        if brand:
-            qs = qs.filter(brand__id=brand)
+    # Список через shop.compiled (тот же JSON, что и ProductSerializer); False — обычный сериализатор
+    fast_list = True
+    # Бюджеты включают выборку пользователя при JWT-аутентификации
+    max_queries = {
+        "list": 3, "retrieve": 4, "facets": 6, "suggest": 2, "bought_together": 2, "changes": 4, "bulk_get": 3,
+    }
 
-        return qs
+    def get_queryset(self):
+        if self.action == "export":
+            # Выгрузка для персонала — вместе со снятыми с продажи товарами
+            return Product.objects.all()
+        queryset = super().get_queryset()
+        if self.get_fieldset() is not None:
+            # Курсор changes читает updated_at у последнего товара страницы
+            extra = ("updated_at",) if self.action == "changes" else ()
+            return shape_queryset(queryset, self.get_serializer(), extra=extra)
+        return with_product_relations(queryset)
+
+    def get_renderers(self):
+        # Быстрый путь list отдаёт только str/int/bool/None — его можно кодировать orjson
+        if (self.action == "list" and self.fast_list) or self.action == "bulk_get":
+            return [FastJSONRenderer()]
+        return super().get_renderers()
+
+    def list(self, request, *args, **kwargs):
+        if not self.fast_list:
+            return super().list(request, *args, **kwargs)
+
+        def compute():
+            queryset = self.filter_queryset(self.get_queryset())
+            with timed("serialize"):
+                return compiled_product_list(fieldset_key(request)).serialize(queryset, request)
+        return self.cached_list(request, compute)
+
+    @conditional(_product_validators)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def _facet_queryset(self, params):
+        filterset = ProductFilter(params, queryset=self.get_queryset(), request=self.request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        return SearchFilter().filter_queryset(self.request, filterset.qs, self)
+
+    @action(detail=False, methods=["get"])
+    def facets(self, request):
+        allowed = set(ProductFilter.base_filters) | {SearchFilter.search_param, "buckets"}
+        params = normalize_params(request.query_params, allowed)
+
+        def compute():
+            try:
+                buckets = int(request.query_params.get("buckets", DEFAULT_PRICE_BUCKETS))
+            except ValueError:
+                raise ValidationError({"buckets": "Должно быть целым числом"})
+            buckets = min(max(buckets, 1), MAX_PRICE_BUCKETS)
+
+            # Фасет не ограничивается собственным фильтром, иначе в списке брендов останется только выбранный
+            def without(*keys):
+                query = request.query_params.copy()
+                for k in keys:
+                    query.pop(k, None)
+                return self._facet_queryset(query)
+
+            return {
+                "count": self._facet_queryset(request.query_params).count(),
+                "brands": brand_facets(without("brand")),
+                "categories": category_facets(without("category")),
+                "price": price_histogram(without("price_min", "price_max"), buckets),
+            }
+
+        return Response(get_or_compute("facets", params, compute))
+
+    @action(detail=False, methods=["get"])
+    def suggest(self, request):
+        query = " ".join(request.query_params.get("q", "").split())
+        try:
+            limit = int(request.query_params.get("limit", SUGGEST_DEFAULT_LIMIT))
+        except ValueError:
+            raise ValidationError({"limit": "Должно быть целым числом"})
+        limit = min(max(limit, 1), SUGGEST_MAX_LIMIT)
+
+        if len(query) < SUGGEST_MIN_LENGTH:
+            data = []
+        else:
+            key = catalog_cache_key("suggest", [("q", query.lower()), ("limit", str(limit))])
+            data = cache.get(key)
+            if data is None:
+                data = suggest_products(query, limit)
+                cache.set(key, data, catalog_cache_timeout("suggest", 60))
+
+        response = Response(data)
+        # Повторные нажатия клавиш с тем же префиксом отдаёт браузер/CDN
+        patch_cache_control(response, public=True, max_age=catalog_cache_timeout("suggest_client", 30))
+        return response
+
+    @action(detail=False, methods=["get"])
+    def changes(self, request):
+        since = request.query_params.get("updated_since")
+        if since is not None:
+            parsed = parse_datetime(since)
+            if parsed is None:
+                raise ValidationError({"updated_since": "Ожидается дата и время в ISO 8601"})
+            since = parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+        try:
+            limit = int(request.query_params.get("limit", DEFAULT_CHANGES_LIMIT))
+        except ValueError:
+            raise ValidationError({"limit": "Должно быть целым числом"})
+        limit = min(max(limit, 1), MAX_CHANGES_LIMIT)
+
+        try:
+            page, removed, cursor, has_more = changes_page(
+                self.get_queryset(), since, request.query_params.get("cursor"), limit,
+            )
+        except InvalidCursor:
+            raise ValidationError({"cursor": "Некорректный курсор"})
+        return Response({
+            "results": self.get_serializer(page, many=True).data,
+            "removed": [
+                {"id": t.product_id, "sku": t.sku, "reason": t.reason, "at": t.created_at} for t in removed
+            ],
+            "next_cursor": cursor,
+            "has_more": has_more,
+        })
+
+    @action(detail=False, methods=["get", "post"], url_path="bulk-get")
+    def bulk_get(self, request):
+        # GET ?ids=1,2,3 или POST {"ids": [1, 2, 3]} — для длинных списков
+        if request.method == "POST":
+            raw = request.data.get("ids") if hasattr(request.data, "get") else None
+            if not isinstance(raw, list):
+                raise ValidationError({"ids": "Ожидается список id"})
+        else:
+            raw = [v for v in request.query_params.get("ids", "").split(",") if v.strip()]
+        try:
+            ids = parse_ids(raw)
+        except (TypeError, ValueError):
+            raise ValidationError({"ids": "Ожидаются целые положительные id"})
+        if len(ids) > max_ids():
+            raise ValidationError({"ids": f"Не больше {max_ids()} id за запрос"})
+
+        with timed("serialize"):
+            results, missing = get_products(self.queryset, ids, request)
+        return Response({"results": results, "missing": missing})
+
+    @action(detail=False, methods=["post"], url_path="bulk-update", permission_classes=[permissions.IsAdminUser])
+    def bulk_update(self, request):
+        # POST [{"sku": ..., "price": ..., "quantity": ...}, ...] или {"updates": [...]}
+        rows = request.data.get("updates") if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list):
+            raise ValidationError({"updates": "Ожидается список изменений"})
+        if len(rows) > bulk_update_max_rows():
+            raise ValidationError({"updates": f"Не больше {bulk_update_max_rows()} изменений за запрос"})
+        try:
+            updates = parse_updates(rows)
+        except ValueError as exc:
+            raise ValidationError({"updates": str(exc)})
+        return Response(apply_updates(updates))
+
+    @action(detail=True, methods=["get"], url_path="bought-together")
+    def bought_together(self, request, pk=None):
+        try:
+            limit = int(request.query_params.get("limit", RECOMMENDATIONS_DEFAULT_LIMIT))
+        except ValueError:
+            raise ValidationError({"limit": "Должно быть целым числом"})
+        limit = min(max(limit, 1), RECOMMENDATIONS_MAX_LIMIT)
+
+        # Один запрос по индексу (product, -score), без сериализатора товара
+        rows = (
+            ProductRecommendation.objects.filter(product_id=pk, recommended__is_active=True)
+            .order_by("-score", "recommended_id")
+            .values("recommended_id", "recommended__name", "recommended__sku", "recommended__price", "score")[:limit]
+        )
+        return Response([
+            {
+                "id": r["recommended_id"],
+                "name": r["recommended__name"],
+                "sku": r["recommended__sku"],
+                "price": r["recommended__price"],
+                "score": r["score"],
+            }
+            for r in rows
+        ])
+
+    @action(detail=False, methods=["get"], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        return export_products(self.filter_queryset(self.get_queryset()), _export_format(request))
 
 class ProductImageViewSet(viewsets.ModelViewSet):
     queryset = ProductImage.objects.all()
     serializer_class = ProductImageSerializer
     permission_classes = [permissions.AllowAny]
+    max_queries = 2
 
 
 class CartViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
+    max_queries = {"list": 5}
 
+    @conditional(_cart_validators, private=True)
     def list(self, request):
-        cart, _ = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        fieldset = Fieldset.from_request(request)
+        if fieldset is None:
+            return Response(CartSerializer(get_cart(request.user)).data)
+        serializer = CartSerializer(context={"fieldset": fieldset})
+        cart = get_cart(request.user, prefetch_lookups(serializer))
+        return Response(CartSerializer(cart, context={"fieldset": fieldset}).data)
 
 
-class CartItemViewSet(viewsets.ModelViewSet):
+class CartItemViewSet(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     serializer_class = CartItemSerializer
     permission_classes = [permissions.IsAuthenticated]
+    max_queries = {"list": 4, "retrieve": 4}
 
     def get_queryset(self):
         cart, _ = Cart.objects.get_or_create(user=self.request.user)
-        return CartItem.objects.filter(cart=cart)
+        queryset = CartItem.objects.filter(cart=cart)
+        if self.get_fieldset() is not None:
+            return shape_queryset(queryset, self.get_serializer())
+        return with_product_relations(queryset, "product__")
 
     def perform_create(self, serializer):
         cart, _ = Cart.objects.get_or_create(user=self.request.user)
@@ -91,16 +369,61 @@ class CartItemViewSet(viewsets.ModelViewSet):
         else:
             serializer.save(cart=cart)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(SparseFieldsetViewMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
+    max_queries = {"list": 4, "retrieve": 4}
+
+    def is_archived(self):
+        # Архив (shop.retention) только читается: ?archived=true у списка и выгрузки,
+        # retrieve ищет там сам, если заказа нет среди текущих
+        if getattr(self, "_archived", False):
+            return True
+        return self.action in ("list", "export", "export_all") and self.request.query_params.get("archived") in ("1", "true")
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        model, item_model = (ArchivedOrder, ArchivedOrderItem) if self.is_archived() else (Order, OrderItem)
+        queryset = model.objects.filter(user=self.request.user)
+        if self.get_fieldset() is not None:
+            return shape_queryset(queryset, self.get_serializer())
+        return queryset.prefetch_related(order_items_prefetch(item_model))
 
     def get_serializer_class(self):
         if self.action == "create":
             return OrderCreateSerializer
-        return OrderSerializer
+        return ArchivedOrderSerializer if self.is_archived() else OrderSerializer
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != "retrieve" or self.is_archived():
+                raise
+        self._archived = True
+        return super().get_object()
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        return export_orders(self.get_queryset(), _export_format(request))
+
+    @action(detail=False, methods=["get"], url_path="export-all", permission_classes=[permissions.IsAdminUser])
+    def export_all(self, request):
+        # Все заказы для персонала, фильтры — как list_filter в админке, плюс ?user=<id>
+        fmt = _export_format(request)
+        model = ArchivedOrder if self.is_archived() else Order
+        queryset = model.objects.all()
+        for field in ("status", "delivery_method"):
+            value = request.query_params.get(field)
+            if value:
+                choices = dict(model._meta.get_field(field).choices)
+                if value not in choices:
+                    raise ValidationError({field: f"Допустимые значения: {', '.join(choices)}"})
+                queryset = queryset.filter(**{field: value})
+        if request.query_params.get("user"):
+            try:
+                queryset = queryset.filter(user_id=int(request.query_params["user"]))
+            except ValueError:
+                raise ValidationError({"user": "Должно быть целым числом"})
+        return export_orders(queryset, fmt)
 
     @action(detail=False, methods=["post"])
     def from_cart(self, request):
@@ -113,6 +436,7 @@ class OrderViewSet(viewsets.ModelViewSet):
 
         with transaction.atomic():
             product_ids = list(items.values_list("product_id", flat=True))
+            # select_for_update роутится как запись — блокировки всегда на primary
             products = Product.objects.select_for_update().filter(id__in=product_ids)
             products_map = {p.id: p for p in products}
 
@@ -147,6 +471,7 @@ class OrderViewSet(viewsets.ModelViewSet):
             )
 
             total = 0
+            stock = {}
             for item in items:
                 order_item = order.items.create(
                     product=item.product,
@@ -155,14 +480,91 @@ class OrderViewSet(viewsets.ModelViewSet):
                 total += order_item.subtotal
 
                 Product.objects.filter(id=item.product_id).update(
-                    quantity=F("quantity") - item.quantity
+                    quantity=F("quantity") - item.quantity, updated_at=timezone.now()
                 )
+                # Строки заблокированы select_for_update — новый остаток известен без перечитывания
+                product = products_map[item.product_id]
+                product.quantity -= item.quantity
+                stock[product.id] = product.quantity
 
             order.total_amount = total
             order.save(update_fields=["total_amount"])
+            record_order(order)
 
             items.delete()
+            # update() не шлёт сигналов: остатки видны в кэшах списков, фасетов и товаров — сбрасываем все
+            transaction.on_commit(bump_catalog_version)
+            # NOTIFY уходит подписчикам при коммите, при откате — нет
+            notify_stock(stock)
 
         return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
 
 
+class AnalyticsViewSet(viewsets.ViewSet):
+    """Staff dashboards: ?date_from=&date_to= (YYYY-MM-DD, last 30 days by default)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def _period(self, request):
+        try:
+            last = date.fromisoformat(request.query_params["date_to"]) if "date_to" in request.query_params \
+                else timezone.localdate()
+            first = date.fromisoformat(request.query_params["date_from"]) if "date_from" in request.query_params \
+                else last - timedelta(days=DEFAULT_PERIOD_DAYS - 1)
+        except ValueError:
+            raise ValidationError({"detail": "date_from/date_to: формат YYYY-MM-DD"})
+        if first > last:
+            raise ValidationError({"date_from": "Позже date_to"})
+        if (last - first).days >= MAX_PERIOD_DAYS:
+            raise ValidationError({"date_from": f"Период не больше {MAX_PERIOD_DAYS} дней"})
+        return first, last
+
+    def _top(self, request, dimension):
+        first, last = self._period(request)
+        order_by = request.query_params.get("order_by", "units")
+        if order_by not in ("units", "revenue", "orders"):
+            raise ValidationError({"order_by": "Допустимые значения: units, revenue, orders"})
+        try:
+            limit = int(request.query_params.get("limit", DEFAULT_TOP_LIMIT))
+        except ValueError:
+            raise ValidationError({"limit": "Должно быть целым числом"})
+        limit = min(max(limit, 1), MAX_TOP_LIMIT)
+        return Response({
+            "date_from": first, "date_to": last,
+            "results": top(dimension, first, last, order_by, limit),
+        })
+
+    @action(detail=False, methods=["get"])
+    def daily(self, request):
+        first, last = self._period(request)
+        return Response({"date_from": first, "date_to": last, "results": daily_totals(first, last)})
+
+    @action(detail=False, methods=["get"])
+    def products(self, request):
+        return self._top(request, "products")
+
+    @action(detail=False, methods=["get"])
+    def categories(self, request):
+        return self._top(request, "categories")
+
+    @action(detail=False, methods=["get"])
+    def brands(self, request):
+        return self._top(request, "brands")
+
+
+async def stock_stream(request):
+    """``GET /websec/products/stock-stream/?ids=1,2,3`` — server-sent events with stock levels (ASGI only)."""
+    if not isinstance(request, ASGIRequest):
+        # Под WSGI поток занял бы рабочий процесс целиком
+        return JsonResponse({"detail": "Поток остатков доступен только через ASGI"}, status=501)
+    try:
+        ids = parse_ids(v for v in request.GET.get("ids", "").split(",") if v.strip())
+    except ValueError:
+        return JsonResponse({"ids": "Ожидаются целые положительные id"}, status=400)
+    if not ids or len(ids) > stock_stream_max_ids():
+        return JsonResponse({"ids": f"От 1 до {stock_stream_max_ids()} id"}, status=400)
+
+    response = StreamingHttpResponse(stock_events(ids), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # nginx не должен буферизовать события
+    response["X-Accel-Buffering"] = "no"
+    return response
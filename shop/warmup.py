@@ -0,0 +1,64 @@
+# shop/warmup.py
+"""
+Catalog cache warm-up: requests the hottest list/facet URLs through the normal
+request stack, so the cache keys are exactly the ones real clients hit.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import Client
+
+from .cache import force_refresh
+from .models import Brand, Category, Product
+
+WARM_ORDERINGS = ["-units_sold_30d", "price", "-price"]
+
+
+def warm_urls(top=10, prefix="/websec"):
+    """Brand/category lists, the default product list and facets, common orderings,
+    the ``top`` categories and brands by active products and their ``top`` combinations."""
+    active = Q(products__is_active=True)
+    categories = Category.objects.annotate(n=Count("products", filter=active)).order_by("-n", "id")
+    brands = Brand.objects.annotate(n=Count("products", filter=active)).order_by("-n", "id")
+    pairs = (
+        Product.objects.filter(is_active=True).values("category_id", "brand_id")
+        .annotate(n=Count("id")).order_by("-n", "category_id", "brand_id")
+    )
+
+    urls = [f"{prefix}/brands/", f"{prefix}/categories/", f"{prefix}/products/", f"{prefix}/products/facets/"]
+    urls += [f"{prefix}/products/?ordering={ordering}" for ordering in WARM_ORDERINGS]
+    for name, ids in (("category", categories.values_list("id", flat=True)[:top]),
+                      ("brand", brands.values_list("id", flat=True)[:top])):
+        for pk in ids:
+            urls += [f"{prefix}/products/?{name}={pk}", f"{prefix}/products/facets/?{name}={pk}"]
+    urls += [f"{prefix}/products/?brand={p['brand_id']}&category={p['category_id']}" for p in pairs[:top]]
+    return urls
+
+
+def warm(urls, host="localhost", secure=False, workers=4, refresh=False):
+    """Fetches ``urls`` in ``workers`` threads (``1`` — in this thread); yields (url, status code, seconds)."""
+
+    def fetch(url):
+        client = Client(SERVER_NAME=host)
+        start = time.perf_counter()
+        if refresh:
+            with force_refresh():
+                response = client.get(url, secure=secure)
+        else:
+            response = client.get(url, secure=secure)
+        return url, response.status_code, time.perf_counter() - start
+
+    def fetch_in_thread(url):
+        try:
+            return fetch(url)
+        finally:
+            # Потоки пула — не запросы Django: соединение закрываем сами
+            connection.close()
+
+    if workers == 1:
+        yield from map(fetch, urls)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(fetch_in_thread, urls)
@@ -9,6 +9,7 @@ class User(AbstractUser):
     email = models.EmailField(unique=True )
     pending_email = models.EmailField(null=True, blank=True) 
     wishlist = models.ManyToManyField(Product, blank=True, related_name='products')
+    updated_at = models.DateTimeField(auto_now=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [ 'first_name', 'last_name', 'username']
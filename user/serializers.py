@@ -1,5 +1,6 @@
 from django.contrib.auth import get_user_model, authenticate
 from rest_framework import serializers
+from e_commerce.instrumentation import InstrumentedSerializerMixin
 
 User = get_user_model()
 
@@ -41,7 +42,7 @@ class LoginSerializer(serializers.Serializer):
         return attrs
 
 
-class MeSerializer(serializers.ModelSerializer):
+class MeSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ("id", "first_name", "last_name", "email")
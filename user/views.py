@@ -21,7 +21,10 @@ from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.http import require_GET
 from axes.handlers.proxy import AxesProxyHandler
 from axes.utils import reset as axes_reset
-from shop.models import Cart
+from shop.cache import get_catalog_changed_at, get_catalog_version
+from shop.queries import get_cart, cart_version
+from e_commerce.conditional import conditional, version_tag
+from e_commerce.instrumentation import query_budget
 
 User = get_user_model()
 acc_active_token = TokenGenerator()
@@ -187,8 +190,7 @@ class LoginView(APIView):
         refresh = RefreshToken.for_user(user)
         access = str(refresh.access_token)
         refresh_str = str(refresh)
-        cart, _ = Cart.objects.get_or_create(user = user)
-        cart_data = CartSerializer(cart).data
+        cart_data = CartSerializer(get_cart(user)).data
         resp = JsonResponse(
             {
                 "detail": "OK",
@@ -252,11 +254,22 @@ class LogoutView(APIView):
 class MeView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def _validators(self, request):
+        cart = cart_version(request.user)
+        if cart is None:
+            return None
+        user = request.user
+        return (
+            version_tag("me", user.pk, user.updated_at, cart[0], cart[1], get_catalog_version()),
+            max(user.updated_at, cart[1], get_catalog_changed_at()),
+        )
+
+    @query_budget(5)
+    @conditional(_validators, private=True)
     def get(self, request):
         user = request.user
         user_data = MeSerializer(user).data
-        cart = Cart.objects.get_or_create(user=user)[0]
-        cart_data = CartSerializer(cart).data  
+        cart_data = CartSerializer(get_cart(user)).data
         return JsonResponse({
             'user': user_data,
             'cart': cart_data